@@ -1,7 +1,9 @@
-import mido
 import time
 from pynput import keyboard
 import threading
+import argparse
+import midi_output
+from midi_output import NOTE_ON_STATUS, NOTE_OFF_STATUS, NoteState
 
 # --- MIDI 配置 ---
 midi_channel = 0
@@ -30,19 +32,18 @@ custom_melody_sequence = [
 
 
 # --- 全局变量 ---
+midi_backend = midi_output.MidoBackend.name # 启动时通过 --backend 选择的输出后端
 midi_port = None
 current_sequence_index = 0 # 跟踪当前播放到旋律序列的哪个元素
 last_notes_played = []     # 存储上一个播放的音符/和弦，用于在下一个元素播放前关闭
 
-# 修复：初始化 active_notes 字典
-# 它应该在全局作用域或者 start_midi_stepper 函数内部作为全局变量声明
-active_notes = {} 
+# 每个通道 128 个音符槽的引用计数，重叠的和弦不会互相切断
+note_state = NoteState()
 current_pressed_keys = set() # 用于跟踪当前按下的键，避免重复触发 on_press
 
 
 # --- MIDI 消息发送函数 ---
 def send_note_on(note_or_chord):
-    global active_notes # 确保函数能够修改全局的 active_notes
     if midi_port and not midi_port.closed:
         notes_to_play = []
         if isinstance(note_or_chord, int): # 如果是单个音符
@@ -54,14 +55,12 @@ def send_note_on(note_or_chord):
 
         for note in notes_to_play:
             if note is not None: # 确保不是 None
-                msg_on = mido.Message('note_on', channel=midi_channel, note=note, velocity=velocity)
-                midi_port.send(msg_on)
-                # print(f"发送 Note On: {msg_on}")
-                active_notes[note] = True # 标记为激活
+                midi_port.send_buffer(bytes((NOTE_ON_STATUS | midi_channel, note, velocity)))
+                # print(f"发送 Note On: {note}")
+                note_state.note_on(midi_channel, note) # 引用计数 +1
         return notes_to_play # 返回实际发送的音符列表
 
 def send_note_off(note_or_chord):
-    global active_notes # 确保函数能够修改全局的 active_notes
     if midi_port and not midi_port.closed:
         notes_to_stop = []
         if isinstance(note_or_chord, int):
@@ -70,17 +69,16 @@ def send_note_off(note_or_chord):
             notes_to_stop.extend(note_or_chord)
         
         for note in notes_to_stop:
-            if note is not None and note in active_notes: # 确保不是 None 且在激活列表中
-                msg_off = mido.Message('note_off', channel=midi_channel, note=note, velocity=0)
-                midi_port.send(msg_off)
-                # print(f"发送 Note Off: {msg_off}")
-                del active_notes[note]
+            # 引用计数归零时才真正发送 Note Off
+            if note is not None and note_state.note_off(midi_channel, note):
+                midi_port.send_buffer(bytes((NOTE_OFF_STATUS | midi_channel, note, 0)))
+                # print(f"发送 Note Off: {note}")
 
 
 # --- 键盘监听函数 ---
 def on_press(key):
     """当键盘键被按下时调用"""
-    global current_sequence_index, last_notes_played, active_notes, current_pressed_keys # 确保所有全局变量都被声明
+    global current_sequence_index, last_notes_played, current_pressed_keys # 确保所有全局变量都被声明
 
     if midi_port is None or midi_port.closed:
         print("MIDI 端口未打开或已关闭。")
@@ -90,9 +88,8 @@ def on_press(key):
         # 按下 'Esc' 键退出
         if key == keyboard.Key.esc:
             print("按下 'Esc' 键，退出程序。")
-            # 在退出前关闭所有可能还在响的音符
-            for note in list(active_notes.keys()): # 遍历拷贝，因为可能会修改字典
-                send_note_off(note)
+            # 在退出前关闭所有可能还在响的音符 (每个通道一条 All Notes Off)
+            midi_port.all_notes_off(note_state)
             return False # 返回 False 停止监听器
 
         # 忽略重复按键事件 (当按住键时，pynput 会持续触发 on_press)
@@ -147,16 +144,14 @@ def on_release(key):
 
 # --- 主程序启动函数 ---
 def start_midi_stepper():
-    global midi_port, active_notes # 确保能够修改全局变量 active_notes
-
-    # 再次强调：active_notes 在全局作用域已经初始化，这里只是为了代码清晰再次提及
-    # 如果你在函数内部初始化它，就需要在 on_press/on_release 里面加 global active_notes
+    global midi_port
 
     try:
-        print("Available MIDI output ports:", mido.get_output_names())
+        output_names = midi_output.output_names(midi_backend)
+        print(f"Available MIDI output ports ({midi_backend}):", output_names)
 
         port_to_open_name = None
-        for name in mido.get_output_names():
+        for name in output_names:
             # 尝试匹配 LoopMIDI, Python 或 RtMidi 创建的端口
             if "loopmidi" in name.lower() or "python" in name.lower() or "rtmidi" in name.lower():
                 port_to_open_name = name
@@ -164,15 +159,15 @@ def start_midi_stepper():
         
         if port_to_open_name:
             try:
-                midi_port = mido.open_output(port_to_open_name)
+                midi_port = midi_output.open_output(midi_backend, port_to_open_name)
                 print(f"Successfully opened MIDI port: '{port_to_open_name}'")
             except Exception as e:
                 print(f"Failed to open port '{port_to_open_name}': {e}")
                 print("This might happen if the port is already in use by another application.")
                 # 尝试打开第一个可用端口作为备用
-                if mido.get_output_names():
-                    midi_port = mido.open_output(mido.get_output_names()[0])
-                    print(f"Opened first available port: '{mido.get_output_names()[0]}'")
+                if output_names:
+                    midi_port = midi_output.open_output(midi_backend, output_names[0])
+                    print(f"Opened first available port: '{output_names[0]}'")
                 else:
                     print("No MIDI output ports found. Please ensure you have a MIDI driver (e.g., LoopMIDI) installed.")
                     return
@@ -196,12 +191,15 @@ def start_midi_stepper():
         print(f"程序启动时发生错误: {e}")
     finally:
         if midi_port and not midi_port.closed:
-            # 程序退出前，确保关闭所有可能还在响的音符
-            for note in list(active_notes.keys()): # 遍历拷贝，因为可能会修改字典
-                send_note_off(note)
+            # 程序退出前，确保关闭所有可能还在响的音符 (每个通道一条 All Notes Off)
+            midi_port.all_notes_off(note_state)
             midi_port.close()
             print("MIDI 端口已关闭。")
+            print(midi_port.latency_report())
         print("程序已退出。")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="键盘步进旋律/和弦播放器")
+    midi_output.add_backend_argument(parser)
+    midi_backend = parser.parse_args().backend
     start_midi_stepper()
\ No newline at end of file
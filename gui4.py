@@ -1,10 +1,20 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import mido
 import time
 from pynput import keyboard
 import threading
-import json
+import argparse
+import midi_output
+import midi_reader
+import midi_tool
+import sequence_cache
+import sequence_io
+from packed_sequence import PackedSequence
+from step_engine import StepEngine, compile_sequence, element_notes
+from sequence_view import VirtualSequenceList
+import sequence_model
+from phrase_index import PhraseIndex, parse_phrase
+from measure_index import MeasureIndex, parse_bar_beat
 
 # --- MIDI Configuration ---
 midi_channel = 0 # Default MIDI channel (0-15)
@@ -12,13 +22,20 @@ velocity = 90    # Default velocity
 midi_program = 0 # Default MIDI program (0 for Acoustic Grand Piano)
 
 # --- Global Variables ---
-midi_port = None
-current_sequence_index = 0
-last_notes_played = []
-active_notes = {}
+midi_backend = midi_output.MidoBackend.name # Output backend chosen at startup (--backend)
 current_pressed_keys = set()
 
-custom_melody_sequence = []
+custom_melody_sequence = sequence_model.SequenceModel()
+
+UI_REFRESH_MS = 16        # Cursor/status refresh period (~60 Hz), independent of how fast keys are hit
+LATENCY_REFRESH_MS = 500 # Refresh period of the stepping latency display
+SEQUENCE_FILETYPES = [("JSON files", "*.json"), ("Binary sequence files", "*" + sequence_io.BINARY_SUFFIX)]
+# Keys that seek instead of stepping while the listener runs
+SEEK_KEYS = {
+    keyboard.Key.page_up: lambda app: app.step_bar(-1),
+    keyboard.Key.page_down: lambda app: app.step_bar(1),
+    keyboard.Key.home: lambda app: app.seek_cursor(0),
+}
 
 # --- Note Name Conversion Helper ---
 def midinote_to_name(midinote):
@@ -37,134 +54,103 @@ def midinote_to_name(midinote):
 
     return f"{note_name}{octave}"
 
-# --- MIDI Message Sending Helper Functions ---
-def send_note_on(note_or_chord):
-    """Sends Note On message(s)."""
-    global active_notes
-    if midi_port and not midi_port.closed:
-        notes_to_play = []
-        if isinstance(note_or_chord, int):
-            notes_to_play.append(note_or_chord)
-        elif isinstance(note_or_chord, list) or isinstance(note_or_chord, tuple):
-            notes_to_play.extend(note_or_chord)
-        else:
-            return [] # Handle empty list as rest
-
-        for note in notes_to_play:
-            if note is not None:
-                msg_on = mido.Message('note_on', channel=midi_channel, note=note, velocity=velocity)
-                midi_port.send(msg_on)
-                active_notes[note] = True
-        return notes_to_play
-
-def send_note_off(note):
-    """Sends Note Off message."""
-    global active_notes
-    if midi_port and not midi_port.closed:
-        if note is not None and note in active_notes:
-            msg_off = mido.Message('note_off', channel=midi_channel, note=note, velocity=0)
-            midi_port.send(msg_off)
-            del active_notes[note]
-
-def send_program_change(program_number):
-    """Sends a Program Change message to change the instrument."""
-    global midi_program
-    if midi_port and not midi_port.closed:
-        if 0 <= program_number <= 127: # MIDI program numbers are 0-127
-            msg_pc = mido.Message('program_change', channel=midi_channel, program=program_number)
-            midi_port.send(msg_pc)
-            midi_program = program_number # Update the global program number
-            print(f"Sent Program Change to instrument: {program_number}")
-        else:
-            print(f"Warning: Invalid MIDI program number {program_number}. Must be between 0 and 127.")
-
-# --- MIDI File Conversion Function ---
-def midi_file_to_sequence(midi_filepath, track_index=0, quantization_level=0.25):
+def format_sequence_item(item):
+    """Formats one sequence element for the list (e.g. 'Chord: [60, 64] (C4, E4)')."""
+    notes = element_notes(item)
+    if len(notes) == 1:
+        return f"Note: {notes[0]} ({midinote_to_name(notes[0])})"
+    elif notes:
+        chord_names = [midinote_to_name(n) for n in notes]
+        return f"Chord: {list(notes)} ({', '.join(chord_names)})"
+    return "Rest"
+
+# --- Compiled Step Program ---
+compiled_program = []      # One (note_on_buffer, note_off_buffer) pair per sequence element
+
+# --- Background MIDI Import ---
+def parse_index_list(text):
+    """Parses '1, 3,5' into [1, 3, 5]; an empty string means 'all' and returns None."""
+    text = text.strip()
+    if not text:
+        return None
+    return [int(part) for part in text.split(',') if part.strip()]
+
+class ImportJob:
     """
-    Extracts note events from a MIDI file and converts them into the custom_melody_sequence format.
-    Attempts to group simultaneously occurring notes into chords.
+    Runs a midi_reader import function (read_timed_sequence / read_timed_merged_sequence) on a worker
+    thread, through the on-disk sequence cache. Subclasses override work() for other background imports.
+    Progress and the outcome are left in plain attributes that the Tk thread polls;
+    the worker never touches Tk, and the result is only swapped in by the Tk thread.
     """
-    try:
-        mid = mido.MidiFile(midi_filepath)
-        
-        if not mid.tracks:
-            print("MIDI file contains no tracks.")
-            return []
-
-        if track_index >= len(mid.tracks):
-            print(f"Warning: Track index {track_index} does not exist. Using the first track (index 0).")
-            track_index = 0
-
-        track = mid.tracks[track_index]
-        ticks_per_beat = mid.ticks_per_beat
-        current_tempo = mido.bpm2tempo(120) 
-
-        for msg in mid.tracks[0]:
-            if msg.type == 'set_tempo':
-                current_tempo = msg.tempo
-                break
-
-        active_note_start_beats = {}
-        note_events_in_beats = []
-        
-        current_time_ticks = 0
-
-        for msg in track:
-            current_time_ticks += msg.time
-            current_time_beats = current_time_ticks / ticks_per_beat
-
-            if msg.type == 'note_on' and msg.velocity > 0:
-                active_note_start_beats[msg.note] = current_time_beats
-            elif msg.type == 'note_off' or (msg.type == 'note_on' and msg.velocity == 0):
-                if msg.note in active_note_start_beats:
-                    start_beats = active_note_start_beats.pop(msg.note)
-                    note_events_in_beats.append((start_beats, current_time_beats, msg.note))
-        
-        note_events_in_beats.sort(key=lambda x: x[0])
-
-        sequence = []
-        last_quantized_time_processed = -float('inf')
-        notes_for_current_quantized_time = set()
-
-        for start_beats, _, note in note_events_in_beats:
-            quantized_start_beats = round(start_beats / quantization_level) * quantization_level
-
-            if quantized_start_beats > last_quantized_time_processed:
-                if notes_for_current_quantized_time:
-                    if len(notes_for_current_quantized_time) == 1:
-                        sequence.append(list(notes_for_current_quantized_time)[0])
-                    else:
-                        sequence.append(sorted(list(notes_for_current_quantized_time)))
-                notes_for_current_quantized_time.clear()
-                
-            notes_for_current_quantized_time.add(note)
-            last_quantized_time_processed = quantized_start_beats
-        
-        if notes_for_current_quantized_time:
-            if len(notes_for_current_quantized_time) == 1:
-                sequence.append(list(notes_for_current_quantized_time)[0])
-            else:
-                sequence.append(sorted(list(notes_for_current_quantized_time)))
-
-        print(f"Successfully imported {len(sequence)} elements from '{midi_filepath}'.")
+    def __init__(self, filepath, reader=midi_reader.read_timed_sequence, **options):
+        self.filepath = filepath
+        self.reader = reader
+        self.options = options
+        self.cancel_event = threading.Event()
+        self.progress = None # Latest (stage, done, total)
+        self.result = None
+        self.error = None
+        self.done = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _report(self, stage, done, total):
+        self.progress = (stage, done, total)
+
+    def work(self):
+        return sequence_cache.cached_read(self.reader, self.filepath, progress=self._report,
+                                          cancel_event=self.cancel_event, **self.options)
+
+    def _run(self):
+        try:
+            self.result = self.work()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+
+class InstrumentScanJob(ImportJob):
+    """Scans a multi-instrument file once into midi_tool.InstrumentParts, kept in memory for the picker."""
+    def work(self):
+        return midi_tool.scan_instrument_parts(self.filepath, self._report, self.cancel_event)
+
+class PartImportJob(ImportJob):
+    """Builds the sequence of one (channel, program) part of a scanned file straight from memory."""
+    def __init__(self, parts, key):
+        super().__init__(parts.midi_file_path)
+        self.parts = parts
+        self.key = key
+
+    def work(self):
+        items, timing = self.parts.read_sequence(self.key, progress=self._report, cancel_event=self.cancel_event)
+        sequence = PackedSequence(items)
+        sequence_cache.attach_timing(sequence, timing)
         return sequence
 
-    except FileNotFoundError:
-        messagebox.showerror("File Error", f"MIDI file '{midi_filepath}' not found.")
-        return []
-    except Exception as e:
-        messagebox.showerror("MIDI Parsing Error", f"An error occurred while parsing the MIDI file: {e}")
-        print(f"MIDI Parsing Error Details: {e}")
-        return []
-
 # --- GUI Application Class ---
 class MidiSequencerApp:
     def __init__(self, master):
         self.master = master
         master.title("MIDI Sequencer")
 
+        self.engine = None # StepEngine owning the MIDI port while stepping
+        self.shown_step = None # engine.last_step currently drawn in the window
+        self.pending_status = None # Latest status text from the listener thread, drawn by refresh_ui
+        self.import_job = None # ImportJob while a MIDI import runs in the background
+        self.next_index = 0 # Element the next key press plays (set by seek_cursor)
+        self.phrase_indexes = {} # interval mode -> PhraseIndex, built on the first search in that mode
+        self.search_results = None # Start indices of the last search; None after an edit
+        self.search_position = -1 # Result the cursor was last moved to
+        self.measure_index = MeasureIndex(custom_melody_sequence).subscribe() # Bar/beat seeking
+
         # UI Elements
-        self.melody_listbox = tk.Listbox(master, height=15, width=60)
+        self.melody_listbox = VirtualSequenceList(master, format_sequence_item, rows=15, width=60,
+                                                  empty_text="Sequence is empty. Add notes/chords or import MIDI.")
         self.melody_listbox.pack(pady=10)
 
         # Frame for adding notes/chords
@@ -177,6 +163,34 @@ class MidiSequencerApp:
         tk.Button(add_frame, text="Add", command=self.add_note_or_chord).pack(side=tk.LEFT)
         tk.Button(add_frame, text="Delete Selected", command=self.delete_selected).pack(side=tk.LEFT, padx=5)
 
+        # Phrase search
+        search_frame = tk.Frame(master)
+        search_frame.pack(pady=5)
+        tk.Label(search_frame, text="Find phrase (e.g., 60 62 64,67 rest):").pack(side=tk.LEFT)
+        self.search_entry = tk.Entry(search_frame, width=25)
+        self.search_entry.pack(side=tk.LEFT, padx=5)
+        self.search_entry.bind("<Return>", lambda event: self.find_phrase())
+        self.search_interval_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(search_frame, text="Intervals (any key)", variable=self.search_interval_var,
+                       command=self.clear_search_results).pack(side=tk.LEFT)
+        tk.Button(search_frame, text="Find", command=self.find_phrase).pack(side=tk.LEFT, padx=2)
+        tk.Button(search_frame, text="Next", command=self.next_search_result).pack(side=tk.LEFT, padx=2)
+        self.search_label = tk.Label(master, text="", anchor=tk.W, width=60)
+        self.search_label.pack()
+
+        # Seek by bar/beat (hotkeys while stepping: Page Up / Page Down = previous / next bar, Home = start)
+        measure_frame = tk.Frame(master)
+        measure_frame.pack(pady=2)
+        tk.Label(measure_frame, text="Go to bar[:beat] (e.g., 33 or 33:3):").pack(side=tk.LEFT)
+        self.bar_entry = tk.Entry(measure_frame, width=10)
+        self.bar_entry.pack(side=tk.LEFT, padx=5)
+        self.bar_entry.bind("<Return>", lambda event: self.seek_bar_from_gui())
+        tk.Button(measure_frame, text="Go", command=self.seek_bar_from_gui).pack(side=tk.LEFT, padx=2)
+        tk.Button(measure_frame, text="<< Bar", command=lambda: self.step_bar(-1)).pack(side=tk.LEFT, padx=2)
+        tk.Button(measure_frame, text="Bar >>", command=lambda: self.step_bar(1)).pack(side=tk.LEFT, padx=2)
+        self.position_label = tk.Label(measure_frame, text="", width=16, anchor=tk.W)
+        self.position_label.pack(side=tk.LEFT, padx=5)
+
         # --- Instrument Control ---
         instrument_frame = tk.Frame(master)
         instrument_frame.pack(pady=5)
@@ -191,8 +205,30 @@ class MidiSequencerApp:
         file_frame = tk.Frame(master)
         file_frame.pack(pady=5)
         tk.Button(file_frame, text="Import MIDI File", command=self.import_midi).pack(side=tk.LEFT, padx=5)
-        tk.Button(file_frame, text="Save Sequence (JSON)", command=self.save_sequence).pack(side=tk.LEFT, padx=5)
-        tk.Button(file_frame, text="Load Sequence (JSON)", command=self.load_sequence).pack(side=tk.LEFT, padx=5)
+        tk.Button(file_frame, text="Pick Instrument...", command=self.pick_instrument).pack(side=tk.LEFT, padx=5)
+        tk.Button(file_frame, text="Save Sequence", command=self.save_sequence).pack(side=tk.LEFT, padx=5)
+        tk.Button(file_frame, text="Load Sequence", command=self.load_sequence).pack(side=tk.LEFT, padx=5)
+
+        # Multi-track import options
+        merge_frame = tk.Frame(master)
+        merge_frame.pack(pady=2)
+        self.merge_tracks_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(merge_frame, text="Merge tracks", variable=self.merge_tracks_var).pack(side=tk.LEFT)
+        tk.Label(merge_frame, text="Tracks:").pack(side=tk.LEFT)
+        self.merge_tracks_entry = tk.Entry(merge_frame, width=12)
+        self.merge_tracks_entry.pack(side=tk.LEFT, padx=2)
+        tk.Label(merge_frame, text="Channels:").pack(side=tk.LEFT)
+        self.merge_channels_entry = tk.Entry(merge_frame, width=12)
+        self.merge_channels_entry.pack(side=tk.LEFT, padx=2)
+        tk.Label(merge_frame, text="(comma-separated, empty = all)").pack(side=tk.LEFT)
+
+        # Import progress
+        import_frame = tk.Frame(master)
+        import_frame.pack(pady=2)
+        self.import_label = tk.Label(import_frame, text="", width=45, anchor=tk.W)
+        self.import_label.pack(side=tk.LEFT)
+        self.cancel_import_button = tk.Button(import_frame, text="Cancel Import", command=self.cancel_import, state=tk.DISABLED)
+        self.cancel_import_button.pack(side=tk.LEFT, padx=5)
 
         # Controls
         control_frame = tk.Frame(master)
@@ -202,8 +238,22 @@ class MidiSequencerApp:
         self.stop_button = tk.Button(control_frame, text="Stop All Notes & Close MIDI", command=self.stop_all_notes)
         self.stop_button.pack(side=tk.LEFT, padx=5)
 
-        # Initial display
-        self.update_melody_listbox()
+        self.status_label = tk.Label(master, text="", anchor=tk.W, width=60)
+        self.status_label.pack()
+
+        # Latency display
+        latency_frame = tk.Frame(master)
+        latency_frame.pack(pady=5)
+        self.latency_label = tk.Label(latency_frame, text="", justify=tk.LEFT, font=("Courier", 9))
+        self.latency_label.pack(side=tk.LEFT)
+        self.dump_latency_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(latency_frame, text="Save latency CSV on stop", variable=self.dump_latency_var).pack(side=tk.LEFT, padx=5)
+        self.refresh_latency_label()
+        self.refresh_ui()
+
+        # Initial display; afterwards the list and the compiled program follow the model's change events
+        custom_melody_sequence.subscribe(self.on_sequence_change)
+        self.melody_listbox.set_sequence(custom_melody_sequence)
 
     def add_note_or_chord(self):
         input_str = self.note_entry.get().strip()
@@ -213,15 +263,16 @@ class MidiSequencerApp:
         try:
             if ',' in input_str:
                 notes = [int(n.strip()) for n in input_str.split(',')]
-                custom_melody_sequence.append(sorted(notes))
+                new_element = sorted(notes)
             elif input_str.lower() == 'rest' or input_str == '[]':
-                custom_melody_sequence.append([])
+                new_element = []
             else:
-                note = int(input_str)
-                custom_melody_sequence.append(note)
+                new_element = int(input_str)
+            if not all(0 <= n <= 127 for n in element_notes(new_element)):
+                raise ValueError("MIDI pitch out of range")
+            custom_melody_sequence.append(new_element)
             
             self.note_entry.delete(0, tk.END)
-            self.update_melody_listbox()
         except ValueError:
             messagebox.showerror("Input Error", "Please enter a valid MIDI pitch (integer), comma-separated chord (e.g., 60,64,67), or 'rest' / '[]' for a rest.")
         except Exception as e:
@@ -231,29 +282,124 @@ class MidiSequencerApp:
         selected_indices = self.melody_listbox.curselection()
         if not selected_indices:
             return
-        
-        for index in reversed(selected_indices):
-            if 0 <= index < len(custom_melody_sequence):
-                del custom_melody_sequence[index]
-        
-        self.update_melody_listbox()
-
-    def update_melody_listbox(self):
-        self.melody_listbox.delete(0, tk.END)
+        custom_melody_sequence.remove_indices(selected_indices)
+
+    def on_sequence_change(self, kind, start, count):
+        """
+        SequenceModel listener: patches the compiled program and the list view for the changed range only.
+        The engine always gets a fresh program list, never one that is mutated under it.
+        """
+        global compiled_program
+        if kind == sequence_model.RESET:
+            new_steps = compile_sequence(custom_melody_sequence.packed, midi_channel, velocity)
+            program = new_steps
+            self.melody_listbox.set_sequence(custom_melody_sequence)
+        elif kind == sequence_model.INSERTED:
+            new_steps = compile_sequence(custom_melody_sequence[start:start + count], midi_channel, velocity)
+            program = compiled_program[:start] + new_steps + compiled_program[start:]
+            self.melody_listbox.rows_inserted(start, count)
+        elif kind == sequence_model.REMOVED:
+            new_steps = []
+            program = compiled_program[:start] + compiled_program[start + count:]
+            self.melody_listbox.rows_removed(start, count)
+        elif kind == sequence_model.COMPACTED:
+            runs = custom_melody_sequence.removed_runs
+            new_steps = []
+            program = []
+            for kept_start, kept_stop in sequence_model.kept_ranges(runs, len(compiled_program)):
+                program += compiled_program[kept_start:kept_stop]
+            self.melody_listbox.rows_compacted(runs)
+        else: # sequence_model.REPLACED
+            new_steps = compile_sequence(custom_melody_sequence[start:start + count], midi_channel, velocity)
+            program = compiled_program[:start] + new_steps + compiled_program[start + count:]
+            self.melody_listbox.rows_replaced(start, count)
+        compiled_program = program
+        if self.engine and self.engine.running:
+            self.engine.load_program(program, new_steps)
+        if self.search_results is not None:
+            self.clear_search_results()
+
+    # --- Phrase Search ---
+    def phrase_index(self, interval):
+        """Returns the PhraseIndex for a matching mode, building it on first use; it then follows every edit."""
+        index = self.phrase_indexes.get(interval)
+        if index is None:
+            index = PhraseIndex(custom_melody_sequence, interval=interval).subscribe()
+            self.phrase_indexes[interval] = index
+        return index
+
+    def clear_search_results(self):
+        self.search_results = None
+        self.search_position = -1
+        self.search_label.config(text="")
+
+    def find_phrase(self):
+        """Finds every occurrence of the phrase in the entry and moves the cursor to the first one."""
+        text = self.search_entry.get().strip()
+        if not text:
+            return
+        try:
+            phrase = parse_phrase(text)
+        except ValueError:
+            messagebox.showerror("Input Error", "Please enter MIDI pitches separated by spaces, chords as 60,64,67 and 'rest' for rests.")
+            return
+        interval = self.search_interval_var.get()
+        self.search_results = self.phrase_index(interval).find(phrase)
+        self.search_position = -1
+        if not self.search_results:
+            self.search_label.config(text=f"'{text}' not found.")
+            return
+        self.next_search_result()
+
+    def next_search_result(self):
+        """Moves the cursor to the next search result (wrapping around)."""
+        if self.search_results is None:
+            self.find_phrase()
+            return
+        if not self.search_results:
+            return
+        self.search_position = (self.search_position + 1) % len(self.search_results)
+        index = self.search_results[self.search_position]
+        self.search_label.config(text=f"Match {self.search_position + 1}/{len(self.search_results)} at index {index}")
+        self.seek_cursor(index)
+
+    def seek_cursor(self, index):
+        """Makes element index the next one played, and shows it in the list."""
         if not custom_melody_sequence:
-            self.melody_listbox.insert(tk.END, "Sequence is empty. Add notes/chords or import MIDI.")
             return
-            
-        for i, item in enumerate(custom_melody_sequence):
-            display_text = ""
-            if isinstance(item, int):
-                display_text = f"Note: {item} ({midinote_to_name(item)})"
-            elif isinstance(item, list) and item:
-                chord_names = [midinote_to_name(n) for n in item]
-                display_text = f"Chord: {item} ({', '.join(chord_names)})"
-            elif isinstance(item, list) and not item:
-                display_text = "Rest"
-            self.melody_listbox.insert(tk.END, f"{i:03d} | {display_text}")
+        index %= len(custom_melody_sequence)
+        self.next_index = index
+        if self.engine and self.engine.running:
+            self.engine.seek(index)
+        self.melody_listbox.highlight(index)
+        self.show_position(index)
+
+    # --- Bar/Beat Seeking ---
+    def show_position(self, index):
+        position = self.measure_index.position(index)
+        self.position_label.config(text=f"Bar {position[0]}, beat {position[1] + 1:g}" if position else "")
+
+    def seek_bar_from_gui(self):
+        try:
+            bar, beat = parse_bar_beat(self.bar_entry.get())
+        except ValueError:
+            messagebox.showerror("Input Error", "Please enter a bar number, optionally with a beat (e.g., 33 or 33:3), both from 1.")
+            return
+        bar_range = self.measure_index.bar_range()
+        if bar_range is None:
+            messagebox.showinfo("Info", "The sequence has no bar positions. Import a MIDI file to seek by bar.")
+            return
+        index = self.measure_index.seek(bar, beat)
+        if index is None:
+            messagebox.showinfo("Info", f"Bar {bar} is past the end of the sequence (bars {bar_range[0]}-{bar_range[1]}).")
+            return
+        self.seek_cursor(index)
+
+    def step_bar(self, delta):
+        """Moves the cursor to the start of the previous (delta -1) or next (delta 1) bar."""
+        index = self.measure_index.step_bar(self.next_index, delta)
+        if index is not None:
+            self.seek_cursor(index)
 
     # --- New Method to Set Instrument from GUI ---
     def set_instrument_from_gui(self):
@@ -262,7 +408,8 @@ class MidiSequencerApp:
             if 0 <= program_num <= 127:
                 global midi_program
                 midi_program = program_num
-                send_program_change(midi_program) # Send program change if MIDI port is open
+                if self.engine and self.engine.running: # Send program change if MIDI port is open
+                    self.engine.set_program(midi_program)
                 messagebox.showinfo("Instrument Set", f"Instrument set to program: {midi_program}")
             else:
                 messagebox.showerror("Input Error", "MIDI program number must be between 0 and 127.")
@@ -270,50 +417,126 @@ class MidiSequencerApp:
             messagebox.showerror("Input Error", "Please enter a valid integer for the instrument program.")
 
     def import_midi(self):
+        if self.import_job:
+            messagebox.showinfo("Info", "A MIDI import is already running.")
+            return
+        if self.merge_tracks_var.get():
+            try:
+                options = dict(reader=midi_reader.read_timed_merged_sequence,
+                               tracks=parse_index_list(self.merge_tracks_entry.get()),
+                               channels=parse_index_list(self.merge_channels_entry.get()))
+            except ValueError:
+                messagebox.showerror("Input Error", "Tracks and channels must be comma-separated integers.")
+                return
+        else:
+            options = {}
         filepath = filedialog.askopenfilename(filetypes=[("MIDI files", "*.mid")])
         if filepath:
-            try:
-                new_sequence = midi_file_to_sequence(filepath)
-                if new_sequence is not None:
-                    global custom_melody_sequence
-                    custom_melody_sequence = new_sequence
-                    self.update_melody_listbox()
-                    messagebox.showinfo("Import Successful", f"Imported {len(new_sequence)} elements from {filepath}.")
-            except Exception as e:
-                messagebox.showerror("Import Failed", f"Could not import MIDI file: {e}")
+            self.start_import_job(ImportJob(filepath, **options), f"Importing {filepath}...")
+
+    def start_import_job(self, job, text):
+        self.import_job = job
+        job.start()
+        self.import_label.config(text=text)
+        self.cancel_import_button.config(state=tk.NORMAL)
+
+    def pick_instrument(self):
+        """Scans a multi-instrument MIDI file in the background, then lets the user import one part from memory."""
+        if self.import_job:
+            messagebox.showinfo("Info", "A MIDI import is already running.")
+            return
+        filepath = filedialog.askopenfilename(filetypes=[("MIDI files", "*.mid")])
+        if filepath:
+            self.start_import_job(InstrumentScanJob(filepath), f"Scanning instruments in {filepath}...")
+
+    def show_part_picker(self, parts):
+        """Lists the (channel, program) parts of a scanned file; the chosen one is imported without temp files."""
+        counts = parts.note_counts()
+        if not counts:
+            messagebox.showinfo("Pick Instrument", f"No instrument parts (channels with a Program Change) in {parts.midi_file_path}.")
+            return
+        dialog = tk.Toplevel(self.master)
+        dialog.title("Pick Instrument")
+        tk.Label(dialog, text=parts.midi_file_path, anchor=tk.W).pack(fill=tk.X, padx=5, pady=2)
+        listbox = tk.Listbox(dialog, width=45, height=min(len(counts), 16))
+        for (channel, program), note_count in counts:
+            listbox.insert(tk.END, f"Channel {channel}, program {program}: {note_count} notes")
+        listbox.selection_set(0)
+        listbox.pack(padx=5, pady=5)
+
+        def import_part(event=None):
+            selected = listbox.curselection()
+            if not selected:
+                return
+            if self.import_job:
+                messagebox.showinfo("Info", "A MIDI import is already running.", parent=dialog)
+                return
+            (channel, program), _ = counts[selected[0]]
+            dialog.destroy()
+            self.start_import_job(PartImportJob(parts, (channel, program)),
+                                  f"Importing channel {channel}, program {program}...")
+
+        listbox.bind("<Double-Button-1>", import_part)
+        tk.Button(dialog, text="Import", command=import_part).pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Button(dialog, text="Cancel", command=dialog.destroy).pack(side=tk.RIGHT, padx=5, pady=5)
+
+    def cancel_import(self):
+        if self.import_job:
+            self.import_job.cancel()
+            self.import_label.config(text="Cancelling import...")
+
+    def poll_import(self):
+        """Shows the import progress and, once the worker is done, swaps the result in (Tk thread only)."""
+        job = self.import_job
+        if job.progress:
+            stage, done, total = job.progress
+            label = "Messages parsed" if stage == "messages" else "Notes grouped"
+            self.import_label.config(text=f"{label}: {done}" if total is None else f"{label}: {done}/{total}")
+        if not job.done:
+            return
+        self.import_job = None
+        self.cancel_import_button.config(state=tk.DISABLED)
+        if isinstance(job.error, midi_reader.ImportCancelled):
+            self.import_label.config(text="Import cancelled.")
+        elif isinstance(job.error, FileNotFoundError):
+            self.import_label.config(text="")
+            messagebox.showerror("File Error", f"MIDI file '{job.filepath}' not found.")
+        elif job.error is not None:
+            self.import_label.config(text="")
+            messagebox.showerror("MIDI Parsing Error", f"An error occurred while parsing the MIDI file: {job.error}")
+            print(f"MIDI Parsing Error Details: {job.error}")
+        elif isinstance(job, InstrumentScanJob):
+            self.import_label.config(text=f"Found {len(job.result.parts)} instrument parts.")
+            self.show_part_picker(job.result)
+        else:
+            custom_melody_sequence.reset(job.result)
+            self.import_label.config(text=f"Imported {len(job.result)} elements.")
+            messagebox.showinfo("Import Successful", f"Imported {len(job.result)} elements from {job.filepath}.")
 
     def save_sequence(self):
-        filepath = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
+        filepath = filedialog.asksaveasfilename(defaultextension=".json", filetypes=SEQUENCE_FILETYPES)
         if filepath:
             try:
-                with open(filepath, 'w') as f:
-                    json.dump(custom_melody_sequence, f, indent=4)
+                sequence_io.save_sequence(filepath, custom_melody_sequence.packed)
                 messagebox.showinfo("Save Successful", "Sequence saved.")
             except Exception as e:
                 messagebox.showerror("Save Failed", f"Could not save sequence: {e}")
 
     def load_sequence(self):
-        filepath = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        filepath = filedialog.askopenfilename(filetypes=SEQUENCE_FILETYPES)
         if filepath:
             try:
-                with open(filepath, 'r') as f:
-                    loaded_sequence = json.load(f)
-                    if all(isinstance(item, int) or (isinstance(item, list) and all(isinstance(n, int) for n in item)) for item in loaded_sequence):
-                        global custom_melody_sequence
-                        custom_melody_sequence = loaded_sequence
-                        self.update_melody_listbox()
-                        messagebox.showinfo("Load Successful", "Sequence loaded.")
-                    else:
-                        messagebox.showerror("Load Failed", "JSON file has incorrect format or unexpected data types.")
-            except json.JSONDecodeError:
-                messagebox.showerror("Load Failed", "Not a valid JSON file.")
+                custom_melody_sequence.reset(sequence_io.load_sequence(filepath))
+                messagebox.showinfo("Load Successful", "Sequence loaded.")
+            except ValueError as e: # Includes sequence_io.SequenceFormatError with the line/column of the problem
+                messagebox.showerror("Load Failed", str(e))
             except Exception as e:
                 messagebox.showerror("Load Failed", f"Could not load sequence: {e}")
 
     def start_keyboard_listener(self):
-        global midi_port, current_sequence_index, last_notes_played, active_notes, current_pressed_keys
+        global current_pressed_keys
 
-        if midi_port and not midi_port.closed:
+        if self.engine and self.engine.running:
             messagebox.showinfo("Info", "MIDI listener is already running.")
             return
 
@@ -322,31 +545,27 @@ class MidiSequencerApp:
             return
 
         try:
-            print("Attempting to open MIDI port...")
-            port_to_open_name = None
-            for name in mido.get_output_names():
-                if "loopmidi" in name.lower() or "python" in name.lower() or "rtmidi" in name.lower():
-                    port_to_open_name = name
-                    break
+            print(f"Attempting to open MIDI port ({midi_backend} backend)...")
+            port = midi_output.open_output(midi_backend)
             
-            if port_to_open_name:
-                midi_port = mido.open_output(port_to_open_name)
-                print(f"Successfully opened MIDI port: '{port_to_open_name}'")
+            if port:
+                print(f"Successfully opened MIDI port: '{port.port_name}'")
+                self.engine = StepEngine(port, compiled_program, midi_channel)
+                self.engine.seek(self.next_index)
+                self.shown_step = None
                 # --- Send initial program change when port opens ---
-                send_program_change(midi_program) 
+                self.engine.set_program(midi_program)
                 # --- End send initial program change ---
+                self.engine.start()
             else:
                 messagebox.showerror("Error", "Could not find LoopMIDI or another suitable virtual MIDI port.\nPlease ensure LoopMIDI is running and a virtual port is created.")
                 return
 
-            current_sequence_index = 0
-            last_notes_played = []
-            active_notes = {}
             current_pressed_keys = set()
 
             self.listener_thread = threading.Thread(target=self._run_listener, daemon=True)
             self.listener_thread.start()
-            messagebox.showinfo("Info", "Keyboard listener started.\nPress any keyboard key in the program window to step through.\nPress 'Esc' to stop the listener.")
+            messagebox.showinfo("Info", "Keyboard listener started.\nPress any keyboard key in the program window to step through.\nPage Up / Page Down jump to the previous / next bar, Home to the start.\nPress 'Esc' to stop the listener.")
 
         except Exception as e:
             messagebox.showerror("MIDI Port Error", f"Could not open MIDI port: {e}")
@@ -361,73 +580,105 @@ class MidiSequencerApp:
         self.master.after(100, self.stop_all_notes)
 
     def on_listener_press(self, key):
-        """pynput callback, runs in listener thread."""
-        global current_sequence_index, last_notes_played, active_notes, current_pressed_keys
+        """pynput callback, runs in listener thread. Only queues the step for the sender thread."""
+        start_ns = time.perf_counter_ns()
 
         if key == keyboard.Key.esc:
             self.master.after(0, lambda: messagebox.showinfo("Exiting", "Esc key detected, exiting keyboard listener."))
             return False
 
+        if key in SEEK_KEYS: # Bar navigation instead of a step; the seek itself runs in the Tk thread
+            self.master.after(0, SEEK_KEYS[key], self)
+            return
+
         key_identifier = key.char.lower() if hasattr(key, 'char') and key.char is not None else key
         if key_identifier in current_pressed_keys:
             return
         current_pressed_keys.add(key_identifier)
 
-        if not custom_melody_sequence:
-            self.master.after(0, lambda: print("Melody sequence is empty, cannot play."))
+        engine = self.engine
+        if not engine or not engine.running:
             return
-
-        for note in last_notes_played:
-            send_note_off(note)
-        last_notes_played = []
-
-        element_to_play = custom_melody_sequence[current_sequence_index]
-        actual_notes_played = send_note_on(element_to_play)
-        
-        if actual_notes_played:
-            log_message = f"Playing: {element_to_play} (Sequence Index: {current_sequence_index})"
-            last_notes_played = actual_notes_played
-        else:
-            log_message = f"Playing rest (Sequence Index: {current_sequence_index})"
-
-        current_sequence_index = (current_sequence_index + 1) % len(custom_melody_sequence)
-        
-        self.master.after(0, lambda: print(log_message))
-        self.master.after(0, lambda: self.update_listbox_highlight(current_sequence_index - 1))
+        if not compiled_program:
+            self.pending_status = "Melody sequence is empty, cannot play."
+            return
+        engine.press(start_ns)
+
+    def refresh_ui(self):
+        """
+        Fixed-rate GUI refresh. Reads only the latest step and status from the shared slots,
+        so Tk work per frame stays bounded however fast the keys are hit.
+        """
+        if self.import_job:
+            self.poll_import()
+        status = self.pending_status
+        if status is not None:
+            self.pending_status = None
+            self.status_label.config(text=status)
+        if self.engine:
+            step = self.engine.last_step
+            if step != self.shown_step and step[1] >= 0:
+                self.shown_step = step
+                _, index, is_rest = step
+                if is_rest:
+                    self.status_label.config(text=f"Playing rest (Sequence Index: {index})")
+                elif index < len(custom_melody_sequence):
+                    self.status_label.config(text=f"Playing: {custom_melody_sequence[index]} (Sequence Index: {index})")
+                self.update_listbox_highlight(index)
+                self.show_position(index)
+                self.next_index = index + 1
+        self.master.after(UI_REFRESH_MS, self.refresh_ui)
 
     def on_listener_release(self, key):
         """pynput callback, runs in listener thread."""
-        global current_pressed_keys
         key_identifier = key.char.lower() if hasattr(key, 'char') and key.char is not None else key
         current_pressed_keys.discard(key_identifier)
 
     def update_listbox_highlight(self, index_to_highlight):
-        """Updates the Listbox highlight in the GUI main thread."""
-        self.melody_listbox.select_clear(0, tk.END)
+        """Moves the cursor highlight in the GUI main thread (touches only the old and new rows)."""
         if custom_melody_sequence:
             display_index = index_to_highlight 
             if display_index < 0:
                 display_index = len(custom_melody_sequence) - 1
-
-            if 0 <= display_index < len(custom_melody_sequence):
-                self.melody_listbox.select_set(display_index)
-                self.melody_listbox.see(display_index)
+            self.melody_listbox.highlight(display_index)
+
+    def refresh_latency_label(self):
+        """Periodically shows the stepping latency percentiles in the window."""
+        if self.engine:
+            self.latency_label.config(text=(
+                f"Keypress -> MIDI: {midi_output.format_latency(self.engine.press_latency.summary())}\n"
+                f"Note-off phase:   {midi_output.format_latency(self.engine.note_off_latency.summary())}"))
+        self.master.after(LATENCY_REFRESH_MS, self.refresh_latency_label)
+
+    def dump_latency(self):
+        """Asks for a file and writes the recorded stepping latency samples as CSV."""
+        if not self.engine:
+            return
+        filepath = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
+        if filepath:
+            try:
+                midi_output.dump_latency_csv(filepath, {"keypress_to_send_ns": self.engine.press_latency,
+                                                        "note_off_phase_ns": self.engine.note_off_latency})
+                print(f"Latency samples written to {filepath}")
+            except Exception as e:
+                messagebox.showerror("Save Failed", f"Could not save latency CSV: {e}")
 
     def stop_all_notes(self):
         """Stops all active notes and closes the MIDI port."""
-        global midi_port, active_notes
-        if midi_port and not midi_port.closed:
-            print("Stopping all active notes and closing MIDI port...")
-            for note in list(active_notes.keys()):
-                send_note_off(note)
-            midi_port.close()
-            midi_port = None
+        if self.engine and self.engine.running:
+            self.engine.stop()
+            if self.dump_latency_var.get():
+                self.dump_latency()
             messagebox.showinfo("Info", "All notes stopped, MIDI port closed.")
         else:
             print("MIDI port not open or already closed.")
             messagebox.showinfo("Info", "MIDI port not open or already closed.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MIDI keyboard stepping sequencer.")
+    midi_output.add_backend_argument(parser)
+    midi_backend = parser.parse_args().backend
+
     root = tk.Tk()
     app = MidiSequencerApp(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,102 @@
+import bisect
+from array import array
+
+class MeasureIndex:
+    """
+    Finds sequence elements by bar and beat. Imported sequences carry the bar and the beat in the bar
+    of every element onset (PackedSequence.bars / bar_beats); those are sorted along the sequence, so a
+    seek is two bisects: one for the bar's run of elements, one for the beat inside it, O(log n).
+    Elements without a known position (added by hand, bar 0) are left out of the search arrays;
+    when there are none, the sequence's own arrays are searched without copying.
+    The arrays are rebuilt lazily, on the first seek after the model changed.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.bars = None       # Bars of the timed elements, ascending
+        self.bar_beats = None  # Their beats in the bar
+        self.positions = None  # Their element indices, or None when every element is timed
+        self._dirty = True
+
+    def subscribe(self):
+        self.model.subscribe(self.on_sequence_change)
+        return self
+
+    def on_sequence_change(self, kind, start, count):
+        self._dirty = True
+
+    def _build(self):
+        sequence = self.model.packed
+        bars, bar_beats = sequence.bars, sequence.bar_beats
+        if bars is None or bar_beats is None:
+            self.bars = self.bar_beats = array('I')
+            self.positions = None
+        elif 0 not in bars:
+            self.bars, self.bar_beats, self.positions = bars, bar_beats, None
+        else:
+            self.positions = array('I', (i for i, bar in enumerate(bars) if bar))
+            self.bars = array('I', (bars[i] for i in self.positions))
+            self.bar_beats = array('f', (bar_beats[i] for i in self.positions))
+        self._dirty = False
+
+    def _element(self, position):
+        return position if self.positions is None else self.positions[position]
+
+    def has_positions(self):
+        if self._dirty:
+            self._build()
+        return len(self.bars) > 0
+
+    def bar_range(self):
+        """(first bar, last bar) of the sequence, or None without bar positions."""
+        if not self.has_positions():
+            return None
+        return self.bars[0], self.bars[-1]
+
+    def seek(self, bar, beat=0.0):
+        """
+        Index of the first element at or after bar / beat (beat counted from 0 in the bar),
+        or None when the position is past the end or the sequence has no bar positions.
+        """
+        if not self.has_positions():
+            return None
+        lo = bisect.bisect_left(self.bars, bar)
+        hi = bisect.bisect_right(self.bars, bar, lo)
+        position = bisect.bisect_left(self.bar_beats, beat - 1e-6, lo, hi) if beat else lo
+        if position >= len(self.bars):
+            return None
+        return self._element(position)
+
+    def position(self, index):
+        """(bar, beat in bar) of element index, or None if it is not known."""
+        sequence = self.model.packed
+        if sequence.bars is None or sequence.bar_beats is None or not 0 <= index < len(sequence):
+            return None
+        bar = sequence.bars[index]
+        return (bar, sequence.bar_beats[index]) if bar else None
+
+    def step_bar(self, index, delta):
+        """
+        Index of the first element of the bar delta bars away from the bar of element index
+        (the nearest timed element before it, if that one has no position). None without positions.
+        """
+        if not self.has_positions():
+            return None
+        if self.positions is None:
+            bar = self.bars[min(max(index, 0), len(self.bars) - 1)]
+        else:
+            before = bisect.bisect_right(self.positions, index) - 1
+            bar = self.bars[max(before, 0)]
+        bar = min(max(bar + delta, self.bars[0]), self.bars[-1])
+        if delta < 0:
+            # Bars without elements are skipped: go to the nearest bar at or before the target that has any
+            bar = self.bars[max(bisect.bisect_right(self.bars, bar) - 1, 0)]
+        return self._element(bisect.bisect_left(self.bars, bar))
+
+def parse_bar_beat(text):
+    """Parses 'bar' or 'bar:beat' (both from 1, the beat may be fractional) into (bar, beat from 0)."""
+    bar_text, _, beat_text = text.strip().partition(":")
+    bar = int(bar_text)
+    beat = float(beat_text) - 1 if beat_text.strip() else 0.0
+    if bar < 1 or beat < 0:
+        raise ValueError("bar and beat start at 1")
+    return bar, beat
@@ -0,0 +1,347 @@
+import csv
+import math
+import time
+import threading
+from array import array
+
+import mido
+
+try:
+    import rtmidi
+except ImportError: # python-rtmidi is optional, the mido backend still works without it
+    rtmidi = None
+
+# --- Raw MIDI Status Bytes ---
+NOTE_OFF_STATUS = 0x80
+NOTE_ON_STATUS = 0x90
+CONTROL_CHANGE_STATUS = 0xB0
+PROGRAM_CHANGE_STATUS = 0xC0
+ALL_SOUND_OFF = 120 # Controller numbers of the channel mode messages
+ALL_NOTES_OFF = 123
+
+# Port names we try first: LoopMIDI, or ports created by Python / RtMidi
+PORT_KEYWORDS = ("loopmidi", "python", "rtmidi")
+BUFFER_CACHE_LIMIT = 65536 # Distinct chords kept by step_engine; backends keep twice as many buffers (on + off)
+
+def message_length(status):
+    """Returns the length in bytes of a channel message with the given status byte."""
+    kind = status & 0xF0
+    if kind in (0xC0, 0xD0): # program change, channel pressure
+        return 2
+    return 3
+
+def split_buffer(buf):
+    """Splits a buffer of concatenated channel messages into one bytes object per message."""
+    parts = []
+    i = 0
+    while i < len(buf):
+        length = message_length(buf[i])
+        parts.append(bytes(buf[i:i + length]))
+        i += length
+    return tuple(parts)
+
+def find_output_name(names, keywords=PORT_KEYWORDS):
+    """Returns the first port name containing one of the keywords (case-insensitive), or None."""
+    for name in names:
+        lowered = name.lower()
+        if any(keyword in lowered for keyword in keywords):
+            return name
+    return None
+
+
+class NoteState:
+    """
+    Sounding-note reference counts: one byte per (channel, note), 16 x 128 slots in a bytearray.
+    A note sounded by two overlapping chords only really stops when both released it.
+    """
+    def __init__(self, channels=16):
+        self.channels = channels
+        self._counts = bytearray(channels * 128)
+        self._channel_counts = [0] * channels # Sounding notes per channel, for O(channels) panic
+
+    def note_on(self, channel, note):
+        """Counts one more holder of the note. Returns the new count."""
+        slot = (channel << 7) | note
+        count = self._counts[slot]
+        if count == 0:
+            self._channel_counts[channel] += 1
+        if count < 255:
+            count += 1
+            self._counts[slot] = count
+        return count
+
+    def note_off(self, channel, note):
+        """Releases one holder. Returns True when the note just became silent (send the note_off)."""
+        slot = (channel << 7) | note
+        count = self._counts[slot]
+        if count == 0:
+            return False
+        count -= 1
+        self._counts[slot] = count
+        if count == 0:
+            self._channel_counts[channel] -= 1
+            return True
+        return False
+
+    def is_active(self, channel, note):
+        return self._counts[(channel << 7) | note] != 0
+
+    def apply(self, buf):
+        """Updates the counts from a raw buffer of note_on/note_off messages (3 bytes each)."""
+        for i in range(0, len(buf), 3):
+            status = buf[i]
+            kind = status & 0xF0
+            if kind == NOTE_ON_STATUS and buf[i + 2]:
+                self.note_on(status & 0x0F, buf[i + 1])
+            elif kind == NOTE_OFF_STATUS or kind == NOTE_ON_STATUS:
+                self.note_off(status & 0x0F, buf[i + 1])
+
+    def release(self, buf):
+        """
+        Releases one holder per note_off in a raw buffer (3 bytes each) and returns what to send:
+        only the note_offs of notes that just became silent. That is buf itself unless some
+        note is still held (or was not sounding), so the common case allocates nothing.
+        """
+        kept = None
+        for i in range(0, len(buf), 3):
+            if self.note_off(buf[i] & 0x0F, buf[i + 1]):
+                if kept is not None:
+                    kept += buf[i:i + 3]
+            elif kept is None:
+                kept = bytearray(buf[:i])
+        return buf if kept is None else bytes(kept)
+
+    def active_notes(self, channel):
+        base = channel << 7
+        return [note for note in range(128) if self._counts[base + note]]
+
+    def active_channels(self):
+        return [channel for channel, count in enumerate(self._channel_counts) if count]
+
+    def clear(self):
+        self._counts[:] = bytes(len(self._counts))
+        self._channel_counts = [0] * self.channels
+
+def all_notes_off_buffer(channels, sound_off=False):
+    """Builds one All Notes Off (CC 123) message per channel, or All Sound Off (CC 120) if sound_off."""
+    controller = ALL_SOUND_OFF if sound_off else ALL_NOTES_OFF
+    return bytes(b for channel in channels for b in (CONTROL_CHANGE_STATUS | channel, controller, 0))
+
+
+class LatencyRing:
+    """
+    Fixed-size ring buffer of latency samples in nanoseconds (time.perf_counter_ns deltas).
+    Recording is a single array store, so it is cheap enough for the keypress path.
+    Written by one thread; readers take a snapshot.
+    """
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.count = 0 # Total samples ever recorded
+        self._samples = array('q', bytes(8 * capacity))
+
+    def record(self, elapsed_ns):
+        self._samples[self.count % self.capacity] = elapsed_ns
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def samples(self):
+        """Returns the retained samples, oldest first."""
+        count = self.count
+        if count <= self.capacity:
+            return self._samples[:count].tolist()
+        start = count % self.capacity
+        return self._samples[start:].tolist() + self._samples[:start].tolist()
+
+    def summary(self):
+        """Returns {'count', 'p50', 'p95', 'p99', 'max'} in nanoseconds, or None if nothing was recorded."""
+        ordered = sorted(self.samples())
+        if not ordered:
+            return None
+        def percentile(p):
+            return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+        return {"count": self.count, "p50": percentile(50), "p95": percentile(95),
+                "p99": percentile(99), "max": ordered[-1]}
+
+def format_latency(summary):
+    """Formats a LatencyRing summary in microseconds."""
+    if summary is None:
+        return "no samples"
+    return (f"p50 {summary['p50'] / 1000:.0f} us, p95 {summary['p95'] / 1000:.0f} us, "
+            f"p99 {summary['p99'] / 1000:.0f} us, max {summary['max'] / 1000:.0f} us (n={summary['count']})")
+
+def dump_latency_csv(filepath, rings):
+    """
+    Writes latency rings side by side to a CSV file, one column per ring (values in ns).
+    rings: dict of column name -> LatencyRing. Rows are aligned oldest first.
+    """
+    columns = {name: ring.samples() for name, ring in rings.items()}
+    length = max((len(samples) for samples in columns.values()), default=0)
+    with open(filepath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["sample"] + list(columns))
+        for i in range(length):
+            writer.writerow([i] + [samples[i] if i < len(samples) else "" for samples in columns.values()])
+
+
+class OutputBackend:
+    """
+    Base class of the MIDI output backends.
+    Everything is sent as raw byte buffers; each send is timed so backends can be compared.
+    Decoded buffers are cached; the cache is dropped when it reaches 2 * BUFFER_CACHE_LIMIT entries,
+    so repeated imports in one session do not keep every buffer ever sent.
+    """
+    name = "base"
+
+    def __init__(self, port_name):
+        self.port_name = port_name
+        self.send_latency = LatencyRing()
+        self._lock = threading.Lock()
+        self._decoded = {} # Buffer -> backend-specific decoded messages
+
+    @property
+    def closed(self):
+        raise NotImplementedError
+
+    def prepare(self, buffers):
+        """Pre-decodes buffers that will be sent later so the send path only does lookups."""
+        for buf in buffers:
+            self._prepared(buf)
+
+    def send_buffer(self, buf):
+        """Sends one or more concatenated channel messages (no-op for an empty buffer or a closed port)."""
+        if not buf or self.closed:
+            return
+        start = time.perf_counter_ns()
+        with self._lock:
+            self._send_prepared(self._prepared(buf))
+        self.send_latency.record(time.perf_counter_ns() - start)
+
+    def send_program_change(self, channel, program):
+        self.send_buffer(bytes((PROGRAM_CHANGE_STATUS | channel, program)))
+
+    def all_notes_off(self, note_state, sound_off=False):
+        """
+        Panic stop: one channel mode message per channel that still has sounding notes,
+        instead of a note_off per note, then resets the note state.
+        """
+        channels = note_state.active_channels()
+        if channels:
+            self.send_buffer(all_notes_off_buffer(channels, sound_off))
+        note_state.clear()
+
+    def latency_report(self):
+        """Returns a one-line summary of the send latency measured on this backend."""
+        return f"[{self.name}] send latency: {format_latency(self.send_latency.summary())}"
+
+    def close(self):
+        raise NotImplementedError
+
+    def _prepared(self, buf):
+        decoded = self._decoded.get(buf)
+        if decoded is None:
+            decoded = self._decode(buf)
+            if len(self._decoded) >= 2 * BUFFER_CACHE_LIMIT:
+                self._decoded.clear()
+            self._decoded[bytes(buf)] = decoded
+        return decoded
+
+    def _decode(self, buf):
+        raise NotImplementedError
+
+    def _send_prepared(self, prepared):
+        raise NotImplementedError
+
+
+class MidoBackend(OutputBackend):
+    """Sends through mido.open_output. Buffers are parsed into mido Messages once and cached."""
+    name = "mido"
+
+    def __init__(self, port_name):
+        super().__init__(port_name)
+        self._port = mido.open_output(port_name)
+
+    @property
+    def closed(self):
+        return self._port.closed
+
+    def _decode(self, buf):
+        return tuple(mido.parse_all(buf))
+
+    def _send_prepared(self, messages):
+        for msg in messages:
+            self._port.send(msg)
+
+    def close(self):
+        self._port.close()
+
+    @staticmethod
+    def output_names():
+        return mido.get_output_names()
+
+
+class RtMidiBackend(OutputBackend):
+    """Sends raw bytes straight to rtmidi.MidiOut.send_message, without any mido Message objects."""
+    name = "rtmidi"
+
+    def __init__(self, port_name):
+        super().__init__(port_name)
+        if rtmidi is None:
+            raise RuntimeError("python-rtmidi is not installed.")
+        self._midiout = rtmidi.MidiOut()
+        ports = self._midiout.get_ports()
+        if port_name not in ports:
+            raise IOError(f"Unknown MIDI output port: '{port_name}'")
+        self._midiout.open_port(ports.index(port_name))
+        self._closed = False
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _decode(self, buf):
+        return split_buffer(buf)
+
+    def _send_prepared(self, messages):
+        send_message = self._midiout.send_message
+        for msg in messages:
+            send_message(msg)
+
+    def close(self):
+        if not self._closed:
+            self._midiout.close_port()
+            self._closed = True
+
+    @staticmethod
+    def output_names():
+        if rtmidi is None:
+            return []
+        return rtmidi.MidiOut().get_ports()
+
+
+BACKENDS = {
+    MidoBackend.name: MidoBackend,
+    RtMidiBackend.name: RtMidiBackend,
+}
+
+def output_names(backend="mido"):
+    return BACKENDS[backend].output_names()
+
+def open_output(backend="mido", port_name=None, keywords=PORT_KEYWORDS):
+    """
+    Opens a MIDI output port through the chosen backend.
+    When port_name is None the first port matching one of the keywords is used.
+    Returns None if no suitable port exists.
+    """
+    backend_class = BACKENDS[backend]
+    if port_name is None:
+        port_name = find_output_name(backend_class.output_names(), keywords)
+        if port_name is None:
+            return None
+    return backend_class(port_name)
+
+def add_backend_argument(parser):
+    """Adds the --backend startup option to an argparse parser."""
+    parser.add_argument("--backend", choices=list(BACKENDS), default=MidoBackend.name,
+                        help="MIDI output backend: 'mido' (default) or 'rtmidi' (direct python-rtmidi, no mido Messages).")
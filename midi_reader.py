@@ -0,0 +1,767 @@
+import argparse
+import bisect
+import heapq
+import math
+import mmap
+import random
+import time
+from array import array
+from contextlib import contextmanager
+
+try:
+    import numpy as np
+except ImportError: # numpy is optional, grouping falls back to the pure-Python loop
+    np = None
+
+PROGRESS_INTERVAL = 2000 # Report progress / check for cancellation every N messages or notes
+DEFAULT_TEMPO = 500000   # Microseconds per beat (120 BPM) until the first set_tempo
+SET_TEMPO = 0x51         # Meta message type of set_tempo
+TIME_SIGNATURE = 0x58    # Meta message type of time_signature
+
+# Data bytes following system common / real-time status bytes (0xF0, 0xF7 and 0xFF have their own length field)
+SYSTEM_DATA_LENGTHS = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0, 0xF8: 0, 0xFA: 0, 0xFB: 0, 0xFC: 0, 0xFE: 0}
+
+class ImportCancelled(Exception):
+    """Raised inside an import when its cancel event was set."""
+
+def _check_cancel(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise ImportCancelled()
+
+# --- Fast Note Event Reader ---
+class NoteEvents:
+    """
+    Note on/off events of one track in compact parallel arrays, in file order.
+    Note-offs (and note-ons with velocity 0) are stored with velocity 0.
+    Tempo changes of the track are kept as (tick, microseconds per beat) in tempo_changes,
+    time signatures as (tick, numerator, denominator) in time_signatures.
+    """
+    __slots__ = ("ticks", "notes", "velocities", "channels", "tempo_changes", "time_signatures",
+                 "ticks_per_beat", "track_count", "message_count")
+
+    def __init__(self, ticks_per_beat, track_count):
+        self.ticks = array('L')      # Absolute tick of each event
+        self.notes = array('B')
+        self.velocities = array('B')
+        self.channels = array('B')
+        self.tempo_changes = []
+        self.time_signatures = []
+        self.ticks_per_beat = ticks_per_beat
+        self.track_count = track_count
+        self.message_count = 0       # All messages decoded in the track, notes or not
+
+    def __len__(self):
+        return len(self.ticks)
+
+def read_varlen(data, pos):
+    """Decodes a variable-length quantity. Returns (value, new position)."""
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+    return value, pos
+
+def _read_header(data):
+    """Returns (format, track count, ticks_per_beat, position of the first chunk after MThd)."""
+    if len(data) < 14 or data[0:4] != b'MThd':
+        raise OSError('MThd not found. Probably not a MIDI file')
+    size = int.from_bytes(data[4:8], 'big')
+    midi_format = int.from_bytes(data[8:10], 'big', signed=True)
+    track_count = int.from_bytes(data[10:12], 'big', signed=True)
+    ticks_per_beat = int.from_bytes(data[12:14], 'big', signed=True)
+    return midi_format, track_count, ticks_per_beat, 8 + size
+
+def _track_chunks(data, pos, track_count):
+    """Returns (start, end) byte ranges of the MTrk chunk bodies, without decoding them."""
+    chunks = []
+    for _ in range(track_count):
+        if pos + 8 > len(data):
+            raise EOFError
+        if data[pos:pos + 4] != b'MTrk':
+            raise OSError('no MTrk header at start of track')
+        size = int.from_bytes(data[pos + 4:pos + 8], 'big')
+        chunks.append((pos + 8, pos + 8 + size))
+        pos += 8 + size
+    return chunks
+
+def _scan_note_events(data, start, end, events, progress=None, cancel_event=None):
+    """
+    Decodes one track body straight into events' arrays: variable-length deltas,
+    running status and note on/off bytes. Every other message is skipped by its length
+    without creating any object.
+    """
+    append_tick = events.ticks.append
+    append_note = events.notes.append
+    append_velocity = events.velocities.append
+    append_channel = events.channels.append
+    pos = start
+    tick = 0
+    running_status = None
+    parsed = 0
+
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        delta = byte & 0x7F
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            delta = (delta << 7) | (byte & 0x7F)
+        tick += delta
+
+        status = data[pos]
+        if status < 0x80:
+            if running_status is None:
+                raise OSError('running status without last_status')
+            status = running_status # The byte is the first data byte, leave it in place
+        else:
+            pos += 1
+            if status != 0xFF: # Meta messages don't set running status
+                running_status = status
+
+        kind = status & 0xF0
+        if kind == 0x90:
+            append_tick(tick)
+            append_note(data[pos])
+            append_velocity(data[pos + 1])
+            append_channel(status & 0x0F)
+            pos += 2
+        elif kind == 0x80:
+            append_tick(tick)
+            append_note(data[pos])
+            append_velocity(0)
+            append_channel(status & 0x0F)
+            pos += 2
+        elif kind == 0xC0 or kind == 0xD0:
+            pos += 1
+        elif status < 0xF0:
+            pos += 2
+        elif status == 0xFF:
+            meta_type = data[pos]
+            length, pos = read_varlen(data, pos + 1)
+            if meta_type == SET_TEMPO and length == 3:
+                events.tempo_changes.append((tick, int.from_bytes(data[pos:pos + 3], 'big')))
+            elif meta_type == TIME_SIGNATURE and length >= 2:
+                events.time_signatures.append((tick, data[pos], 1 << data[pos + 1]))
+            pos += length
+        elif status == 0xF0 or status == 0xF7:
+            length, pos = read_varlen(data, pos)
+            pos += length
+        elif status in SYSTEM_DATA_LENGTHS:
+            pos += SYSTEM_DATA_LENGTHS[status]
+        else:
+            raise OSError(f'undefined status byte 0x{status:02x}')
+
+        parsed += 1
+        if parsed % PROGRESS_INTERVAL == 0:
+            _check_cancel(cancel_event)
+            if progress:
+                progress("messages", parsed, None)
+
+    events.message_count += parsed
+    if progress:
+        progress("messages", parsed, parsed)
+
+def _scan_meta_events(data, start, end, events, cancel_event=None):
+    """
+    Collects only the tempo changes and time signatures of one track body into events;
+    every other message is skipped by its length (no note arrays are filled).
+    """
+    pos = start
+    tick = 0
+    running_status = None
+    parsed = 0
+
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        delta = byte & 0x7F
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            delta = (delta << 7) | (byte & 0x7F)
+        tick += delta
+
+        status = data[pos]
+        if status < 0x80:
+            if running_status is None:
+                raise OSError('running status without last_status')
+            status = running_status
+        else:
+            pos += 1
+            if status != 0xFF:
+                running_status = status
+
+        kind = status & 0xF0
+        if kind == 0xC0 or kind == 0xD0:
+            pos += 1
+        elif status < 0xF0:
+            pos += 2
+        elif status == 0xFF:
+            meta_type = data[pos]
+            length, pos = read_varlen(data, pos + 1)
+            if meta_type == SET_TEMPO and length == 3:
+                events.tempo_changes.append((tick, int.from_bytes(data[pos:pos + 3], 'big')))
+            elif meta_type == TIME_SIGNATURE and length >= 2:
+                events.time_signatures.append((tick, data[pos], 1 << data[pos + 1]))
+            pos += length
+        elif status == 0xF0 or status == 0xF7:
+            length, pos = read_varlen(data, pos)
+            pos += length
+        elif status in SYSTEM_DATA_LENGTHS:
+            pos += SYSTEM_DATA_LENGTHS[status]
+        else:
+            raise OSError(f'undefined status byte 0x{status:02x}')
+
+        parsed += 1
+        if parsed % PROGRESS_INTERVAL == 0:
+            _check_cancel(cancel_event)
+
+    events.message_count += parsed
+
+@contextmanager
+def _mapped_midi(midi_filepath):
+    """Memory-maps a .mid file. Yields (data, ticks_per_beat, track chunk ranges)."""
+    with open(midi_filepath, 'rb') as f:
+        if not f.seek(0, 2):
+            raise OSError('MThd not found. Probably not a MIDI file')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            _, track_count, ticks_per_beat, pos = _read_header(data)
+            yield data, ticks_per_beat, _track_chunks(data, pos, track_count)
+
+@contextmanager
+def mapped_tracks(midi_filepath):
+    """Memory-maps a .mid file. Yields (format, ticks_per_beat, data, track chunk ranges) for raw access."""
+    with _mapped_midi(midi_filepath) as (data, ticks_per_beat, chunks):
+        yield _read_header(data)[0], ticks_per_beat, data, chunks
+
+# --- Raw Message Stream ---
+CHANNEL_DATA_LENGTHS = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+
+def iter_track_messages(data, start, end, tick=0, running_status=None):
+    """
+    Yields (absolute tick, message bytes) for every message of one track body, in file order.
+    Running status is expanded, so every message starts with its status byte; meta and sysex
+    messages keep their length field, exactly as in the file.
+    Decoding can resume in the middle of a track from a position saved by iter_track_positions,
+    with the tick and running status in effect there.
+    """
+    for tick, message, _, _ in iter_track_positions(data, start, end, tick, running_status):
+        yield tick, message
+
+def iter_track_positions(data, start, end, tick=0, running_status=None):
+    """
+    Like iter_track_messages, but yields (tick, message, position after the message, running status
+    after it), which is all the state needed to resume decoding after that message.
+    """
+    pos = start
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        delta = byte & 0x7F
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            delta = (delta << 7) | (byte & 0x7F)
+        tick += delta
+
+        status = data[pos]
+        if status < 0x80:
+            if running_status is None:
+                raise OSError('running status without last_status')
+            status = running_status
+            message_start = None
+        else:
+            message_start = pos
+            pos += 1
+            if status != 0xFF: # Meta messages don't set running status
+                running_status = status
+        body_start = pos
+
+        if status < 0xF0:
+            pos += CHANNEL_DATA_LENGTHS[status & 0xF0]
+        elif status == 0xFF:
+            length, pos = read_varlen(data, pos + 1)
+            pos += length
+        elif status == 0xF0 or status == 0xF7:
+            length, pos = read_varlen(data, pos)
+            pos += length
+        elif status in SYSTEM_DATA_LENGTHS:
+            pos += SYSTEM_DATA_LENGTHS[status]
+        else:
+            raise OSError(f'undefined status byte 0x{status:02x}')
+
+        if message_start is None:
+            yield tick, bytes((status,)) + data[body_start:pos], pos, running_status
+        else:
+            yield tick, data[message_start:pos], pos, running_status
+
+def _tagged_messages(track_index, messages):
+    for tick, message in messages:
+        yield tick, track_index, message
+
+@contextmanager
+def merged_messages(midi_filepath):
+    """
+    Memory-maps a .mid file and yields (format, ticks_per_beat, messages), messages iterating
+    (tick, track, message bytes) over all tracks merged on absolute ticks with a heap, O(N log k).
+    Ties keep track order, then file order. Only one message per track is decoded ahead, so memory
+    does not grow with the file.
+    """
+    with mapped_tracks(midi_filepath) as (midi_format, ticks_per_beat, data, chunks):
+        streams = [_tagged_messages(track_index, iter_track_messages(data, start, end))
+                   for track_index, (start, end) in enumerate(chunks)]
+        yield midi_format, ticks_per_beat, heapq.merge(*streams, key=lambda item: item[0])
+
+def _track_note_events(data, ticks_per_beat, chunks, track_index, progress=None, cancel_event=None):
+    """Scans one track of a mapped file. Returns (track index actually read, NoteEvents)."""
+    if track_index >= len(chunks):
+        print(f"Warning: Track index {track_index} does not exist. Using the first track (index 0).")
+        track_index = 0
+    events = NoteEvents(ticks_per_beat, len(chunks))
+    start, end = chunks[track_index]
+    _scan_note_events(data, start, end, events, progress, cancel_event)
+    return track_index, events
+
+def _tracks_note_events(data, ticks_per_beat, chunks, tracks=None, progress=None, cancel_event=None):
+    """Scans the selected tracks of a mapped file. Returns {track index: NoteEvents}."""
+    selected = range(len(chunks)) if tracks is None else sorted(set(t for t in tracks if 0 <= t < len(chunks)))
+    per_track = {}
+    for track_index in selected:
+        events = NoteEvents(ticks_per_beat, len(chunks))
+        start, end = chunks[track_index]
+        _scan_note_events(data, start, end, events, progress, cancel_event)
+        per_track[track_index] = events
+    return per_track
+
+def read_note_events(midi_filepath, track_index=0, progress=None, cancel_event=None):
+    """
+    Memory-maps a .mid file and extracts the note events of one track into a NoteEvents.
+    Other tracks are skipped by their chunk length. Falls back to track 0 (with a warning)
+    if track_index does not exist. Returns None if the file has no tracks.
+    """
+    with _mapped_midi(midi_filepath) as (data, ticks_per_beat, chunks):
+        if not chunks:
+            return None
+        return _track_note_events(data, ticks_per_beat, chunks, track_index, progress, cancel_event)[1]
+
+def read_tracks_note_events(midi_filepath, tracks=None, progress=None, cancel_event=None):
+    """
+    Extracts the note events of several tracks. tracks: iterable of track indices, None for all
+    (indices that do not exist are ignored). Returns (ticks_per_beat, {track index: NoteEvents}).
+    """
+    with _mapped_midi(midi_filepath) as (data, ticks_per_beat, chunks):
+        return ticks_per_beat, _tracks_note_events(data, ticks_per_beat, chunks, tracks, progress, cancel_event)
+
+# --- Tempo Map ---
+class TempoMap:
+    """
+    Tick <-> seconds conversion for a whole file, built once from its tempo changes.
+    Breakpoints hold the tick, the elapsed microseconds and the tempo in effect from there on,
+    so a conversion is a bisect over the breakpoints plus one multiplication, O(log n).
+    """
+    __slots__ = ("ticks_per_beat", "ticks", "micros", "tempos")
+
+    def __init__(self, ticks_per_beat, tempo_changes=()):
+        """tempo_changes: (tick, microseconds per beat) pairs in any order; of several at one tick the last wins."""
+        self.ticks_per_beat = ticks_per_beat
+        self.ticks = array('L', [0])
+        self.micros = array('d', [0.0])
+        self.tempos = array('L', [DEFAULT_TEMPO])
+        for tick, tempo in sorted(tempo_changes, key=lambda change: change[0]):
+            if tick == self.ticks[-1]:
+                self.tempos[-1] = tempo
+                continue
+            self.micros.append(self.micros[-1] + (tick - self.ticks[-1]) * self.tempos[-1] / ticks_per_beat)
+            self.ticks.append(tick)
+            self.tempos.append(tempo)
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def tick_to_seconds(self, tick):
+        """Seconds from the start of the file to tick (ticks may be fractional)."""
+        i = bisect.bisect_right(self.ticks, tick) - 1
+        return (self.micros[i] + (tick - self.ticks[i]) * self.tempos[i] / self.ticks_per_beat) / 1_000_000
+
+    def seconds_to_tick(self, seconds):
+        """Inverse of tick_to_seconds; returns a fractional tick."""
+        micros = seconds * 1_000_000
+        i = max(0, bisect.bisect_right(self.micros, micros) - 1)
+        return self.ticks[i] + (micros - self.micros[i]) * self.ticks_per_beat / self.tempos[i]
+
+# --- Bars and Beats ---
+class Meter:
+    """
+    Bar/beat positions for a whole file, built once from its time signatures. Positions are given
+    in beats (quarter notes, like TempoMap) and converted with a bisect over the time signature
+    changes, O(log n). Bars are numbered from 1; a change in the middle of a bar starts a new bar.
+    """
+    __slots__ = ("beats", "bars", "bar_lengths", "units")
+
+    def __init__(self, ticks_per_beat, time_signatures=()):
+        """time_signatures: (tick, numerator, denominator) triples in any order; 4/4 until the first one."""
+        self.beats = array('d', [0.0])      # Position of each change in beats
+        self.bars = array('L', [1])         # Number of the bar starting there
+        self.bar_lengths = array('d', [4.0]) # Bar length in beats from there on
+        self.units = array('d', [1.0])      # Length of one time signature beat in beats (4 / denominator)
+        for tick, numerator, denominator in sorted(time_signatures, key=lambda change: change[0]):
+            beat = tick / ticks_per_beat
+            unit = 4 / denominator
+            if beat > self.beats[-1]:
+                elapsed = (beat - self.beats[-1]) / self.bar_lengths[-1]
+                self.bars.append(self.bars[-1] + math.ceil(elapsed - 1e-9))
+                self.beats.append(beat)
+                self.bar_lengths.append(numerator * unit)
+                self.units.append(unit)
+            else: # Of several changes at one position the last wins
+                self.bar_lengths[-1] = numerator * unit
+                self.units[-1] = unit
+
+    def position(self, beats):
+        """(bar, beat in bar) of a position in beats; the beat counts time signature beats from 0."""
+        i = max(0, bisect.bisect_right(self.beats, beats) - 1)
+        offset = beats - self.beats[i]
+        bars = math.floor(offset / self.bar_lengths[i] + 1e-9)
+        return self.bars[i] + bars, max(0.0, offset - bars * self.bar_lengths[i]) / self.units[i]
+
+    def bar_start(self, bar):
+        """Position in beats where a bar starts."""
+        i = max(0, bisect.bisect_right(self.bars, bar) - 1)
+        return self.beats[i] + (bar - self.bars[i]) * self.bar_lengths[i]
+
+def _tempo_and_meter(data, ticks_per_beat, chunks, scanned, cancel_event=None):
+    """
+    TempoMap and Meter of a mapped file. scanned: {track index: NoteEvents} of tracks already
+    decoded, whose tempo changes and time signatures are reused; the other tracks get a meta-only scan.
+    """
+    tempo_changes = []
+    time_signatures = []
+    for track_index, (start, end) in enumerate(chunks):
+        events = scanned.get(track_index)
+        if events is None:
+            events = NoteEvents(ticks_per_beat, len(chunks))
+            _scan_meta_events(data, start, end, events, cancel_event)
+        tempo_changes.extend(events.tempo_changes)
+        time_signatures.extend(events.time_signatures)
+    return TempoMap(ticks_per_beat, tempo_changes), Meter(ticks_per_beat, time_signatures)
+
+def _note_stream(track_index, events, channels):
+    """Yields (tick, track, position, channel, note, velocity) for one track, in file order."""
+    for position, (tick, note, note_velocity, channel) in enumerate(
+            zip(events.ticks, events.notes, events.velocities, events.channels)):
+        if channels is None or channel in channels:
+            yield tick, track_index, position, channel, note, note_velocity
+
+def merge_note_events(per_track, channels=None):
+    """
+    k-way merges the per-track note streams on absolute ticks with a heap, O(N log k).
+    Ties keep track order, then file order. channels: set of channels to keep, None for all.
+    Returns a single NoteEvents (channels preserved, tracks folded together).
+    """
+    ticks_per_beat = next(iter(per_track.values())).ticks_per_beat if per_track else 0
+    merged = NoteEvents(ticks_per_beat, len(per_track))
+    tracks = array('H')
+    streams = [_note_stream(track_index, events, channels) for track_index, events in per_track.items()]
+    for tick, track_index, _, channel, note, note_velocity in heapq.merge(*streams):
+        merged.ticks.append(tick)
+        merged.notes.append(note)
+        merged.velocities.append(note_velocity)
+        merged.channels.append(channel)
+        tracks.append(track_index)
+    merged.message_count = sum(events.message_count for events in per_track.values())
+    return merged, tracks
+
+def pair_notes(events, tracks=None):
+    """
+    Matches note-ons with their note-offs (by note number, like the original importer:
+    a repeated note-on restarts the note). Returns (start_ticks, end_ticks, notes) arrays
+    in note-off order.
+    tracks: for merged events, the source track of each event; notes are then matched
+    per (track, channel, note) so parts sharing a pitch don't end each other.
+    """
+    start_ticks = array('L')
+    end_ticks = array('L')
+    notes = array('B')
+    open_notes = {}
+    if tracks is None:
+        keys = events.notes
+    else:
+        keys = [(track, channel, note) for track, channel, note in zip(tracks, events.channels, events.notes)]
+    for tick, note, note_velocity, key in zip(events.ticks, events.notes, events.velocities, keys):
+        if note_velocity:
+            open_notes[key] = tick
+        elif key in open_notes:
+            start_ticks.append(open_notes.pop(key))
+            end_ticks.append(tick)
+            notes.append(note)
+    return start_ticks, end_ticks, notes
+
+def group_notes(start_ticks, notes, ticks_per_beat, quantization_level=0.25, progress=None, cancel_event=None):
+    """
+    Groups notes whose onsets quantize to the same grid position into chords.
+    Returns the sequence: an int for a single note, a sorted list for a chord.
+    Uses the vectorized NumPy path when numpy is installed; both paths give identical results.
+    """
+    if np is not None:
+        return _group_notes_numpy(start_ticks, notes, ticks_per_beat, quantization_level, progress, cancel_event)
+    return _group_notes_python(start_ticks, notes, ticks_per_beat, quantization_level, progress, cancel_event)
+
+def _group_notes_python(start_ticks, notes, ticks_per_beat, quantization_level=0.25, progress=None, cancel_event=None):
+    order = sorted(range(len(start_ticks)), key=start_ticks.__getitem__)
+    sequence = []
+    last_quantized_time_processed = -float('inf')
+    notes_for_current_quantized_time = set()
+    total_notes = len(order)
+
+    for grouped, i in enumerate(order, 1):
+        start_beats = start_ticks[i] / ticks_per_beat
+        quantized_start_beats = round(start_beats / quantization_level) * quantization_level
+
+        if quantized_start_beats > last_quantized_time_processed:
+            if notes_for_current_quantized_time:
+                if len(notes_for_current_quantized_time) == 1:
+                    sequence.append(list(notes_for_current_quantized_time)[0])
+                else:
+                    sequence.append(sorted(notes_for_current_quantized_time))
+            notes_for_current_quantized_time.clear()
+
+        notes_for_current_quantized_time.add(notes[i])
+        last_quantized_time_processed = quantized_start_beats
+
+        if grouped % PROGRESS_INTERVAL == 0:
+            _check_cancel(cancel_event)
+            if progress:
+                progress("notes", grouped, total_notes)
+
+    if notes_for_current_quantized_time:
+        if len(notes_for_current_quantized_time) == 1:
+            sequence.append(list(notes_for_current_quantized_time)[0])
+        else:
+            sequence.append(sorted(notes_for_current_quantized_time))
+    if progress:
+        progress("notes", total_notes, total_notes)
+    return sequence
+
+def _group_notes_numpy(start_ticks, notes, ticks_per_beat, quantization_level=0.25, progress=None, cancel_event=None):
+    """
+    Same grouping as _group_notes_python, on whole arrays: every onset is quantized at once
+    (np.round rounds half to even like round(), and the divisions are done in the same order,
+    so grid positions match bit for bit), notes are sorted by (grid position, pitch), repeated
+    pitches within a grid position are dropped, and the chords are cut at grid position changes.
+    """
+    _check_cancel(cancel_event)
+    total_notes = len(notes)
+    if not total_notes:
+        if progress:
+            progress("notes", 0, 0)
+        return []
+    grid = np.round(np.asarray(start_ticks, dtype=np.float64) / ticks_per_beat / quantization_level)
+    pitches = np.asarray(notes, dtype=np.int64)
+
+    order = np.lexsort((pitches, grid))
+    grid = grid[order]
+    pitches = pitches[order]
+    keep = np.ones(total_notes, dtype=bool)
+    keep[1:] = (grid[1:] != grid[:-1]) | (pitches[1:] != pitches[:-1])
+    grid = grid[keep]
+    pitches = pitches[keep]
+
+    bounds = np.flatnonzero(np.diff(grid)) + 1
+    starts = [0] + bounds.tolist()
+    ends = bounds.tolist() + [len(pitches)]
+    pitch_list = pitches.tolist()
+    sequence = [pitch_list[start] if end - start == 1 else pitch_list[start:end]
+                for start, end in zip(starts, ends)]
+    if progress:
+        progress("notes", total_notes, total_notes)
+    return sequence
+
+class SequenceTiming:
+    """
+    Onset and duration of every sequence element, in beats and in seconds (parallel arrays,
+    element i of the sequence is entry i). The onset is the quantized grid position of the
+    element, its duration that of its longest note. With a Meter, bars and bar_beats hold the
+    bar and the beat in the bar (see Meter.position) of every onset.
+    """
+    __slots__ = ("onset_beats", "duration_beats", "onset_seconds", "duration_seconds", "bars", "bar_beats",
+                 "tempo_map", "meter")
+
+    def __init__(self, tempo_map, meter=None):
+        self.onset_beats = array('d')
+        self.duration_beats = array('d')
+        self.onset_seconds = array('d')
+        self.duration_seconds = array('d')
+        self.bars = array('L')
+        self.bar_beats = array('d')
+        self.tempo_map = tempo_map
+        self.meter = meter
+
+    def __len__(self):
+        return len(self.onset_beats)
+
+    def total_seconds(self):
+        if not self.onset_seconds:
+            return 0.0
+        return max(onset + duration for onset, duration in zip(self.onset_seconds, self.duration_seconds))
+
+def element_timing(start_ticks, end_ticks, tempo_map, quantization_level=0.25, meter=None):
+    """
+    Computes the SequenceTiming of the elements group_notes builds from the same notes
+    (the grid positions are computed the same way, so the elements line up one to one).
+    """
+    ticks_per_beat = tempo_map.ticks_per_beat
+    longest = {} # Grid position -> longest note length in ticks
+    for start, end in zip(start_ticks, end_ticks):
+        grid = round(start / ticks_per_beat / quantization_level)
+        length = end - start
+        if longest.get(grid, -1) < length:
+            longest[grid] = length
+
+    timing = SequenceTiming(tempo_map, meter)
+    for grid in sorted(longest):
+        onset_beats = grid * quantization_level
+        onset_tick = onset_beats * ticks_per_beat
+        onset_seconds = tempo_map.tick_to_seconds(onset_tick)
+        timing.onset_beats.append(onset_beats)
+        timing.duration_beats.append(longest[grid] / ticks_per_beat)
+        timing.onset_seconds.append(onset_seconds)
+        timing.duration_seconds.append(tempo_map.tick_to_seconds(onset_tick + longest[grid]) - onset_seconds)
+        if meter is not None:
+            bar, bar_beat = meter.position(onset_beats)
+            timing.bars.append(bar)
+            timing.bar_beats.append(bar_beat)
+    return timing
+
+def read_sequence(midi_filepath, track_index=0, quantization_level=0.25, progress=None, cancel_event=None):
+    """
+    Extracts note events from a MIDI file and converts them into the custom_melody_sequence format.
+    Attempts to group simultaneously occurring notes into chords.
+
+    progress: optional callable(stage, done, total), stage being "messages" or "notes"
+    (total is None while the message count is not known yet).
+    cancel_event: optional threading.Event; when set, the import stops with ImportCancelled.
+    Parse errors are raised to the caller.
+    """
+    events = read_note_events(midi_filepath, track_index, progress, cancel_event)
+    if events is None:
+        print("MIDI file contains no tracks.")
+        return []
+    _check_cancel(cancel_event)
+
+    start_ticks, _, notes = pair_notes(events)
+    sequence = group_notes(start_ticks, notes, events.ticks_per_beat, quantization_level, progress, cancel_event)
+
+    print(f"Successfully imported {len(sequence)} elements from '{midi_filepath}'.")
+    return sequence
+
+def read_merged_sequence(midi_filepath, tracks=None, channels=None, quantization_level=0.25, progress=None, cancel_event=None):
+    """
+    Imports several tracks of a (type 1) MIDI file as one sequence: every selected track is
+    merged on absolute ticks and chords are grouped across tracks.
+    tracks / channels: iterables of track indices / MIDI channels to include, None for all.
+    """
+    ticks_per_beat, per_track = read_tracks_note_events(midi_filepath, tracks, progress, cancel_event)
+    if not per_track:
+        print("MIDI file contains no matching tracks.")
+        return []
+    _check_cancel(cancel_event)
+
+    merged, event_tracks = merge_note_events(per_track, None if channels is None else set(channels))
+    start_ticks, _, notes = pair_notes(merged, event_tracks)
+    sequence = group_notes(start_ticks, notes, ticks_per_beat, quantization_level, progress, cancel_event)
+
+    print(f"Successfully imported {len(sequence)} elements from {len(per_track)} tracks of '{midi_filepath}'.")
+    return sequence
+
+
+def read_timed_sequence(midi_filepath, track_index=0, quantization_level=0.25, progress=None, cancel_event=None):
+    """
+    Like read_sequence, but also returns the SequenceTiming of the elements:
+    (sequence, timing), timing being None if the file has no tracks.
+    """
+    with _mapped_midi(midi_filepath) as (data, ticks_per_beat, chunks):
+        if not chunks:
+            print("MIDI file contains no tracks.")
+            return [], None
+        track_index, events = _track_note_events(data, ticks_per_beat, chunks, track_index, progress, cancel_event)
+        # The tempo/meter of the imported track come from the same scan; other tracks are read for metas only
+        tempo_map, meter = _tempo_and_meter(data, ticks_per_beat, chunks, {track_index: events}, cancel_event)
+    _check_cancel(cancel_event)
+
+    start_ticks, end_ticks, notes = pair_notes(events)
+    sequence = group_notes(start_ticks, notes, ticks_per_beat, quantization_level, progress, cancel_event)
+    timing = element_timing(start_ticks, end_ticks, tempo_map, quantization_level, meter)
+
+    print(f"Successfully imported {len(sequence)} elements ({timing.total_seconds():.1f} s) from '{midi_filepath}'.")
+    return sequence, timing
+
+def read_timed_merged_sequence(midi_filepath, tracks=None, channels=None, quantization_level=0.25, progress=None, cancel_event=None):
+    """
+    Like read_merged_sequence, but also returns the SequenceTiming of the elements:
+    (sequence, timing), timing being None if no track matched.
+    """
+    with _mapped_midi(midi_filepath) as (data, ticks_per_beat, chunks):
+        per_track = _tracks_note_events(data, ticks_per_beat, chunks, tracks, progress, cancel_event)
+        if not per_track:
+            print("MIDI file contains no matching tracks.")
+            return [], None
+        tempo_map, meter = _tempo_and_meter(data, ticks_per_beat, chunks, per_track, cancel_event)
+    _check_cancel(cancel_event)
+
+    merged, event_tracks = merge_note_events(per_track, None if channels is None else set(channels))
+    start_ticks, end_ticks, notes = pair_notes(merged, event_tracks)
+    sequence = group_notes(start_ticks, notes, ticks_per_beat, quantization_level, progress, cancel_event)
+    timing = element_timing(start_ticks, end_ticks, tempo_map, quantization_level, meter)
+
+    print(f"Successfully imported {len(sequence)} elements ({timing.total_seconds():.1f} s) "
+          f"from {len(per_track)} tracks of '{midi_filepath}'.")
+    return sequence, timing
+
+# --- Benchmark ---
+def _random_notes(count, ticks_per_beat, seed=0):
+    """Synthetic note onsets: a mix of single notes and chords with slightly humanized timing."""
+    rng = random.Random(seed)
+    start_ticks = array('L')
+    notes = array('B')
+    tick = 0
+    while len(notes) < count:
+        tick += rng.choice((ticks_per_beat // 4, ticks_per_beat // 2, ticks_per_beat))
+        for _ in range(rng.choice((1, 1, 1, 2, 3, 4))):
+            start_ticks.append(max(0, tick + rng.randint(-8, 8)))
+            notes.append(rng.randint(36, 96))
+    return start_ticks[:count], notes[:count]
+
+def bench(note_count, quantization_level, repeat):
+    ticks_per_beat = 480
+    start_ticks, notes = _random_notes(note_count, ticks_per_beat)
+    print(f"Grouping {len(notes)} notes (quantization {quantization_level}, best of {repeat}):")
+
+    def best_time(group):
+        best = float('inf')
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = group(start_ticks, notes, ticks_per_beat, quantization_level)
+            best = min(best, time.perf_counter() - t0)
+        return best, result
+
+    python_time, python_result = best_time(_group_notes_python)
+    print(f"  pure Python: {python_time * 1000:9.1f} ms  ({len(python_result)} elements)")
+    if np is None:
+        print("  numpy:       not installed")
+        return
+    numpy_time, numpy_result = best_time(_group_notes_numpy)
+    print(f"  numpy:       {numpy_time * 1000:9.1f} ms  ({len(numpy_result)} elements)")
+    print(f"  speedup: {python_time / numpy_time:.1f}x, identical: {python_result == numpy_result}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MIDI import helpers.")
+    parser.add_argument("command", choices=["bench"], help="'bench': time pure-Python vs NumPy chord grouping.")
+    parser.add_argument("--notes", type=int, default=1_000_000, help="Number of synthetic notes to group.")
+    parser.add_argument("--quantization", type=float, default=0.25, help="Quantization level in beats.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per path (the best time is reported).")
+    args = parser.parse_args()
+    bench(args.notes, args.quantization, args.repeat)
@@ -1,96 +1,934 @@
 import argparse
+import bisect
+import contextlib
+import glob
+import hashlib
+import io
+import json
 import os
-from mido import MidiFile, MidiTrack, Message
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import midi_reader
+
+# --- 增量构建清单 ---
+TOOL_VERSION = 2 # 分离/编译的输出改变时增加, 使旧清单中的所有记录失效
+MANIFEST_NAME = ".midi_tool_manifest.json"
+HASH_CHUNK = 1024 * 1024
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def replace_if_changed(tmp_path, path):
+    """
+    用临时文件替换 path, 但内容相同时保留原文件 (不改变修改时间) 并删除临时文件。
+    返回 (新内容的 sha256, 是否写入)。
+    """
+    digest = file_sha256(tmp_path)
+    if os.path.exists(path) and file_sha256(path) == digest:
+        os.remove(tmp_path)
+        return digest, False
+    os.replace(tmp_path, path)
+    return digest, True
+
+class BuildManifest:
+    """
+    输出目录中的构建清单: 每个源文件记录大小/修改时间、内容哈希、工具版本、选项和输出文件的哈希。
+    大小和修改时间都没变时不需要读取源文件; 只被 touch 过的文件通过哈希识别为未修改。
+    处理失败的源文件也被记录 (没有输出), 在源文件改变之前不再重试。
+    """
+    def __init__(self, output_dir):
+        self.output_dir = os.path.abspath(output_dir)
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("tool_version") == TOOL_VERSION:
+                self.entries = data["entries"]
+        except (OSError, ValueError, KeyError):
+            pass # 没有清单或清单损坏: 全部重新生成
+
+    @staticmethod
+    def _key(source):
+        return os.path.abspath(source)
+
+    def outputs(self, source):
+        """上次为 source 生成的输出 {路径: sha256}。"""
+        entry = self.entries.get(self._key(source))
+        return entry["outputs"] if entry else {}
+
+    def sources(self, midi_files):
+        """
+        去掉输出目录之内的文件和任何记录中的输出文件: 输出目录在输入目录之内时,
+        上次的输出不能被当作新的输入 (否则每次运行、--watch 的每次检查都会再分离一遍)。
+        """
+        output_prefix = os.path.join(self.output_dir, "")
+        generated = {path for entry in self.entries.values() for path in entry["outputs"]}
+        return [path for path in midi_files
+                if not os.path.abspath(path).startswith(output_prefix) and os.path.abspath(path) not in generated]
+
+    def is_current(self, source, options):
+        """source 自上次生成以来没有变化, 选项相同, 且所有输出文件都还在。"""
+        entry = self.entries.get(self._key(source))
+        if entry is None or entry["options"] != options:
+            return False
+        if not all(os.path.exists(path) for path in entry["outputs"]):
+            return False
+        st = os.stat(source)
+        if (st.st_size, st.st_mtime_ns) == (entry["size"], entry["mtime_ns"]):
+            return True
+        if file_sha256(source) != entry["sha256"]:
+            return False
+        entry["size"], entry["mtime_ns"] = st.st_size, st.st_mtime_ns # 只是被 touch 过
+        self.dirty = True
+        return True
+
+    def error(self, source):
+        """上次处理 source 失败时的错误信息, 否则为 None。"""
+        entry = self.entries.get(self._key(source))
+        return entry.get("error") if entry else None
+
+    def record(self, source, options, outputs, st, digest, error=None):
+        """
+        记录一次生成。st / digest: 处理之前取得的 os.stat 结果和源文件的 sha256,
+        这样处理期间源文件被修改时, 大小/修改时间和哈希都不匹配, 下次会重新生成。
+        error: 处理失败时的错误信息 (outputs 为空)。
+        """
+        self.entries[self._key(source)] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": digest,
+            "options": options,
+            "outputs": {os.path.abspath(path): digest for path, digest in outputs.items()},
+            "error": error,
+        }
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"tool_version": TOOL_VERSION, "entries": self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+def watch(run, interval):
+    """
+    每 interval 秒调用一次 run(verbose) 直到 Ctrl+C。run 依靠清单只处理新增或修改过的文件,
+    所以除了第一次以外只在有变化时才输出信息。
+    """
+    print(f"监视中, 每 {interval:g} 秒检查一次 (Ctrl+C 退出)...")
+    verbose = True
+    try:
+        while True:
+            run(verbose)
+            verbose = False
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("停止监视。")
+
+# --- MIDI 分析 ---
+TRACK_NAME = 0x03
+ANALYZE_CHUNKSIZE = 8 # 每次交给工作进程的文件数, 减少大量小文件时的进程间通信
+
+def decode_text(raw):
+    """解码元事件中的文本: 依次尝试 UTF-8、GBK (常见于中文 MIDI) 和 Latin-1。"""
+    for encoding in ("utf-8", "gbk"):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return raw.decode('latin-1')
+
+def analyze_track(data, start, end):
+    """
+    一次遍历统计一个轨道: 每个通道的音符数、音高范围、最大复音数、结束 tick、速度变化和乐器变化。
+    返回 (统计 dict, [(tick, 每拍微秒数)])。
+    """
+    channel_notes = {}
+    programs = []
+    tempo_changes = []
+    sounding = {} # key: (channel, note), value: 正在发声的次数
+    polyphony = peak = 0
+    low = high = None
+    name = None
+    messages = 0
+    tick = 0
+    for tick, message in midi_reader.iter_track_messages(data, start, end):
+        messages += 1
+        status = message[0]
+        kind = status & 0xF0
+        if kind == 0x90 and message[2]:
+            channel = status & 0x0F
+            note = message[1]
+            channel_notes[channel] = channel_notes.get(channel, 0) + 1
+            key = (channel, note)
+            sounding[key] = sounding.get(key, 0) + 1
+            polyphony += 1
+            if polyphony > peak:
+                peak = polyphony
+            if low is None or note < low:
+                low = note
+            if high is None or note > high:
+                high = note
+        elif kind == 0x80 or kind == 0x90:
+            key = (status & 0x0F, message[1])
+            if sounding.get(key):
+                sounding[key] -= 1
+                polyphony -= 1
+        elif kind == 0xC0:
+            programs.append((status & 0x0F, message[1]))
+        elif status == 0xFF:
+            meta_type = message[1]
+            length, body = midi_reader.read_varlen(message, 2)
+            if meta_type == midi_reader.SET_TEMPO and length == 3:
+                tempo_changes.append((tick, int.from_bytes(message[body:body + 3], 'big')))
+            elif meta_type == TRACK_NAME and name is None:
+                name = decode_text(message[body:body + length])
+    stats = {
+        "name": name,
+        "messages": messages,
+        "notes": sum(channel_notes.values()),
+        "channel_notes": {str(channel): count for channel, count in sorted(channel_notes.items())},
+        "pitch_range": [low, high] if low is not None else None,
+        "polyphony_peak": peak,
+        "end_tick": tick,
+        "tempo_changes": len(tempo_changes),
+        "programs": [[channel, program] for channel, program in programs],
+    }
+    return stats, tempo_changes
+
+def analyze_file(midi_file_path):
+    """
+    分析一个 MIDI 文件 (在工作进程中运行), 返回一条可以写成 JSON 的记录。
+    出错时记录中的 "error" 为错误信息, 不会中断整批分析。
+    """
+    start = time.perf_counter()
+    record = {"file": midi_file_path}
+    try:
+        with midi_reader.mapped_tracks(midi_file_path) as (midi_format, ticks_per_beat, data, chunks):
+            tracks = []
+            tempo_changes = []
+            for index, (chunk_start, chunk_end) in enumerate(chunks):
+                stats, track_tempo_changes = analyze_track(data, chunk_start, chunk_end)
+                tracks.append(dict(track=index, **stats))
+                tempo_changes.extend(track_tempo_changes)
+        tempo_map = midi_reader.TempoMap(ticks_per_beat, tempo_changes)
+        for stats in tracks:
+            stats["duration_seconds"] = round(tempo_map.tick_to_seconds(stats["end_tick"]), 3)
+        record.update({
+            "format": midi_format,
+            "ticks_per_beat": ticks_per_beat,
+            "track_count": len(tracks),
+            "notes": sum(stats["notes"] for stats in tracks),
+            "duration_seconds": max((stats["duration_seconds"] for stats in tracks), default=0.0),
+            "tempo_changes": len(tempo_changes),
+            "tracks": tracks,
+            "error": None,
+        })
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["analyze_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return record
+
+def print_analysis(record):
+    """以文本形式显示一个 analyze_file 记录。"""
+    if record["error"]:
+        print(f"错误: 无法解析 MIDI 文件 {record['file']} - {record['error']}")
+        return
+    print(f"分析 MIDI 文件: {record['file']}")
+    print(f"  轨道数量: {record['track_count']}")
+    print(f"  文件类型 (format): {record['format']}")
+    print(f"  每拍刻度 (ticks_per_beat): {record['ticks_per_beat']}")
+    print(f"  时长: {record['duration_seconds']:.1f} 秒, 音符数量: {record['notes']}, 速度变化: {record['tempo_changes']}")
+
+    print("\n  轨道信息:")
+    for stats in record["tracks"]:
+        name = f" ({stats['name']})" if stats["name"] else ""
+        print(f"    轨道 {stats['track']}{name}: 长度 {stats['messages']} 事件")
+        if stats["programs"]:
+            print(f"      检测到的乐器变化: {', '.join(f'  通道 {channel}, 乐器 {program}' for channel, program in stats['programs'])}")
+        else:
+            print("      未检测到 Program Change 消息")
+        if stats["notes"]:
+            per_channel = ", ".join(f"通道 {channel}: {count}" for channel, count in stats["channel_notes"].items())
+            low, high = stats["pitch_range"]
+            print(f"      音符: {stats['notes']} ({per_channel}), 音高范围 {low}-{high}, 最大复音数 {stats['polyphony_peak']}, "
+                  f"时长 {stats['duration_seconds']:.1f} 秒")
 
 def analyze_midi(midi_file_path):
     """
     解析MIDI文件并显示基本信息。
     """
+    print_analysis(analyze_file(midi_file_path))
+
+def expand_midi_inputs(inputs):
+    """把文件、目录 (递归) 和通配符 (支持 **) 展开为去重后的 MIDI 文件列表, 保持输入顺序。"""
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found.extend(find_midi_files(item))
+        elif glob.has_magic(item):
+            found.extend(sorted(path for path in glob.glob(item, recursive=True)
+                                if os.path.isfile(path) and path.lower().endswith((".mid", ".midi"))))
+        else:
+            found.append(item)
+    return list(dict.fromkeys(found))
+
+def _report_analyses(records, out, as_json):
+    """按输入顺序输出分析结果 (map 保持输入顺序, 输出是确定的)。返回失败文件的数量。"""
+    failed = 0
+    for record in records:
+        if record["error"]:
+            failed += 1
+        if as_json:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            print_analysis(record)
+    return failed
+
+def analyze_files(inputs, output=None, workers=None, as_json=False):
+    """
+    用进程池分析多个 MIDI 文件。as_json 时每个文件输出一行 JSON (JSON Lines) 到 output 或标准输出,
+    统计信息打印到标准错误; 否则逐个显示文本报告。返回失败文件的数量。
+    """
+    midi_files = expand_midi_inputs(inputs)
+    start = time.perf_counter()
+    out = sys.stdout
+    if as_json and output and output != "-":
+        out = open(output, 'w', encoding='utf-8')
     try:
-        mid = MidiFile(midi_file_path)
-        print(f"分析 MIDI 文件: {midi_file_path}")
-        print(f"  轨道数量: {len(mid.tracks)}")
-        print(f"  文件类型 (format): {mid.type}")
-        print(f"  每拍刻度 (ticks_per_beat): {mid.ticks_per_beat}")
-
-        print("\n  轨道信息:")
-        for i, track in enumerate(mid.tracks):
-            print(f"    轨道 {i}: 长度 {len(track)} 事件")
-            program_changes = []
-            for msg in track:
-                if msg.type == 'program_change':
-                    program_changes.append(f"  通道 {msg.channel}, 乐器 {msg.program}")
-            if program_changes:
-                print(f"      检测到的乐器变化: {', '.join(program_changes)}")
-            else:
-                print("      未检测到 Program Change 消息")
+        if len(midi_files) > 1 and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                failed = _report_analyses(executor.map(analyze_file, midi_files, chunksize=ANALYZE_CHUNKSIZE),
+                                          out, as_json)
+        else:
+            failed = _report_analyses(map(analyze_file, midi_files), out, as_json)
+    finally:
+        if out is not sys.stdout:
+            out.close()
 
-    except Exception as e:
-        print(f"错误: 无法解析 MIDI 文件 {midi_file_path} - {e}")
+    if as_json or len(midi_files) > 1:
+        elapsed = time.perf_counter() - start
+        rate = f", {len(midi_files) / elapsed:.1f} 文件/秒" if elapsed > 0 else ""
+        print(f"分析完成: {len(midi_files)} 个文件, 失败 {failed}, 用时 {elapsed:.2f} 秒{rate}",
+              file=sys.stderr if as_json else sys.stdout)
+    return failed
+
+# --- 流式乐器分离引擎 ---
+GLOBAL_META_TYPES = {0x51, 0x58, 0x59} # set_tempo, time_signature, key_signature: 复制到每个输出文件
+END_OF_TRACK = b"\xff\x2f\x00"
+WRITE_BUFFER_BYTES = 64 * 1024
+
+def encode_varlen(value):
+    """把整数编码为 MIDI 可变长度数值。"""
+    if value < 0x80: # 最常见的情况: 单字节
+        return bytes((value,))
+    encoded = bytearray((value & 0x7F,))
+    value >>= 7
+    while value:
+        encoded.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(encoded)
+
+def route_by_instrument(messages):
+    """
+    把按绝对 tick 合并的消息流 (midi_reader.merged_messages) 分配到各个 (通道, 乐器) 流。
+    产生 (key, tick, message): key 为 (channel, program); 全局元事件 (速度、拍号、调号) 的 key 为 None,
+    应该写入所有输出。与以前一样, 只有出现过 Program Change 的通道才会被分离。
+    note_off 总是跟随它的 note_on 所在的流, 即使中间通道换了乐器。
+    """
+    programs = {} # key: channel, value: program
+    sounding = {} # key: (channel, note), value: note_on 所在流的 key
+    for tick, _, message in messages:
+        status = message[0]
+        if status == 0xFF:
+            if message[1] in GLOBAL_META_TYPES:
+                yield None, tick, message
+            continue
+        if status >= 0xF0: # SysEx / 系统消息不分离
+            continue
+        channel = status & 0x0F
+        kind = status & 0xF0
+        if kind == 0xC0:
+            programs[channel] = message[1]
+            continue
+        if channel not in programs:
+            continue
+        key = (channel, programs[channel])
+        if kind == 0x90 and message[2]:
+            sounding[(channel, message[1])] = key
+        elif kind == 0x80 or kind == 0x90:
+            key = sounding.pop((channel, message[1]), key)
+        yield key, tick, message
+
+class TrackFileWriter:
+    """
+    把 MIDI 文件边生成边写入磁盘: 由绝对 tick 重新计算 delta time, 每个轨道结束时回填 MTrk 长度。
+    track_count 大于 1 时, 用 next_track() 依次开始后面的轨道。
+    先写入临时文件, close() 时原子替换, 出错时 abort() 删除临时文件。每个输出只占用一个文件缓冲区的内存。
+    """
+    def __init__(self, path, midi_format, ticks_per_beat, track_count=1):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.file = open(self.tmp_path, 'wb', buffering=WRITE_BUFFER_BYTES)
+        self.file.write(b"MThd" + struct.pack(">IHHh", 6, midi_format, track_count, ticks_per_beat))
+        self.message_count = 0
+        self._start_track()
+
+    def _start_track(self):
+        self.length_pos = self.file.tell() + 4
+        self.file.write(b"MTrk\x00\x00\x00\x00") # 长度在轨道结束时回填
+        self.track_bytes = 0
+        self.tick = 0
+
+    def _end_track(self, end_tick=None):
+        self.write(max(self.tick, end_tick or 0), END_OF_TRACK)
+        self.file.seek(self.length_pos)
+        self.file.write(struct.pack(">I", self.track_bytes))
+        self.file.seek(0, os.SEEK_END)
+
+    def write(self, tick, message):
+        chunk = encode_varlen(tick - self.tick) + message
+        self.file.write(chunk)
+        self.track_bytes += len(chunk)
+        self.tick = tick
+        self.message_count += 1
+
+    def next_track(self, end_tick=None):
+        """结束当前轨道 (end_of_track 不早于 end_tick) 并开始下一个轨道。"""
+        self._end_track(end_tick)
+        self._start_track()
+
+    def close(self, end_tick=None):
+        """完成文件。内容与已有文件相同时不覆盖。返回 (sha256, 是否写入)。"""
+        self._end_track(end_tick)
+        self.file.close()
+        return replace_if_changed(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        with contextlib.suppress(OSError):
+            os.remove(self.tmp_path)
+
+# --- 内存中的乐器分离 (gui4 的乐器选择) ---
+class InstrumentParts:
+    """
+    一次扫描得到的所有 (通道, 乐器) 声部: 每个声部的音符事件 (midi_reader.NoteEvents),
+    以及整个文件的速度表和拍号, 之后可以直接从内存导入任意一个声部, 不需要写出分离文件。
+    """
+    def __init__(self, midi_file_path, ticks_per_beat, parts, tempo_map, meter):
+        self.midi_file_path = midi_file_path
+        self.ticks_per_beat = ticks_per_beat
+        self.parts = parts # key: (channel, program), value: NoteEvents
+        self.tempo_map = tempo_map
+        self.meter = meter
+
+    def note_counts(self):
+        """返回 [((channel, program), 音符数量)], 按通道和乐器排序。"""
+        return [(key, sum(1 for velocity in events.velocities if velocity)) for key, events in sorted(self.parts.items())]
+
+    def read_sequence(self, key, quantization_level=0.25, progress=None, cancel_event=None):
+        """把一个声部转换为 (sequence, timing), 与 midi_reader.read_timed_sequence 的结果相同。"""
+        events = self.parts[key]
+        start_ticks, end_ticks, notes = midi_reader.pair_notes(events)
+        sequence = midi_reader.group_notes(start_ticks, notes, self.ticks_per_beat, quantization_level, progress, cancel_event)
+        timing = midi_reader.element_timing(start_ticks, end_ticks, self.tempo_map, quantization_level, self.meter)
+        return sequence, timing
+
+def scan_instrument_parts(midi_file_path, progress=None, cancel_event=None):
+    """
+    用与 separate 相同的分离逻辑 (route_by_instrument) 扫描一遍文件, 把每个 (通道, 乐器) 声部的
+    音符事件收集到内存中。progress / cancel_event 与 midi_reader 的导入函数相同。返回 InstrumentParts。
+    """
+    parts = {}
+    tempo_changes = []
+    time_signatures = []
+    with midi_reader.merged_messages(midi_file_path) as (_, ticks_per_beat, messages):
+        for parsed, (key, tick, message) in enumerate(route_by_instrument(messages), 1):
+            if parsed % midi_reader.PROGRESS_INTERVAL == 0:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise midi_reader.ImportCancelled()
+                if progress:
+                    progress("messages", parsed, None)
+            if key is None:
+                length, body = midi_reader.read_varlen(message, 2)
+                if message[1] == midi_reader.SET_TEMPO and length == 3:
+                    tempo_changes.append((tick, int.from_bytes(message[body:body + 3], 'big')))
+                elif message[1] == midi_reader.TIME_SIGNATURE and length >= 2:
+                    time_signatures.append((tick, message[body], 1 << message[body + 1]))
+                continue
+            kind = message[0] & 0xF0
+            if kind != 0x90 and kind != 0x80:
+                continue
+            events = parts.get(key)
+            if events is None:
+                events = parts[key] = midi_reader.NoteEvents(ticks_per_beat, 1)
+            events.ticks.append(tick)
+            events.notes.append(message[1])
+            events.velocities.append(message[2] if kind == 0x90 else 0)
+            events.channels.append(key[0])
+    return InstrumentParts(midi_file_path, ticks_per_beat, parts,
+                           midi_reader.TempoMap(ticks_per_beat, tempo_changes),
+                           midi_reader.Meter(ticks_per_beat, time_signatures))
 
 def separate_midi_by_instrument(midi_file_path, output_dir="separated_midi"):
     """
     将MIDI文件按乐器分离到不同的轨道并导出为独立的MIDI文件。
+    所有轨道只读取一遍 (按绝对 tick 合并), 每个输出文件都带有完整的速度/拍号信息,
+    事件的 delta time 按输出轨道重新计算, 所以被过滤掉的事件不会影响时间。
+    内容没有变化的输出文件不会被覆盖。返回 {输出路径: sha256}, 失败时返回 None。
     """
+    writers = {} # key: (channel, program), value: TrackFileWriter
     try:
-        mid = MidiFile(midi_file_path)
-        
-        # 存储按乐器分离的轨道
-        instrument_tracks = {} # key: (channel, program), value: MidiTrack
-
-        for track in mid.tracks:
-            current_program = {} # key: channel, value: program
-            for msg in track:
-                if msg.type == 'program_change':
-                    current_program[msg.channel] = msg.program
-                
-                # 如果是音符事件或其他需要分离的事件
-                if msg.type in ['note_on', 'note_off', 'control_change', 'pitchwheel'] and msg.channel in current_program:
-                    key = (msg.channel, current_program[msg.channel])
-                    if key not in instrument_tracks:
-                        instrument_tracks[key] = MidiTrack()
-                        # 添加 Program Change 消息到新轨道的开头
-                        instrument_tracks[key].append(Message('program_change', channel=msg.channel, program=current_program[msg.channel], time=0))
-                    instrument_tracks[key].append(msg)
-                elif msg.type == 'set_tempo': # 通常在第一个轨道，需要保留
-                    if (0,0) not in instrument_tracks: # 假设通用事件可以放到一个默认轨道
-                        instrument_tracks[(0,0)] = MidiTrack()
-                    instrument_tracks[(0,0)].append(msg)
-                elif msg.is_meta: # 元事件，如时间签名，文本事件等，也放到一个默认轨道
-                    if (0,0) not in instrument_tracks:
-                        instrument_tracks[(0,0)] = MidiTrack()
-                    instrument_tracks[(0,0)].append(msg)
-                
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
+        os.makedirs(output_dir, exist_ok=True)
         base_name = os.path.splitext(os.path.basename(midi_file_path))[0]
-        
-        for (channel, program), track in instrument_tracks.items():
-            new_mid = MidiFile()
-            new_mid.type = mid.type # 保持文件类型
-            new_mid.ticks_per_beat = mid.ticks_per_beat # 保持每拍刻度
-            new_mid.tracks.append(track)
-            
-            output_file_name = os.path.join(output_dir, f"{base_name}_channel{channel}_instrument{program}.mid")
-            new_mid.save(output_file_name)
-            print(f"导出乐器轨道 (通道: {channel}, 乐器: {program}) 到: {output_file_name}")
+        global_meta = [] # (tick, message): 之后新建的输出文件也要从头写入这些元事件
+
+        with midi_reader.merged_messages(midi_file_path) as (midi_format, ticks_per_beat, messages):
+            for key, tick, message in route_by_instrument(messages):
+                if key is None:
+                    global_meta.append((tick, message))
+                    for writer in writers.values():
+                        writer.write(tick, message)
+                    continue
+                writer = writers.get(key)
+                if writer is None:
+                    channel, program = key
+                    output_file_name = os.path.join(output_dir, f"{base_name}_channel{channel}_instrument{program}.mid")
+                    writer = writers[key] = TrackFileWriter(output_file_name, midi_format, ticks_per_beat)
+                    # 在新轨道的开头添加 Program Change 消息和之前的全局元事件
+                    writer.write(0, bytes((0xC0 | channel, program)))
+                    for meta_tick, meta in global_meta:
+                        writer.write(meta_tick, meta)
+                writer.write(tick, message)
+
+        outputs = {}
+        for (channel, program), writer in writers.items():
+            outputs[writer.path], changed = writer.close()
+            state = "" if changed else " (内容未变化, 未覆盖)"
+            print(f"导出乐器轨道 (通道: {channel}, 乐器: {program}, {writer.message_count} 个事件) 到: {writer.path}{state}")
+        if not writers:
+            print(f"未在 {midi_file_path} 中找到带有 Program Change 的通道, 没有导出文件。")
+        return outputs
 
     except Exception as e:
+        for writer in writers.values():
+            if not writer.file.closed:
+                writer.abort()
         print(f"错误: 无法分离 MIDI 文件 {midi_file_path} - {e}")
+        return None
+
+def separate_files(inputs, output_dir="separated_midi", force=False, verbose=True):
+    """
+    分离多个 MIDI 文件 (文件、目录或通配符), 跳过清单中记录为未变化的输入 (包括上次失败的),
+    并删除源文件不再生成的旧输出。返回失败文件的数量 (包括未变化而跳过的失败文件)。
+    """
+    manifest = BuildManifest(output_dir)
+    options = {"command": "separate"}
+    midi_files = manifest.sources(expand_midi_inputs(inputs))
+    separated = skipped = failed = known_failed = 0
+    try:
+        for midi_file_path in midi_files:
+            if not force and manifest.is_current(midi_file_path, options):
+                if manifest.error(midi_file_path):
+                    known_failed += 1
+                else:
+                    skipped += 1
+                continue
+            st = os.stat(midi_file_path)
+            digest = file_sha256(midi_file_path) # 在处理之前计算, 记录的是被处理的内容
+            outputs = separate_midi_by_instrument(midi_file_path, output_dir)
+            error = None
+            if outputs is None:
+                outputs, error = {}, "分离失败"
+            new_paths = {os.path.abspath(path) for path in outputs}
+            for old_path in manifest.outputs(midi_file_path):
+                if old_path not in new_paths and os.path.exists(old_path):
+                    os.remove(old_path)
+                    print(f"删除不再生成的旧输出: {old_path}")
+            manifest.record(midi_file_path, options, outputs, st, digest, error)
+            if error:
+                failed += 1
+            else:
+                separated += 1
+    finally:
+        manifest.save()
+    if verbose or separated or failed:
+        print(f"分离完成: 处理 {separated}, 失败 {failed}, 未变化跳过 {skipped}"
+              + (f", 未变化的失败文件 {known_failed}" if known_failed else ""))
+    return failed + known_failed
+
+# --- 按时间范围切片 ---
+INDEX_INTERVAL = 256 # 每个轨道每隔多少条消息记录一个检查点
+STATE_META_TYPES = {0x51: 0, 0x58: 1, 0x59: 2} # set_tempo, time_signature, key_signature -> 写入顺序
+BANK_SELECT = {0, 32} # 必须在 Program Change 之前发送的控制器
+
+class TickIndex:
+    """
+    一个 MIDI 文件的绝对 tick 索引, 只需解析一遍文件:
+    - 每个轨道每隔 INDEX_INTERVAL 条消息一个检查点 (消息的 tick, 字节位置, 之前的 tick 和 running status),
+      用 bisect 找到开始 tick 之前最近的检查点, 从那里继续解码, 不用从头扫描;
+    - 所有状态事件 (速度、拍号、调号、乐器、控制器、弯音) 按 key 分别记录,
+      任意时刻的状态就是每个 key 在该时刻之前的最后一个事件, 同样用 bisect 查找。
+    """
+    def __init__(self, midi_file_path):
+        self.midi_file_path = midi_file_path
+        self.checkpoints = [] # 每个轨道: (ticks, positions, base_ticks, running_statuses)
+        self.state_events = {} # key -> (ticks, tracks, messages)
+        tempo_changes = []
+        time_signatures = []
+        with midi_reader.mapped_tracks(midi_file_path) as (self.midi_format, self.ticks_per_beat, data, self.chunks):
+            for track_index, (start, end) in enumerate(self.chunks):
+                ticks, positions, base_ticks, statuses = array('L'), array('L'), array('L'), array('B')
+                pos, tick, running_status = start, 0, 0
+                for count, (message_tick, message, next_pos, next_status) in enumerate(
+                        midi_reader.iter_track_positions(data, start, end)):
+                    if count % INDEX_INTERVAL == 0:
+                        ticks.append(message_tick)
+                        positions.append(pos)
+                        base_ticks.append(tick)
+                        statuses.append(running_status)
+                    pos, tick, running_status = next_pos, message_tick, next_status or 0
+                    key = self._state_key(message)
+                    if key is not None:
+                        self._add_state(key, message_tick, track_index, message)
+                        if key[0] == "meta":
+                            length, body = midi_reader.read_varlen(message, 2)
+                            if key[1] == midi_reader.SET_TEMPO and length == 3:
+                                tempo_changes.append((message_tick, int.from_bytes(message[body:body + 3], 'big')))
+                            elif key[1] == midi_reader.TIME_SIGNATURE and length >= 2:
+                                time_signatures.append((message_tick, message[body], 1 << message[body + 1]))
+                self.checkpoints.append((ticks, positions, base_ticks, statuses))
+        self._sort_state()
+        self.tempo_map = midi_reader.TempoMap(self.ticks_per_beat, tempo_changes)
+        self.meter = midi_reader.Meter(self.ticks_per_beat, time_signatures)
+
+    @staticmethod
+    def _state_key(message):
+        status = message[0]
+        kind = status & 0xF0
+        if kind == 0xB0:
+            return (status, message[1])
+        if kind == 0xC0 or kind == 0xE0:
+            return (status,)
+        if status == 0xFF and message[1] in STATE_META_TYPES:
+            return ("meta", message[1])
+        return None
+
+    def _add_state(self, key, tick, track_index, message):
+        events = self.state_events.get(key)
+        if events is None:
+            events = self.state_events[key] = (array('L'), array('H'), [])
+        ticks, tracks, messages = events
+        ticks.append(tick)
+        tracks.append(track_index)
+        messages.append(message)
+
+    def _sort_state(self):
+        """
+        状态事件是逐个轨道追加的, 同一个 key 出现在多个轨道时 (例如速度在任意轨道中) tick 并不有序。
+        按 (tick, 轨道) 稳定排序, 同一轨道内保持文件顺序, 这样 bisect 才能找到正确的状态。
+        """
+        for key, (ticks, tracks, messages) in self.state_events.items():
+            order = sorted(range(len(ticks)), key=lambda i: (ticks[i], tracks[i]))
+            if order != list(range(len(ticks))):
+                self.state_events[key] = (array('L', (ticks[i] for i in order)), array('H', (tracks[i] for i in order)),
+                                          [messages[i] for i in order])
+
+    def state_at(self, tick):
+        """在 tick 时刻生效的状态: [(轨道, 消息)], 按 元事件, 音色库选择, 乐器, 其他控制器, 弯音 排序。"""
+        state = []
+        for key, (ticks, tracks, messages) in self.state_events.items():
+            i = bisect.bisect_left(ticks, tick) - 1 # 只算严格早于 tick 的事件, 同一 tick 的事件属于切片本身
+            if i >= 0:
+                state.append((self._state_order(key), tracks[i], messages[i]))
+        state.sort(key=lambda item: item[0])
+        return [(track_index, message) for _, track_index, message in state]
+
+    @staticmethod
+    def _state_order(key):
+        if key[0] == "meta":
+            return (0, STATE_META_TYPES[key[1]])
+        kind = key[0] & 0xF0
+        if kind == 0xB0:
+            return (1 if key[1] in BANK_SELECT else 3, key[0] & 0x0F, key[1])
+        return (2 if kind == 0xC0 else 4, key[0] & 0x0F)
+
+    def iter_range(self, data, track_index, start_tick, end_tick):
+        """从最近的检查点开始解码一个轨道, 产生 start_tick <= tick < end_tick 的 (tick, message)。"""
+        ticks, positions, base_ticks, statuses = self.checkpoints[track_index]
+        if not ticks:
+            return
+        i = max(0, bisect.bisect_left(ticks, start_tick) - 1)
+        _, end = self.chunks[track_index]
+        for tick, message in midi_reader.iter_track_messages(data, positions[i], end, base_ticks[i], statuses[i] or None):
+            if tick >= end_tick:
+                return
+            if tick >= start_tick and message != END_OF_TRACK:
+                yield tick, message
+
+    def tick_range(self, unit, first, last):
+        """把 bars (从 1 开始, 包含 last)、beats (从 0 开始) 或 seconds 的范围转换为 [start_tick, end_tick)。"""
+        if unit == "bars":
+            start, end = self.meter.bar_start(int(first)), self.meter.bar_start(int(last) + 1)
+            return round(start * self.ticks_per_beat), round(end * self.ticks_per_beat)
+        if unit == "beats":
+            return round(first * self.ticks_per_beat), round(last * self.ticks_per_beat)
+        return round(self.tempo_map.seconds_to_tick(first)), round(self.tempo_map.seconds_to_tick(last))
+
+def write_slice(index, data, output_path, start_tick, end_tick):
+    """
+    把 [start_tick, end_tick) 写成一个新的 MIDI 文件 (与源文件相同的格式和轨道数), tick 从 0 开始。
+    切点处生效的速度/拍号/乐器/控制器状态写在开头; 在切片结束时仍在发声的音符在结尾补上 note_off,
+    在切片开始前按下的音符的 note_off 被丢弃。返回写入的消息数量。
+    """
+    state = index.state_at(start_tick)
+    length = end_tick - start_tick
+    writer = TrackFileWriter(output_path, index.midi_format, index.ticks_per_beat, len(index.chunks))
+    try:
+        for track_index in range(len(index.chunks)):
+            if track_index:
+                writer.next_track(length)
+            for state_track, message in state:
+                if state_track == track_index:
+                    writer.write(0, message)
+            sounding = {} # key: (channel, note), value: 切片中发声的次数
+            for tick, message in index.iter_range(data, track_index, start_tick, end_tick):
+                kind = message[0] & 0xF0
+                if kind == 0x90 and message[2]:
+                    key = (message[0] & 0x0F, message[1])
+                    sounding[key] = sounding.get(key, 0) + 1
+                elif kind == 0x80 or kind == 0x90:
+                    key = (message[0] & 0x0F, message[1])
+                    if not sounding.get(key):
+                        continue
+                    sounding[key] -= 1
+                writer.write(tick - start_tick, message)
+            for (channel, note), count in sounding.items():
+                for _ in range(count):
+                    writer.write(length, bytes((0x80 | channel, note, 0)))
+        writer.close(length)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.message_count
+
+def parse_range(text):
+    """解析 '32-48' 这样的范围, 返回 (first, last) 两个数。"""
+    first, separator, last = text.partition("-")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"范围格式应为 A-B: {text}")
+    try:
+        return float(first), float(last)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"范围格式应为 A-B: {text}")
+
+def slice_midi(midi_file_path, ranges, output_dir="sliced_midi"):
+    """
+    从一个 MIDI 文件中切出多个时间范围, 只建立一次索引。ranges: [(单位, first, last)],
+    单位为 'bars' / 'beats' / 'seconds'。返回失败的切片数量。
+    """
+    start = time.perf_counter()
+    index = TickIndex(midi_file_path)
+    print(f"索引 {midi_file_path}: {len(index.chunks)} 个轨道, 用时 {(time.perf_counter() - start) * 1000:.1f} 毫秒")
+    os.makedirs(output_dir, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(midi_file_path))[0]
+    failed = 0
+    with midi_reader.mapped_tracks(midi_file_path) as (_, _, data, _):
+        for unit, first, last in ranges:
+            start_tick, end_tick = index.tick_range(unit, first, last)
+            if end_tick <= start_tick:
+                print(f"错误: 范围 {unit} {first:g}-{last:g} 为空。")
+                failed += 1
+                continue
+            output_path = os.path.join(output_dir, f"{base_name}_{unit}{first:g}-{last:g}.mid")
+            slice_start = time.perf_counter()
+            count = write_slice(index, data, output_path, start_tick, end_tick)
+            print(f"导出 {unit} {first:g}-{last:g} (tick {start_tick}-{end_tick}, {count} 个事件) 到: {output_path} "
+                  f"({(time.perf_counter() - slice_start) * 1000:.1f} 毫秒)")
+    return failed
+
+def find_midi_files(input_dir):
+    """递归查找目录下的所有 .mid / .midi 文件 (按路径排序)。"""
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith((".mid", ".midi")):
+                found.append(os.path.join(root, name))
+    return found
+
+def compiled_output_path(midi_file_path, input_dir, output_dir):
+    """输出路径: 在 output_dir 下保持与 input_dir 相同的目录结构, 扩展名改为 .json。"""
+    relative = os.path.relpath(midi_file_path, input_dir)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + ".json")
+
+def compile_midi_file(midi_file_path, output_path, track_index=None, quantization_level=0.25):
+    """
+    将一个 MIDI 文件编译为 gui4 可以加载的 JSON 序列 (在工作进程中运行)。
+    track_index 为 None 时合并所有轨道。任何错误都只影响这一个文件。内容没有变化时不覆盖输出。
+    返回 (midi_file_path, 元素数量, 错误信息或 None, 耗时秒数, 源文件的 sha256, 输出的 sha256, 是否写入),
+    源文件的哈希在解析之前计算, 供构建清单记录。
+    """
+    start = time.perf_counter()
+    source_digest = None
+    try:
+        source_digest = file_sha256(midi_file_path)
+        with contextlib.redirect_stdout(io.StringIO()): # 工作进程中不打印每个文件的导入信息
+            if track_index is None:
+                sequence = midi_reader.read_merged_sequence(midi_file_path, quantization_level=quantization_level)
+            else:
+                sequence = midi_reader.read_sequence(midi_file_path, track_index, quantization_level)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(sequence, f)
+        digest, changed = replace_if_changed(tmp_path, output_path) # 原子替换, 中断时不会留下半个输出文件
+        return midi_file_path, len(sequence), None, time.perf_counter() - start, source_digest, digest, changed
+    except Exception as e:
+        return midi_file_path, 0, f"{type(e).__name__}: {e}", time.perf_counter() - start, source_digest, None, False
+
+def compile_directory(input_dir, output_dir, workers=None, track_index=None, quantization_level=0.25, force=False,
+                      verbose=True):
+    """
+    用进程池把 input_dir 下所有 MIDI 文件编译为 JSON 序列, 跳过清单中记录为未变化的文件
+    (包括上次失败的), 最后打印吞吐量统计。返回失败文件的数量 (包括未变化而跳过的失败文件)。
+    """
+    manifest = BuildManifest(output_dir)
+    options = {"command": "compile", "track": track_index, "quantization": quantization_level}
+    midi_files = manifest.sources(find_midi_files(input_dir))
+    jobs = []
+    skipped = known_failed = 0
+    for midi_file_path in midi_files:
+        output_path = compiled_output_path(midi_file_path, input_dir, output_dir)
+        if not force and manifest.is_current(midi_file_path, options):
+            if manifest.error(midi_file_path):
+                known_failed += 1
+            else:
+                skipped += 1
+        else:
+            jobs.append((midi_file_path, output_path, os.stat(midi_file_path)))
+
+    if not verbose and not jobs:
+        manifest.save()
+        return known_failed
+    print(f"找到 {len(midi_files)} 个 MIDI 文件: 需要编译 {len(jobs)} 个, 未变化 {skipped} 个"
+          + (f", 未变化的失败文件 {known_failed} 个。" if known_failed else "。"))
+    start = time.perf_counter()
+    compiled = failed = elements = unchanged = 0
+    input_bytes = 0
+    busy_seconds = 0.0
+    try:
+        if jobs:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(compile_midi_file, midi_file_path, output_path, track_index, quantization_level):
+                           (output_path, st) for midi_file_path, output_path, st in jobs}
+                for done, future in enumerate(as_completed(futures), 1):
+                    try:
+                        midi_file_path, count, error, seconds, source_digest, digest, changed = future.result()
+                    except Exception as e: # 工作进程异常退出
+                        failed += 1
+                        print(f"错误: 工作进程失败 - {e}")
+                        continue
+                    busy_seconds += seconds
+                    output_path, st = futures[future]
+                    if error:
+                        failed += 1
+                        manifest.record(midi_file_path, options, {}, st, source_digest, error)
+                        print(f"[{done}/{len(jobs)}] 错误: {midi_file_path} - {error}")
+                    else:
+                        compiled += 1
+                        elements += count
+                        input_bytes += os.path.getsize(midi_file_path)
+                        manifest.record(midi_file_path, options, {output_path: digest}, st, source_digest)
+                        if not changed:
+                            unchanged += 1
+                        state = "" if changed else " (输出内容未变化, 未覆盖)"
+                        print(f"[{done}/{len(jobs)}] {midi_file_path}: {count} 个元素{state}")
+    finally:
+        manifest.save()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n编译完成: 成功 {compiled} (其中输出未变化 {unchanged}), 失败 {failed}, 跳过 {skipped}, 用时 {elapsed:.2f} 秒")
+    if elapsed > 0 and compiled:
+        print(f"  吞吐量: {compiled / elapsed:.1f} 文件/秒, {input_bytes / elapsed / 1024 / 1024:.2f} MB/秒, "
+              f"{elements / elapsed:.0f} 元素/秒")
+        print(f"  每个文件平均耗时: {busy_seconds / (compiled + failed) * 1000:.1f} 毫秒 (工作进程内)")
+    return failed + known_failed
 
 def main():
     parser = argparse.ArgumentParser(description="一个用于解析和编辑 MIDI 文件的命令行工具。")
-    parser.add_argument("command", choices=["analyze", "separate"], help="要执行的命令 ('analyze' 或 'separate').")
-    parser.add_argument("midi_file", help="要处理的 MIDI 文件路径。")
-    parser.add_argument("--output_dir", default="separated_midi", help="分离MIDI文件时的输出目录 (默认为 'separated_midi').")
+    subparsers = parser.add_subparsers(dest="command", required=True, help="要执行的命令。")
+
+    analyze_parser = subparsers.add_parser("analyze", help="显示 MIDI 文件的基本信息和每个轨道的统计。")
+    analyze_parser.add_argument("inputs", nargs="+", help="MIDI 文件、目录 (递归搜索) 或通配符 (如 'songs/**/*.mid')。")
+    analyze_parser.add_argument("--json", action="store_true", help="以 JSON Lines 格式输出 (每个文件一行)。")
+    analyze_parser.add_argument("--output", default=None, help="JSON Lines 输出文件 (默认为标准输出)。")
+    analyze_parser.add_argument("--workers", type=int, default=None, help="工作进程数量 (默认为 CPU 核心数, 1 为不使用进程池)。")
+
+    separate_parser = subparsers.add_parser("separate", help="按乐器分离 MIDI 文件。")
+    separate_parser.add_argument("inputs", nargs="+", help="要处理的 MIDI 文件、目录 (递归搜索) 或通配符。")
+    separate_parser.add_argument("--output_dir", default="separated_midi", help="分离MIDI文件时的输出目录 (默认为 'separated_midi').")
+    separate_parser.add_argument("--force", action="store_true", help="忽略清单, 重新分离所有输入。")
+    separate_parser.add_argument("--watch", action="store_true", help="持续监视输入, 只处理新增或修改过的文件。")
+    separate_parser.add_argument("--interval", type=float, default=2.0, help="--watch 的检查间隔秒数 (默认 2)。")
+
+    compile_parser = subparsers.add_parser("compile", help="把目录下所有 MIDI 文件批量编译为 gui4 可加载的 JSON 序列。")
+    compile_parser.add_argument("input_dir", help="包含 MIDI 文件的目录 (递归搜索)。")
+    compile_parser.add_argument("--output_dir", default="compiled_sequences", help="输出目录 (默认为 'compiled_sequences').")
+    compile_parser.add_argument("--workers", type=int, default=None, help="工作进程数量 (默认为 CPU 核心数)。")
+    compile_parser.add_argument("--track", type=int, default=None, help="只编译指定轨道 (默认合并所有轨道)。")
+    compile_parser.add_argument("--quantization", type=float, default=0.25, help="和弦分组的量化精度, 单位为拍 (默认 0.25)。")
+    compile_parser.add_argument("--force", action="store_true", help="忽略清单, 重新编译所有文件。")
+    compile_parser.add_argument("--watch", action="store_true", help="持续监视输入目录, 只编译新增或修改过的文件。")
+    compile_parser.add_argument("--interval", type=float, default=2.0, help="--watch 的检查间隔秒数 (默认 2)。")
+
+    slice_parser = subparsers.add_parser("slice", help="切出 MIDI 文件的一段或多段 (只解析一次)。")
+    slice_parser.add_argument("midi_file", help="要处理的 MIDI 文件路径。")
+    slice_parser.add_argument("--bars", type=parse_range, action="append", default=[], help="小节范围, 如 32-48 (从 1 开始, 包含结尾小节), 可重复。")
+    slice_parser.add_argument("--beats", type=parse_range, action="append", default=[], help="拍范围 (四分音符, 从 0 开始), 可重复。")
+    slice_parser.add_argument("--seconds", type=parse_range, action="append", default=[], help="秒数范围, 可重复。")
+    slice_parser.add_argument("--output_dir", default="sliced_midi", help="输出目录 (默认为 'sliced_midi').")
 
     args = parser.parse_args()
 
     if args.command == "analyze":
-        analyze_midi(args.midi_file)
+        failed = analyze_files(args.inputs, args.output, args.workers, args.json or args.output is not None)
+        if failed:
+            raise SystemExit(1)
     elif args.command == "separate":
-        separate_midi_by_instrument(args.midi_file, args.output_dir)
+        # --force 只作用于第一次运行, --watch 之后的检查仍然依靠清单
+        run = lambda verbose=True: separate_files(args.inputs, args.output_dir, args.force and verbose, verbose)
+        if args.watch:
+            watch(run, args.interval)
+        elif run():
+            raise SystemExit(1)
+    elif args.command == "slice":
+        ranges = ([("bars", *r) for r in args.bars] + [("beats", *r) for r in args.beats]
+                  + [("seconds", *r) for r in args.seconds])
+        if not ranges:
+            parser.error("slice 需要至少一个 --bars / --beats / --seconds 范围。")
+        if slice_midi(args.midi_file, ranges, args.output_dir):
+            raise SystemExit(1)
+    elif args.command == "compile":
+        run = lambda verbose=True: compile_directory(args.input_dir, args.output_dir, args.workers, args.track,
+                                                     args.quantization, args.force and verbose, verbose)
+        if args.watch:
+            watch(run, args.interval)
+        elif run():
+            raise SystemExit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
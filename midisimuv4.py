@@ -1,6 +1,8 @@
-import mido
 import time
+import argparse
 from pynput import keyboard # 导入 pynput 的键盘模块
+import midi_output
+from midi_output import NOTE_ON_STATUS, NOTE_OFF_STATUS, NoteState
 
 # MIDI 音符映射：将键盘字符映射到 MIDI 音高 (C4 八度)
 # MIDI 音高 60 是 C4
@@ -22,17 +24,18 @@ key_to_midi_note = {
 }
 
 # 存储当前正在发声的音符，用于在按键释放时关闭
-active_notes = {} # 字典，键是 MIDI 音高，值是 True (表示正在发声)
+note_state = NoteState() # 每个通道 128 个音符槽的引用计数
 
 # MIDI 通道和力度
 midi_channel = 0
 velocity = 100
 
+midi_backend = midi_output.MidoBackend.name # 启动时通过 --backend 选择的输出后端
 midi_port = None # 全局变量，用于在不同函数中访问 MIDI 端口
 
 def on_press(key):
     """当键盘键被按下时调用"""
-    global midi_port, active_notes # 声明全局变量以便修改
+    global midi_port # 声明全局变量以便修改
 
     if midi_port is None or midi_port.closed:
         print("MIDI 端口未打开或已关闭。请检查启动时的错误。")
@@ -52,18 +55,17 @@ def on_press(key):
                 note = key_to_midi_note[char_key]
 
                 # 如果音符已经处于激活状态 (还在发声)，则不重复发送 Note On
-                if note not in active_notes:
-                    msg_on = mido.Message('note_on', channel=midi_channel, note=note, velocity=velocity)
-                    midi_port.send(msg_on)
-                    print(f"发送 Note On: {msg_on} (按键: '{char_key}')")
-                    active_notes[note] = True # 标记此音符为激活状态
+                if not note_state.is_active(midi_channel, note):
+                    midi_port.send_buffer(bytes((NOTE_ON_STATUS | midi_channel, note, velocity)))
+                    print(f"发送 Note On: note={note} velocity={velocity} (按键: '{char_key}')")
+                    note_state.note_on(midi_channel, note) # 标记此音符为激活状态
     except Exception as e:
         print(f"处理按键按下事件时出错: {e}")
 
 
 def on_release(key):
     """当键盘键被释放时调用"""
-    global midi_port, active_notes # 声明全局变量以便修改
+    global midi_port # 声明全局变量以便修改
 
     if midi_port is None or midi_port.closed:
         return
@@ -76,12 +78,10 @@ def on_release(key):
             if char_key in key_to_midi_note:
                 note = key_to_midi_note[char_key]
 
-                # 如果音符处于激活状态，则发送 Note Off
-                if note in active_notes:
-                    msg_off = mido.Message('note_off', channel=midi_channel, note=note, velocity=0)
-                    midi_port.send(msg_off)
-                    print(f"发送 Note Off: {msg_off}")
-                    del active_notes[note] # 从激活列表中移除
+                # 如果音符的引用计数归零，则发送 Note Off
+                if note_state.note_off(midi_channel, note):
+                    midi_port.send_buffer(bytes((NOTE_OFF_STATUS | midi_channel, note, 0)))
+                    print(f"发送 Note Off: note={note}")
     except Exception as e:
         print(f"处理按键释放事件时出错: {e}")
 
@@ -89,10 +89,11 @@ def start_midi_keyboard():
     global midi_port # 声明全局变量以便修改
 
     try:
-        print("Available MIDI output ports:", mido.get_output_names())
+        output_names = midi_output.output_names(midi_backend)
+        print(f"Available MIDI output ports ({midi_backend}):", output_names)
 
         port_to_open_name = None
-        for name in mido.get_output_names():
+        for name in output_names:
             if "loopmidi" in name.lower() or "python" in name.lower() or "rtmidi" in name.lower():
                 port_to_open_name = name
                 break
@@ -100,15 +101,15 @@ def start_midi_keyboard():
         if port_to_open_name:
             try:
                 # 尝试打开一个已存在的虚拟端口（如 LoopMIDI 创建的）
-                midi_port = mido.open_output(port_to_open_name)
+                midi_port = midi_output.open_output(midi_backend, port_to_open_name)
                 print(f"Successfully opened MIDI port: '{port_to_open_name}'")
             except Exception as e:
                 print(f"Failed to open port '{port_to_open_name}': {e}")
                 print("This might happen if the port is already in use by another application.")
                 # 尝试打开第一个可用端口作为备用
-                if mido.get_output_names():
-                    midi_port = mido.open_output(mido.get_output_names()[0])
-                    print(f"Opened first available port: '{mido.get_output_names()[0]}'")
+                if output_names:
+                    midi_port = midi_output.open_output(midi_backend, output_names[0])
+                    print(f"Opened first available port: '{output_names[0]}'")
                 else:
                     print("No MIDI output ports found. Please ensure you have a MIDI driver (e.g., LoopMIDI) installed.")
                     return
@@ -131,17 +132,20 @@ def start_midi_keyboard():
         print(f"程序启动时发生错误: {e}")
     finally:
         if midi_port and not midi_port.closed:
-            # 在程序退出前，确保关闭所有激活的音符
-            for note in list(active_notes.keys()): # 遍历拷贝，因为可能会修改字典
-                try:
-                    msg_off = mido.Message('note_off', channel=midi_channel, note=note, velocity=0)
-                    midi_port.send(msg_off)
-                    print(f"发送 Note Off (清理): {msg_off}")
-                except Exception as e:
-                    print(f"关闭音符时出错: {e}")
+            # 在程序退出前，确保关闭所有激活的音符 (每个通道一条 All Notes Off)
+            try:
+                channels = note_state.active_channels()
+                midi_port.all_notes_off(note_state)
+                print(f"发送 All Notes Off (清理): 通道 {channels}")
+            except Exception as e:
+                print(f"关闭音符时出错: {e}")
             midi_port.close()
             print("MIDI 端口已关闭。")
+            print(midi_port.latency_report())
         print("MIDI 模拟程序已退出。")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="实时 MIDI 键盘模拟")
+    midi_output.add_backend_argument(parser)
+    midi_backend = parser.parse_args().backend
     start_midi_keyboard()
\ No newline at end of file
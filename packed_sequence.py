@@ -0,0 +1,291 @@
+from array import array
+
+# --- Compact Sequence Storage ---
+# Element i of a sequence is pitches[offsets[i]:offsets[i + 1]] (CSR layout): one pitch is a note,
+# several a chord, none a rest. A million-element sequence costs about 5 bytes per element plus
+# one byte per pitch, instead of a Python int or list object per element.
+
+def item_notes(item):
+    """Returns the pitches of a sequence element (int, list/tuple, [] rest or ElementView) as a tuple."""
+    if isinstance(item, int):
+        return (item,)
+    if isinstance(item, ElementView):
+        return item.notes
+    if isinstance(item, (list, tuple)):
+        return tuple(n for n in item if n is not None)
+    return ()
+
+class ElementView:
+    """
+    Read-only view of one element of a PackedSequence. It refers to the element by index,
+    so it is only valid until the sequence is next modified.
+    """
+    __slots__ = ("_sequence", "_index")
+
+    def __init__(self, sequence, index):
+        self._sequence = sequence
+        self._index = index
+
+    @property
+    def notes(self):
+        return self._sequence.notes(self._index)
+
+    @property
+    def is_rest(self):
+        offsets = self._sequence.offsets
+        return offsets[self._index] == offsets[self._index + 1]
+
+    @property
+    def is_chord(self):
+        offsets = self._sequence.offsets
+        return offsets[self._index + 1] - offsets[self._index] > 1
+
+    @property
+    def velocity(self):
+        """Per-element velocity, or None when the sequence has none (0 also means 'not set')."""
+        velocities = self._sequence.velocities
+        return velocities[self._index] if velocities is not None else None
+
+    @property
+    def onset(self):
+        """Per-element onset in beats, or None when the sequence has none."""
+        onsets = self._sequence.onsets
+        return onsets[self._index] if onsets is not None else None
+
+    @property
+    def bar(self):
+        """Bar of the onset (from 1), or None when it is not known."""
+        bars = self._sequence.bars
+        return bars[self._index] or None if bars is not None else None
+
+    @property
+    def bar_beat(self):
+        """Beat of the onset in its bar (from 0), or None when the sequence has no bar positions."""
+        bar_beats = self._sequence.bar_beats
+        return bar_beats[self._index] if bar_beats is not None else None
+
+    @property
+    def duration(self):
+        """Per-element duration in beats, or None when the sequence has none."""
+        durations = self._sequence.durations
+        return durations[self._index] if durations is not None else None
+
+    @property
+    def onset_seconds(self):
+        """Per-element onset in seconds, or None when the sequence has none."""
+        onset_seconds = self._sequence.onset_seconds
+        return onset_seconds[self._index] if onset_seconds is not None else None
+
+    @property
+    def duration_seconds(self):
+        """Per-element duration in seconds, or None when the sequence has none."""
+        duration_seconds = self._sequence.duration_seconds
+        return duration_seconds[self._index] if duration_seconds is not None else None
+
+    def __len__(self):
+        offsets = self._sequence.offsets
+        return offsets[self._index + 1] - offsets[self._index]
+
+    def __iter__(self):
+        return iter(self.notes)
+
+    def to_item(self):
+        """The element in the JSON/list form: an int for a note, a list for a chord, [] for a rest."""
+        notes = self.notes
+        return notes[0] if len(notes) == 1 else list(notes)
+
+    def __eq__(self, other):
+        if isinstance(other, ElementView):
+            return self.notes == other.notes
+        return self.to_item() == other
+
+    def __hash__(self):
+        # Consistent with __eq__: a single note equals (and hashes like) its int; chords and rests
+        # equal lists, which are unhashable, so they hash by their notes
+        notes = self.notes
+        return hash(notes[0]) if len(notes) == 1 else hash(notes)
+
+    def __repr__(self):
+        return repr(self.to_item())
+
+# Optional per-element arrays: attribute name -> array typecode (elements added without a value get 0)
+EXTRAS = {
+    "velocities": 'B', # Note-on velocity
+    "onsets": 'd',     # Onset in beats
+    "durations": 'f',  # Duration in beats
+    "bars": 'I',       # Bar of the onset, from 1 (0: unknown, e.g. an element added by hand)
+    "bar_beats": 'f',  # Beat of the onset in its bar, from 0 in time signature beats
+    "onset_seconds": 'd',    # Onset in seconds (through the file's tempo map)
+    "duration_seconds": 'f', # Duration in seconds
+}
+
+class PackedSequence:
+    """
+    Melody sequence stored as CSR arrays: offsets (uint32, len + 1 entries) and pitches (uint8),
+    with optional per-element arrays (see EXTRAS), each either None or one entry per element.
+    Indexing and iteration work like a list but yield ElementView objects; to_list() gives the
+    plain int/list form used by the JSON files.
+    """
+    __slots__ = ("offsets", "pitches") + tuple(EXTRAS)
+
+    def __init__(self, items=None):
+        self.offsets = array('I', [0])
+        self.pitches = array('B')
+        for name in EXTRAS:
+            setattr(self, name, None)
+        if items is not None:
+            self.extend(items)
+
+    @classmethod
+    def from_arrays(cls, offsets, pitches, **extras):
+        """
+        Wraps existing arrays (not copied). offsets must start at 0 and end at len(pitches).
+        Read-only buffers such as memoryviews work too, for a sequence that is never modified.
+        """
+        sequence = cls.__new__(cls)
+        sequence.offsets = offsets
+        sequence.pitches = pitches
+        for name in EXTRAS:
+            setattr(sequence, name, extras.get(name))
+        return sequence
+
+    def extras(self):
+        """Returns {name: array} of the optional per-element arrays that are present."""
+        return {name: getattr(self, name) for name in EXTRAS if getattr(self, name) is not None}
+
+    def copy(self):
+        return PackedSequence.from_arrays(array('I', self.offsets), array('B', self.pitches),
+                                          **{name: array(EXTRAS[name], values) for name, values in self.extras().items()})
+
+    def memory_bytes(self):
+        total = self.offsets.itemsize * len(self.offsets) + len(self.pitches)
+        for values in self.extras().values():
+            total += values.itemsize * len(values)
+        return total
+
+    # --- Read access (list compatible) ---
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __bool__(self):
+        return len(self.offsets) > 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return PackedSequence(self.notes(i) for i in range(start, stop, step))
+            stop = max(start, stop)
+            base = self.offsets[start]
+            offsets = array('I', (o - base for o in self.offsets[start:stop + 1])) if base else self.offsets[start:stop + 1]
+            return PackedSequence.from_arrays(
+                offsets, self.pitches[base:self.offsets[stop]],
+                **{name: values[start:stop] for name, values in self.extras().items()})
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("sequence index out of range")
+        return ElementView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield ElementView(self, index)
+
+    def notes(self, index):
+        """Pitches of element index as a tuple (empty for a rest)."""
+        return tuple(self.pitches[self.offsets[index]:self.offsets[index + 1]])
+
+    def to_list(self):
+        offsets = self.offsets
+        pitches = self.pitches.tolist()
+        return [pitches[start] if end - start == 1 else pitches[start:end]
+                for start, end in zip(offsets, offsets[1:])]
+
+    def __eq__(self, other):
+        if isinstance(other, PackedSequence):
+            return self.offsets == other.offsets and self.pitches == other.pitches
+        return NotImplemented
+
+    # --- Mutations ---
+    def _pack(self, items):
+        """Returns (offsets relative to 0 without the leading 0, pitches) of a run of elements."""
+        offsets = array('I')
+        pitches = array('B')
+        for item in items:
+            if isinstance(item, int):
+                pitches.append(item)
+            else:
+                pitches.extend(item_notes(item))
+            offsets.append(len(pitches))
+        return offsets, pitches
+
+    def _extras_insert(self, index, count, source=None):
+        """Keeps the optional arrays aligned after inserting count elements (copied from source when it has them)."""
+        for name, values in self.extras().items():
+            new_values = getattr(source, name, None)
+            if new_values is None:
+                new_values = array(EXTRAS[name], [0]) * count
+            values[index:index] = new_values
+
+    def append(self, item):
+        notes = item_notes(item)
+        self.pitches.extend(notes)
+        self.offsets.append(len(self.pitches))
+        self._extras_insert(len(self) - 1, 1)
+
+    def extend(self, items):
+        self.insert(len(self), items)
+
+    def insert(self, index, items):
+        """Inserts a run of elements before index. Returns the number of elements inserted."""
+        source = items if isinstance(items, PackedSequence) else None
+        if source is not None:
+            new_offsets, new_pitches = source.offsets[1:], source.pitches
+        else:
+            new_offsets, new_pitches = self._pack(items)
+        count = len(new_offsets)
+        if not count:
+            return 0
+        start = self.offsets[index]
+        added = len(new_pitches)
+        tail = self.offsets[index + 1:]
+        if added:
+            tail = array('I', (o + added for o in tail))
+        self.offsets[index + 1:] = array('I', (o + start for o in new_offsets)) + tail
+        self.pitches[start:start] = new_pitches
+        self._extras_insert(index, count, source)
+        return count
+
+    def replace(self, index, item):
+        notes = item_notes(item)
+        start, end = self.offsets[index], self.offsets[index + 1]
+        self.pitches[start:end] = array('B', notes)
+        shift = len(notes) - (end - start)
+        if shift:
+            self.offsets[index + 1:] = array('I', (o + shift for o in self.offsets[index + 1:]))
+
+    def delete_indices(self, indices):
+        """
+        Removes a set of element indices in one compaction pass: the kept runs are copied in bulk
+        and only their offsets are rebased.
+        """
+        removed = sorted(set(i for i in indices if 0 <= i < len(self)))
+        if not removed:
+            return
+        offsets, pitches = self.offsets, self.pitches
+        new_offsets = array('I', [0])
+        new_pitches = array('B')
+        kept_extras = {name: array(EXTRAS[name]) for name in self.extras()}
+        run_start = 0
+        for stop in removed + [len(self)]:
+            if run_start < stop:
+                shift = offsets[run_start] - len(new_pitches)
+                new_pitches.extend(pitches[offsets[run_start]:offsets[stop]])
+                run = offsets[run_start + 1:stop + 1]
+                new_offsets.extend(array('I', (o - shift for o in run)) if shift else run)
+                for name, kept in kept_extras.items():
+                    kept.extend(getattr(self, name)[run_start:stop])
+            run_start = stop + 1
+        self.offsets, self.pitches = new_offsets, new_pitches
+        for name, kept in kept_extras.items():
+            setattr(self, name, kept)
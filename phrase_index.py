@@ -0,0 +1,321 @@
+import bisect
+from array import array
+
+import sequence_model
+
+# --- Element Keys ---
+# Exact mode compares the pitches of every element. Interval mode is transposition invariant:
+# an element is described by its chord shape (pitches relative to its lowest note) and the step
+# from the lowest note of the previous element, so a phrase matches in any key.
+REST_KEY = ()
+NO_LOW = -1 # Lowest pitch recorded for a rest
+
+def exact_key(notes, previous=None):
+    return tuple(sorted(notes))
+
+def interval_key(notes, previous):
+    if not notes:
+        return REST_KEY
+    low = min(notes)
+    shape = tuple(sorted(n - low for n in notes))
+    return (low - min(previous) if previous else None, shape)
+
+def element_parts(notes, interval):
+    """(lowest pitch, hash of the part of the key that depends on this element only)."""
+    if not notes:
+        return NO_LOW, hash(REST_KEY)
+    if interval:
+        low = min(notes)
+        return low, hash(tuple(sorted(n - low for n in notes)))
+    return 0, hash(tuple(sorted(notes)))
+
+def combine_key_hash(low, shape_hash, previous_low, interval):
+    """Hash of the full element key, from its parts and the previous element's lowest pitch."""
+    if not interval or low == NO_LOW:
+        return shape_hash
+    return hash((low - previous_low if previous_low != NO_LOW else None, shape_hash))
+
+# --- Rolling Hash ---
+HASH_MODULUS = (1 << 61) - 1
+HASH_BASE = 1_000_003
+
+class PhraseIndex:
+    """
+    Finds every occurrence of a phrase (a run of notes, chords and rests) in a SequenceModel.
+    Every run of `gram` consecutive element keys is hashed with a polynomial rolling hash and
+    indexed by its start position; a query looks up the positions of one gram of the phrase and
+    verifies only those candidates. Positions are kept per block of about block_size elements
+    (relative to the block start), so an edit only re-indexes the blocks around the changed range
+    and shifts the block starts, instead of rebuilding the whole index.
+    The index follows the model through its change events once subscribed.
+    """
+    def __init__(self, model, interval=False, gram=4, block_size=1024):
+        self.model = model
+        self.interval = interval
+        self.key = interval_key if interval else exact_key
+        self.gram = gram
+        self.block_size = block_size
+        self.lows = array('h')        # Lowest pitch of every element (NO_LOW for rests)
+        self.shape_hashes = array('q') # Hash of the element-local part of every key
+        self.key_hashes = array('q')  # Hash of every element key
+        self.block_lengths = []       # Elements per block
+        self.block_starts = []        # Index of the first element of every block
+        self.block_grams = []         # Per block: {gram hash: [positions relative to the block start]}
+        self._top_power = pow(HASH_BASE, gram - 1, HASH_MODULUS)
+        self.rebuild()
+
+    # --- Building ---
+    def _element_key(self, index):
+        sequence = self.model.packed
+        previous = sequence.notes(index - 1) if index > 0 else None
+        return self.key(sequence.notes(index), previous)
+
+    def _combined(self, start, stop):
+        """
+        Key hashes of [start, stop) from the index's own lows/shape hashes. Removal events arrive
+        after the whole batch is applied to the model, so recomputing a key after a removal must
+        not read the model.
+        """
+        lows, shape_hashes, interval = self.lows, self.shape_hashes, self.interval
+        return array('q', (combine_key_hash(lows[i], shape_hashes[i], lows[i - 1] if i > 0 else NO_LOW, interval)
+                           for i in range(start, stop)))
+
+    def _read_parts(self, start, stop):
+        """Reads elements [start, stop) from the model into lows/shape_hashes (same length, in place)."""
+        sequence = self.model.packed
+        parts = [element_parts(sequence.notes(i), self.interval) for i in range(start, stop)]
+        self.lows[start:stop] = array('h', (low for low, _ in parts))
+        self.shape_hashes[start:stop] = array('q', (shape_hash for _, shape_hash in parts))
+
+    def _gram_hash(self, hashes):
+        h = 0
+        for key_hash in hashes:
+            h = (h * HASH_BASE + key_hash) % HASH_MODULUS
+        return h
+
+    def rebuild(self):
+        """Indexes the whole sequence (on load, or when the model is reset)."""
+        count = len(self.model)
+        self.lows = array('h', bytes(2 * count))
+        self.shape_hashes = array('q', bytes(8 * count))
+        self._read_parts(0, count)
+        self.key_hashes = self._combined(0, count)
+        self.block_lengths = [min(self.block_size, count - start) for start in range(0, count, self.block_size)]
+        self._update_starts()
+        self.block_grams = [None] * len(self.block_lengths)
+        for block in range(len(self.block_lengths)):
+            self._index_block(block)
+
+    def _update_starts(self):
+        starts = []
+        total = 0
+        for length in self.block_lengths:
+            starts.append(total)
+            total += length
+        self.block_starts = starts
+
+    def _index_block(self, block):
+        """(Re)builds the gram table of one block with a rolling hash over its start positions."""
+        grams = {}
+        gram = self.gram
+        key_hashes = self.key_hashes
+        start = self.block_starts[block]
+        stop = min(start + self.block_lengths[block], len(key_hashes) - gram + 1)
+        if start < stop:
+            h = self._gram_hash(key_hashes[start:start + gram])
+            for position in range(start, stop):
+                if position > start:
+                    h = ((h - key_hashes[position - 1] * self._top_power) * HASH_BASE
+                         + key_hashes[position + gram - 1]) % HASH_MODULUS
+                grams.setdefault(h, []).append(position - start)
+        self.block_grams[block] = grams
+
+    def _blocks_between(self, lo, hi):
+        """Blocks holding a gram start in [lo, hi)."""
+        lo = max(0, lo)
+        if lo >= hi or not self.block_starts:
+            return range(0)
+        first = max(0, bisect.bisect_right(self.block_starts, lo) - 1)
+        last = max(0, bisect.bisect_right(self.block_starts, hi - 1) - 1)
+        return range(first, last + 1)
+
+    def _reindex(self, lo, hi):
+        """Re-indexes every block holding a gram start in [lo, hi)."""
+        for block in self._blocks_between(lo, hi):
+            self._index_block(block)
+
+    def _split_large_blocks(self, block):
+        length = self.block_lengths[block]
+        if length <= 2 * self.block_size:
+            return
+        pieces = [min(self.block_size, length - offset) for offset in range(0, length, self.block_size)]
+        self.block_lengths[block:block + 1] = pieces
+        self.block_grams[block:block + 1] = [None] * len(pieces)
+
+    def _index_new_blocks(self):
+        for block, grams in enumerate(self.block_grams):
+            if grams is None:
+                self._index_block(block)
+
+    # --- Model Events ---
+    def subscribe(self):
+        self.model.subscribe(self.on_sequence_change)
+        return self
+
+    def on_sequence_change(self, kind, start, count):
+        if kind == sequence_model.RESET:
+            self.rebuild()
+        elif kind == sequence_model.INSERTED:
+            self._inserted(start, count)
+        elif kind == sequence_model.REMOVED:
+            self._removed(start, count)
+        elif kind == sequence_model.COMPACTED:
+            self._compacted(self.model.removed_runs)
+        else: # sequence_model.REPLACED
+            self._replaced(start, count)
+
+    def _refresh_keys(self, start, stop):
+        stop = min(stop, len(self.key_hashes))
+        if start < stop:
+            self.key_hashes[start:stop] = self._combined(start, stop)
+
+    def _inserted(self, start, count):
+        self.lows[start:start] = array('h', bytes(2 * count))
+        self.shape_hashes[start:start] = array('q', bytes(8 * count))
+        self.key_hashes[start:start] = array('q', bytes(8 * count))
+        self._read_parts(start, start + count)
+        self._refresh_keys(start, start + count + 1) # The next key depends on its predecessor in interval mode
+        if not self.block_lengths:
+            self.block_lengths = [0]
+            self.block_grams = [None]
+            self.block_starts = [0]
+        block = max(0, bisect.bisect_right(self.block_starts, start) - 1)
+        if start == self.block_starts[block] and block > 0:
+            block -= 1 # Appending to the previous block keeps block starts stable for inserts at a boundary
+        self.block_lengths[block] += count
+        self._split_large_blocks(block)
+        self._update_starts()
+        self._index_new_blocks()
+        self._reindex(start - self.gram + 1, start + count + 1)
+
+    def _removed(self, start, count):
+        del self.lows[start:start + count]
+        del self.shape_hashes[start:start + count]
+        del self.key_hashes[start:start + count]
+        self._refresh_keys(start, start + 1)
+        end = start + count
+        lengths, grams = [], []
+        for block_start, length, block_grams in zip(self.block_starts, self.block_lengths, self.block_grams):
+            overlap = max(0, min(end, block_start + length) - max(start, block_start))
+            if length - overlap:
+                lengths.append(length - overlap)
+                grams.append(block_grams if not overlap else None)
+        self.block_lengths, self.block_grams = lengths, grams
+        self._update_starts()
+        self._index_new_blocks()
+        self._reindex(start - self.gram + 1, start + 1)
+
+    def _compacted(self, runs):
+        """Applies a batch of removed runs with one pass over the arrays and the block list."""
+        kept = list(sequence_model.kept_ranges(runs, len(self.lows)))
+        self.lows = _compact(self.lows, kept)
+        self.shape_hashes = _compact(self.shape_hashes, kept)
+        self.key_hashes = _compact(self.key_hashes, kept)
+        gaps = [] # New index of the element after every removed run
+        removed = 0
+        for start, count in runs:
+            gaps.append(start - removed)
+            removed += count
+        for gap in gaps:
+            self._refresh_keys(gap, gap + 1)
+
+        lengths, grams = [], []
+        run = 0
+        for block_start, length, block_grams in zip(self.block_starts, self.block_lengths, self.block_grams):
+            block_end = block_start + length
+            overlap = 0
+            while run < len(runs) and runs[run][0] < block_end:
+                start, count = runs[run]
+                overlap += min(block_end, start + count) - max(start, block_start)
+                if start + count > block_end:
+                    break # The run goes on into the next block
+                run += 1
+            if length - overlap:
+                lengths.append(length - overlap)
+                grams.append(block_grams if not overlap else None)
+        self.block_lengths, self.block_grams = lengths, grams
+        self._update_starts()
+        self._index_new_blocks()
+        stale = set()
+        for gap in gaps:
+            stale.update(self._blocks_between(gap - self.gram + 1, gap + 1))
+        for block in sorted(stale):
+            self._index_block(block)
+
+    def _replaced(self, start, count):
+        self._read_parts(start, start + count)
+        self._refresh_keys(start, start + count + 1)
+        self._reindex(start - self.gram + 1, start + count + 1)
+
+    # --- Queries ---
+    def _candidates(self, gram_hash):
+        for block_start, grams in zip(self.block_starts, self.block_grams):
+            for position in grams.get(gram_hash, ()):
+                yield block_start + position
+
+    def _matches_at(self, position, pattern_keys):
+        """Verifies a candidate against the real element keys (gram hashes may collide)."""
+        if position < 0 or position + len(pattern_keys) > len(self.model):
+            return False
+        for offset, pattern_key in enumerate(pattern_keys):
+            key = self._element_key(position + offset)
+            if offset == 0 and self.interval and pattern_key is not REST_KEY and key is not REST_KEY:
+                # The phrase's first element has no predecessor: compare its chord shape only
+                if pattern_key[1] != key[1]:
+                    return False
+            elif key != pattern_key:
+                return False
+        return True
+
+    def find(self, phrase):
+        """
+        Returns the sorted start indices of every occurrence of phrase (a list of sequence items:
+        ints, chord lists, [] rests).
+        """
+        notes = [tuple(n for n in ([item] if isinstance(item, int) else item)) for item in phrase]
+        if not notes:
+            return []
+        pattern_keys = [self.key(element, notes[i - 1] if i else None) for i, element in enumerate(notes)]
+        parts = [element_parts(element, self.interval) for element in notes]
+        pattern_hashes = [combine_key_hash(low, shape_hash, parts[i - 1][0] if i else NO_LOW, self.interval)
+                          for i, (low, shape_hash) in enumerate(parts)]
+        # In interval mode the first key of the phrase depends on what precedes it, so it is never hashed
+        skip = 1 if self.interval else 0
+        if len(pattern_hashes) - skip >= self.gram:
+            gram_hash = self._gram_hash(pattern_hashes[skip:skip + self.gram])
+            candidates = (position - skip for position in self._candidates(gram_hash))
+        elif skip < len(pattern_hashes):
+            # Phrase shorter than a gram: scan the key hashes for its first hashed element
+            target = pattern_hashes[skip]
+            candidates = (position - skip for position, key_hash in enumerate(self.key_hashes) if key_hash == target)
+        else:
+            candidates = range(len(self.key_hashes))
+        return sorted(position for position in candidates if self._matches_at(position, pattern_keys))
+
+def _compact(values, kept):
+    compacted = array(values.typecode)
+    for start, stop in kept:
+        compacted.extend(values[start:stop])
+    return compacted
+
+def parse_phrase(text):
+    """Parses '60 62 64,67 rest 65' (space separated; chords comma separated) into sequence items."""
+    phrase = []
+    for token in text.replace(";", " ").split():
+        if token.lower() in ("r", "rest", "[]"):
+            phrase.append([])
+        elif "," in token:
+            phrase.append(sorted(int(n) for n in token.split(",") if n.strip()))
+        else:
+            phrase.append(int(token))
+    return phrase
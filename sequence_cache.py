@@ -0,0 +1,150 @@
+import argparse
+import hashlib
+import os
+import struct
+import time
+from array import array
+
+import sequence_io
+from packed_sequence import PackedSequence
+
+# --- Cache Location and Limits ---
+CACHE_DIR = os.environ.get("KIW_SEQUENCE_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".cache", "keyboard_in_work", "sequences"))
+MAX_CACHE_BYTES = int(os.environ.get("KIW_SEQUENCE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# --- Entry Format ---
+# Entries are binary sequence files (see sequence_io), loaded through mmap.
+KEY_VERSION = 4 # Bump when the key or the entry format changes
+ENTRY_SUFFIX = sequence_io.BINARY_SUFFIX
+HASH_CHUNK = 1024 * 1024
+
+def file_digest(filepath):
+    """SHA-256 of the file content."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(midi_filepath, selection, quantization_level):
+    """
+    Key of an imported sequence: content hash of the MIDI file + track selection + quantization.
+    selection: any string describing which tracks/channels were imported (e.g. 'track=0').
+    """
+    descriptor = f"v{KEY_VERSION}|{file_digest(midi_filepath)}|{selection}|q={quantization_level!r}"
+    return hashlib.sha256(descriptor.encode('utf-8')).hexdigest()
+
+def entry_path(key):
+    return os.path.join(CACHE_DIR, key + ENTRY_SUFFIX)
+
+def load(key):
+    """Returns the cached sequence for key (memory-mapped read), or None on a miss."""
+    path = entry_path(key)
+    try:
+        sequence = sequence_io.read_binary(path)
+        os.utime(path) # Mark as recently used for LRU eviction
+        return sequence
+    except (OSError, ValueError, struct.error):
+        return None
+
+def store(key, sequence, max_bytes=None):
+    """Writes a sequence into the cache (atomically) and evicts old entries beyond max_bytes."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = entry_path(key)
+    sequence_io.write_binary(path, sequence)
+    evict(MAX_CACHE_BYTES if max_bytes is None else max_bytes)
+
+def entries():
+    """Returns [(path, size, last used time)] of all cache entries, least recently used first."""
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    result = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(ENTRY_SUFFIX):
+            path = os.path.join(CACHE_DIR, name)
+            st = os.stat(path)
+            result.append((path, st.st_size, st.st_mtime))
+    result.sort(key=lambda entry: entry[2])
+    return result
+
+def evict(max_bytes):
+    """Deletes least recently used entries until the cache fits in max_bytes. Returns the number removed."""
+    current = entries()
+    total = sum(size for _, size, _ in current)
+    removed = 0
+    for path, size, _ in current:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+def clear():
+    return evict(0)
+
+def attach_timing(sequence, timing):
+    """
+    Copies a midi_reader.SequenceTiming into the optional arrays of a PackedSequence: onsets and
+    durations in beats and in seconds, and the bar positions when the timing has a meter.
+    """
+    sequence.onsets = array('d', timing.onset_beats)
+    sequence.durations = array('f', timing.duration_beats)
+    sequence.onset_seconds = array('d', timing.onset_seconds)
+    sequence.duration_seconds = array('f', timing.duration_seconds)
+    if timing.meter is not None:
+        sequence.bars = array('I', timing.bars)
+        sequence.bar_beats = array('f', timing.bar_beats)
+
+def cached_read(reader, midi_filepath, quantization_level=0.25, progress=None, cancel_event=None, **selection):
+    """
+    Runs a midi_reader import function through the cache: a hit returns the stored sequence
+    without parsing; a miss imports the file and stores the result. Returns a PackedSequence.
+    The timed readers (returning (sequence, timing)) are supported too: the onsets and durations
+    (in beats and seconds) and bar positions are kept in the sequence's optional arrays.
+    """
+    descriptor = reader.__name__ + ";" + ";".join(f"{name}={value!r}" for name, value in sorted(selection.items()))
+    key = cache_key(midi_filepath, descriptor, quantization_level)
+    sequence = load(key)
+    if sequence is not None:
+        print(f"Loaded {len(sequence)} elements for '{midi_filepath}' from the sequence cache.")
+        return sequence
+    result = reader(midi_filepath, quantization_level=quantization_level, progress=progress,
+                    cancel_event=cancel_event, **selection)
+    if isinstance(result, tuple):
+        items, timing = result
+        sequence = PackedSequence(items)
+        if timing is not None:
+            attach_timing(sequence, timing)
+    else:
+        sequence = PackedSequence(result)
+    store(key, sequence)
+    return sequence
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the imported-sequence cache.")
+    parser.add_argument("command", choices=["info", "list", "clear", "evict"],
+                        help="'info': summary, 'list': entries (least recently used first), "
+                             "'clear': delete everything, 'evict': shrink to --max_bytes.")
+    parser.add_argument("--max_bytes", type=int, default=MAX_CACHE_BYTES, help="Size limit used by 'evict'.")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        current = entries()
+        total = sum(size for _, size, _ in current)
+        print(f"Cache directory: {CACHE_DIR}")
+        print(f"Entries: {len(current)}, size: {total / 1024:.1f} KiB (limit {MAX_CACHE_BYTES / 1024 / 1024:.0f} MiB)")
+    elif args.command == "list":
+        for path, size, used in entries():
+            print(f"{os.path.basename(path)}  {size:>10} bytes  last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(used))}")
+    elif args.command == "clear":
+        print(f"Removed {clear()} entries.")
+    elif args.command == "evict":
+        print(f"Removed {evict(args.max_bytes)} entries.")
+
+if __name__ == "__main__":
+    main()
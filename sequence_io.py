@@ -0,0 +1,391 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from array import array
+
+from packed_sequence import EXTRAS, PackedSequence
+
+try:
+    import numpy as np
+except ImportError: # numpy is optional, validation falls back to plain loops
+    np = None
+
+# --- Binary Sequence Format (.kseq) ---
+# Header: magic, version, flags, element count, pitch count (little-endian), then the sections
+# in this order, each padded to SECTION_ALIGN bytes:
+#   offsets    uint32[count + 1]  element i is pitches[offsets[i]:offsets[i + 1]]
+#   pitches    uint8[pitch count]
+#   velocities uint8[count]       if FLAG_VELOCITIES
+#   onsets     float64[count]     if FLAG_ONSETS (beats)
+#   durations  float32[count]     if FLAG_DURATIONS (beats)
+#   bars       uint32[count]      if FLAG_BARS
+#   bar_beats  float32[count]     if FLAG_BAR_BEATS
+#   onset_seconds    float64[count] if FLAG_ONSET_SECONDS
+#   duration_seconds float32[count] if FLAG_DURATION_SECONDS
+# Sections added by later flags come last, so files without them read the same as before.
+MAGIC = b"KSEQ"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+SECTION_ALIGN = 8
+BINARY_SUFFIX = ".kseq"
+FLAG_VELOCITIES = 1
+FLAG_ONSETS = 2
+FLAG_DURATIONS = 4
+FLAG_BARS = 8
+FLAG_BAR_BEATS = 16
+FLAG_ONSET_SECONDS = 32
+FLAG_DURATION_SECONDS = 64
+EXTRA_FLAGS = {"velocities": FLAG_VELOCITIES, "onsets": FLAG_ONSETS, "durations": FLAG_DURATIONS,
+               "bars": FLAG_BARS, "bar_beats": FLAG_BAR_BEATS,
+               "onset_seconds": FLAG_ONSET_SECONDS, "duration_seconds": FLAG_DURATION_SECONDS}
+
+def _layout(count, pitch_count, flags):
+    """Returns ([(section name, typecode, byte offset, item count)], total file size)."""
+    sections = [("offsets", 'I', count + 1), ("pitches", 'B', pitch_count)]
+    sections += [(name, EXTRAS[name], count) for name, flag in EXTRA_FLAGS.items() if flags & flag]
+    layout = []
+    pos = HEADER.size
+    for name, typecode, length in sections:
+        layout.append((name, typecode, pos, length))
+        pos += array(typecode).itemsize * length
+        pos += -pos % SECTION_ALIGN
+    return layout, pos
+
+def encode_sequence(sequence):
+    """Encodes a sequence (PackedSequence, or ints, chord lists and [] rests) into .kseq bytes."""
+    if not isinstance(sequence, PackedSequence):
+        sequence = PackedSequence(sequence)
+    extras = sequence.extras()
+    flags = sum(EXTRA_FLAGS[name] for name in extras)
+    layout, size = _layout(len(sequence), len(sequence.pitches), flags)
+    data = bytearray(size)
+    HEADER.pack_into(data, 0, MAGIC, VERSION, flags, len(sequence), len(sequence.pitches))
+    for name, typecode, pos, length in layout:
+        values = getattr(sequence, name)
+        if sys.byteorder == 'big' and values.itemsize > 1:
+            values = array(typecode, values)
+            values.byteswap()
+        raw = values.tobytes()
+        data[pos:pos + len(raw)] = raw
+    return bytes(data)
+
+def validate_arrays(offsets, pitches):
+    """
+    Checks the CSR invariants: offsets start at 0, never decrease and end at len(pitches),
+    and every pitch is a MIDI note (0-127). Vectorized with numpy when it is installed.
+    Raises ValueError on the first violation.
+    """
+    if not len(offsets) or offsets[0] != 0 or offsets[-1] != len(pitches):
+        raise ValueError("Corrupt sequence: offsets do not cover the pitch array.")
+    if np is not None:
+        offset_values = np.frombuffer(offsets, dtype=np.uint32)
+        decreasing = np.flatnonzero(offset_values[1:] < offset_values[:-1])
+        if len(decreasing):
+            raise ValueError(f"Corrupt sequence: offsets decrease at element {int(decreasing[0])}.")
+        pitch_values = np.frombuffer(pitches, dtype=np.uint8)
+        if len(pitch_values) and int(pitch_values.max()) > 127:
+            position = int(np.flatnonzero(pitch_values > 127)[0])
+            raise ValueError(f"Corrupt sequence: pitch {int(pitch_values[position])} out of range 0-127.")
+        return
+    for index, (start, end) in enumerate(zip(offsets, offsets[1:])):
+        if end < start:
+            raise ValueError(f"Corrupt sequence: offsets decrease at element {index}.")
+    if len(pitches) and max(pitches) > 127:
+        raise ValueError(f"Corrupt sequence: pitch {max(pitches)} out of range 0-127.")
+
+def decode_sequence(buffer, copy=True):
+    """
+    Decodes .kseq bytes (any buffer, e.g. an mmap) into a PackedSequence.
+    copy=True copies every section out in bulk (one memcpy each, the result is editable);
+    copy=False returns a read-only sequence whose arrays are memoryviews into the buffer itself.
+    """
+    magic, version, flags, count, pitch_count = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a binary sequence file.")
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary sequence version {version}.")
+    layout, size = _layout(count, pitch_count, flags)
+    if len(buffer) < size:
+        raise ValueError("Truncated binary sequence file.")
+
+    copy = copy or sys.byteorder == 'big'
+    view = memoryview(buffer)
+    arrays = {}
+    for name, typecode, pos, length in layout:
+        section = view[pos:pos + array(typecode).itemsize * length]
+        if copy:
+            values = array(typecode)
+            values.frombytes(section)
+            if sys.byteorder == 'big':
+                values.byteswap()
+            section.release()
+        else:
+            values = section.cast(typecode)
+        arrays[name] = values
+    if copy:
+        view.release()
+
+    offsets = arrays.pop("offsets")
+    pitches = arrays.pop("pitches")
+    validate_arrays(offsets, pitches)
+    return PackedSequence.from_arrays(offsets, pitches, **arrays)
+
+def read_binary(filepath, copy=True):
+    """
+    Loads a .kseq file through mmap. With copy=False nothing is copied: the returned read-only
+    sequence reads straight from the mapping, which stays open as long as the sequence is alive.
+    """
+    with open(filepath, 'rb') as f:
+        if not f.seek(0, 2):
+            raise ValueError("Not a binary sequence file.")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if not copy:
+        return decode_sequence(data, copy=False)
+    with data:
+        return decode_sequence(data)
+
+def write_binary(filepath, sequence):
+    """Writes a .kseq file atomically (temporary file + rename)."""
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(encode_sequence(sequence))
+    os.replace(tmp_path, filepath)
+
+# --- JSON Sequence Format ---
+JSON_CHUNK_CHARS = 64 * 1024
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+JSON_DELIMITERS = ",]} \t\n\r"
+_WS = r"[ \t\n\r]*"
+_INT = r"(?:0|[1-9][0-9]*)"
+NOTE_RUN = re.compile(rf"(?:{_WS}{_INT}{_WS},)+") # Consecutive plain notes, each followed by ','
+SIMPLE_ELEMENT = re.compile( # Whitespace, a note or a chord of plain non-negative integers, whitespace, ',' or ']'
+    rf"{_WS}(?P<element>(?P<number>{_INT})|\[(?P<chord>{_WS}{_INT}{_WS}(?:,{_WS}{_INT}{_WS})*)?{_WS}\]){_WS}(?P<delimiter>[,\]])")
+
+class SequenceFormatError(ValueError):
+    """A JSON sequence file is malformed; line/column (1-based) and element index say where."""
+    def __init__(self, message, line, column, element=None):
+        where = f"line {line}, column {column}"
+        if element is not None:
+            where += f", element {element}"
+        super().__init__(f"{message} ({where})")
+        self.line = line
+        self.column = column
+        self.element = element
+
+class _JsonStream:
+    """
+    Chunked text reader for the streaming JSON loader. Only the unconsumed tail of the file is
+    kept in memory; the line number and line start of the dropped text are tracked so errors
+    can still be reported by line and column.
+    """
+    def __init__(self, f, chunk_chars):
+        self.f = f
+        self.chunk_chars = chunk_chars
+        self.text = ""
+        self.pos = 0          # Position in text
+        self.base = 0         # Absolute character offset of text[0]
+        self.line = 1         # Line number at text[0]
+        self.line_start = 0   # Absolute offset of the first character of that line
+        self.eof = False
+
+    def fill(self):
+        """Drops the consumed text and reads one more chunk. Returns False at end of file."""
+        consumed = self.text[:self.pos]
+        newlines = consumed.count("\n")
+        if newlines:
+            self.line += newlines
+            self.line_start = self.base + consumed.rfind("\n") + 1
+        self.base += self.pos
+        chunk = self.f.read(self.chunk_chars)
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+        return bool(chunk)
+
+    def skip_whitespace(self):
+        """Advances to the next non-whitespace character. Returns it, or '' at end of file."""
+        while True:
+            text = self.text
+            pos = self.pos = JSON_WHITESPACE.match(text, self.pos).end()
+            if pos < len(text):
+                return text[pos]
+            if not self.fill():
+                return ""
+
+    def error(self, message, pos=None, element=None):
+        pos = self.pos if pos is None else pos
+        line = self.line + self.text.count("\n", 0, pos)
+        last_newline = self.text.rfind("\n", 0, pos)
+        line_start = self.base + last_newline + 1 if last_newline >= 0 else self.line_start
+        return SequenceFormatError(message, line, self.base + pos - line_start + 1, element)
+
+def _element_pitches(value):
+    """Returns the pitches of one decoded JSON element, or an error message string."""
+    if type(value) is int:
+        pitches = (value,)
+    elif type(value) is list:
+        if not all(type(n) is int for n in value):
+            return "chord contains a value that is not an integer"
+        pitches = value
+    else:
+        return f"expected a MIDI pitch or a list of pitches, got {type(value).__name__}"
+    for pitch in pitches:
+        if not 0 <= pitch <= 127:
+            return f"pitch {pitch} out of range 0-127"
+    return pitches
+
+def _nth_element_start(text, pos, n):
+    """Position of the n-th (0-based) comma-separated element starting at pos, for error reports."""
+    for _ in range(n):
+        pos = text.index(",", pos) + 1
+    return JSON_WHITESPACE.match(text, pos).end()
+
+def read_json(filepath, chunk_chars=JSON_CHUNK_CHARS):
+    """
+    Streaming loader for JSON sequences (a list of ints, int lists and [] rests).
+    The top-level array is parsed one element at a time (plain notes and chords with one regex
+    match, anything else with raw_decode), each element is
+    validated as soon as it is read and appended straight into a PackedSequence, so neither
+    the whole file text nor a full parse tree is ever held. Raises SequenceFormatError with
+    the line, column and element index of the first problem.
+    """
+    decoder = json.JSONDecoder()
+    sequence = PackedSequence()
+    offsets = sequence.offsets
+    pitches = sequence.pitches
+    with open(filepath, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f, chunk_chars)
+        if stream.skip_whitespace() != "[":
+            raise stream.error("Expected '[' (a JSON list of sequence elements)")
+        stream.pos += 1
+        closed = stream.skip_whitespace() == "]"
+        element = 0
+        while not closed:
+            # Fastest path: a run of plain notes, each followed by ',', converted in bulk
+            match = NOTE_RUN.match(stream.text, stream.pos)
+            if match:
+                run = [int(n) for n in match.group().split(",")[:-1]]
+                if max(run) > 127:
+                    bad = next(i for i, pitch in enumerate(run) if pitch > 127)
+                    raise stream.error(f"Invalid element: pitch {run[bad]} out of range 0-127",
+                                       _nth_element_start(stream.text, match.start(), bad), element + bad)
+                base = len(pitches)
+                pitches.extend(run)
+                offsets.extend(range(base + 1, base + len(run) + 1))
+                element += len(run)
+                stream.pos = match.end()
+
+            # Fast path: a plain note or chord followed by ',' or ']' already in the buffer
+            match = SIMPLE_ELEMENT.match(stream.text, stream.pos)
+            if match:
+                number, chord, delimiter = match.group("number", "chord", "delimiter")
+                element_pitches = (int(number),) if number is not None else [int(n) for n in chord.split(",")] if chord else ()
+                for pitch in element_pitches:
+                    if pitch > 127:
+                        raise stream.error(f"Invalid element: pitch {pitch} out of range 0-127",
+                                           match.start("element"), element)
+                pitches.extend(element_pitches)
+                offsets.append(len(pitches))
+                element += 1
+                if delimiter == "]":
+                    stream.pos = match.end() - 1
+                    closed = True
+                else:
+                    stream.pos = match.end()
+                continue
+
+            # General path: anything else, including elements cut at the chunk boundary and errors
+            if not stream.skip_whitespace():
+                raise stream.error("Unexpected end of file", element=element)
+            # Decode one element; it only counts once ',' or ']' follows it inside the buffer,
+            # otherwise a number cut at the chunk boundary ('1' of '127', '1.' of '1.5') could be read short.
+            while True:
+                try:
+                    value, end = decoder.raw_decode(stream.text, stream.pos)
+                except json.JSONDecodeError as e:
+                    # Only a token running into the end of the buffer may just be cut short
+                    if stream.eof or any(c in JSON_DELIMITERS for c in stream.text[e.pos:e.pos + 64]):
+                        raise stream.error(e.msg, e.pos, element)
+                    stream.fill()
+                    continue
+                delimiter = JSON_WHITESPACE.match(stream.text, end).end()
+                if (stream.eof or len(stream.text) - delimiter >= 64 or
+                        (delimiter < len(stream.text) and stream.text[delimiter] in ",]")):
+                    break
+                stream.fill()
+
+            element_pitches = _element_pitches(value)
+            if isinstance(element_pitches, str):
+                raise stream.error(f"Invalid element: {element_pitches}", element=element)
+            pitches.extend(element_pitches)
+            offsets.append(len(pitches))
+            element += 1
+
+            stream.pos = end
+            delimiter = stream.skip_whitespace()
+            if delimiter == "]":
+                closed = True
+            elif delimiter == ",":
+                stream.pos += 1
+            else:
+                raise stream.error("Expected ',' or ']' after element" if delimiter else "Unexpected end of file",
+                                   element=element - 1)
+        stream.pos += 1
+        if stream.skip_whitespace():
+            raise stream.error("Extra data after the sequence")
+    return sequence
+
+def write_json(filepath, sequence, indent=4):
+    items = sequence.to_list() if isinstance(sequence, PackedSequence) else list(sequence)
+    with open(filepath, 'w') as f:
+        json.dump(items, f, indent=indent)
+
+# --- Format Dispatch ---
+def is_binary_path(filepath):
+    return filepath.lower().endswith(BINARY_SUFFIX)
+
+def load_sequence(filepath, copy=True):
+    """Loads a sequence file, binary (.kseq) or JSON (anything else), as a PackedSequence."""
+    if is_binary_path(filepath):
+        return read_binary(filepath, copy)
+    return read_json(filepath)
+
+def save_sequence(filepath, sequence):
+    """Saves a sequence, binary for a .kseq path and JSON otherwise."""
+    if is_binary_path(filepath):
+        write_binary(filepath, sequence)
+    else:
+        write_json(filepath, sequence)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert and inspect melody sequence files (.json / .kseq).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Convert between JSON and binary (by file extension).")
+    convert_parser.add_argument("source")
+    convert_parser.add_argument("destination")
+    info_parser = subparsers.add_parser("info", help="Show element count, timing arrays and load time.")
+    info_parser.add_argument("filepath")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        start = time.perf_counter()
+        sequence = load_sequence(args.source)
+        save_sequence(args.destination, sequence)
+        print(f"Converted {len(sequence)} elements: {args.source} -> {args.destination} "
+              f"({(time.perf_counter() - start) * 1000:.1f} ms)")
+    elif args.command == "info":
+        start = time.perf_counter()
+        sequence = load_sequence(args.filepath, copy=False)
+        elapsed = time.perf_counter() - start
+        print(f"{args.filepath}: {len(sequence)} elements, {len(sequence.pitches)} pitches, "
+              f"optional arrays: {', '.join(sequence.extras()) or 'none'}")
+        print(f"  loaded in {elapsed * 1000:.2f} ms, file size {os.path.getsize(args.filepath)} bytes")
+
+if __name__ == "__main__":
+    main()
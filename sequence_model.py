@@ -0,0 +1,111 @@
+from packed_sequence import PackedSequence
+
+# --- Change Event Kinds ---
+INSERTED = "inserted" # start, count: new elements now occupy [start, start + count)
+REMOVED = "removed"   # start, count: elements [start, start + count) were removed
+REPLACED = "replaced" # start, count: elements [start, start + count) changed in place
+RESET = "reset"       # start=0, count=new length: the whole sequence was replaced
+COMPACTED = "compacted" # start=first removed index, count=elements removed: the runs in
+                        # SequenceModel.removed_runs were removed in one batch
+
+def kept_ranges(runs, length):
+    """
+    Yields the [start, stop) ranges of old indices that survive removing runs (ascending
+    (start, count) pairs) from a sequence of the given old length, so a listener can compact
+    its own per-element data in one pass.
+    """
+    kept = 0
+    for start, count in runs:
+        if kept < start:
+            yield kept, start
+        kept = start + count
+    if kept < length:
+        yield kept, length
+
+class SequenceModel:
+    """
+    Melody sequence (ints for notes, lists for chords, [] for rests) that tells its listeners
+    exactly which range changed, so views and the compiled program can patch only those rows.
+    Listeners are called as listener(kind, start, count) after the change has been applied.
+    The elements are stored in a PackedSequence; reads return its ElementView objects.
+    """
+    def __init__(self, items=None):
+        self._items = _packed(items)
+        self._listeners = []
+        self.removed_runs = [] # (start, count) runs of the last batch removal, ascending, in old indices
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def _emit(self, kind, start, count):
+        for listener in self._listeners:
+            listener(kind, start, count)
+
+    # --- Read access (list compatible) ---
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def to_list(self):
+        return self._items.to_list()
+
+    @property
+    def packed(self):
+        """The underlying PackedSequence (read only; mutate through the model so listeners are told)."""
+        return self._items
+
+    # --- Mutations ---
+    def append(self, item):
+        self._items.append(item)
+        self._emit(INSERTED, len(self._items) - 1, 1)
+
+    def insert(self, index, items):
+        count = self._items.insert(index, items)
+        if count:
+            self._emit(INSERTED, index, count)
+
+    def replace(self, index, item):
+        self._items.replace(index, item)
+        self._emit(REPLACED, index, 1)
+
+    def remove_indices(self, indices):
+        """
+        Removes a batch of (possibly unsorted, non-contiguous) indices with one compaction pass.
+        A single contiguous run is reported as REMOVED; several runs as one COMPACTED event, so
+        listeners compact their own data once instead of once per run.
+        """
+        removed = sorted(set(i for i in indices if 0 <= i < len(self._items)))
+        if not removed:
+            return
+        self._items.delete_indices(removed)
+
+        runs = []
+        run_start = previous = removed[0]
+        for index in removed[1:]:
+            if index != previous + 1:
+                runs.append((run_start, previous - run_start + 1))
+                run_start = index
+            previous = index
+        runs.append((run_start, previous - run_start + 1))
+        self.removed_runs = runs
+        if len(runs) == 1:
+            self._emit(REMOVED, *runs[0])
+        else:
+            self._emit(COMPACTED, removed[0], len(removed))
+
+    def reset(self, items):
+        self._items = _packed(items)
+        self._emit(RESET, 0, len(self._items))
+
+def _packed(items):
+    if isinstance(items, PackedSequence):
+        return items
+    return PackedSequence(items)
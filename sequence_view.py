@@ -0,0 +1,190 @@
+import bisect
+import tkinter as tk
+from itertools import accumulate
+
+from sequence_model import kept_ranges
+
+CURSOR_BACKGROUND = "lightblue" # Row colour of the stepping cursor
+
+class VirtualSequenceList(tk.Frame):
+    """
+    Virtualized list of sequence elements.
+    The Listbox only ever holds the visible window of rows; element text is formatted lazily
+    through format_item(item) and cached (the row number is added when drawing, so the cache
+    survives inserts and deletes), so a 100k-element sequence costs no more to display than a
+    15-element one. The stepping cursor is drawn as a row background, separate from the user's
+    selection, and moving it only touches the old and new rows.
+    """
+    def __init__(self, master, format_item, empty_text="", rows=15, width=60):
+        super().__init__(master)
+        self.format_item = format_item
+        self.empty_text = empty_text
+        self.rows = rows
+
+        self.listbox = tk.Listbox(self, height=rows, width=width, selectmode=tk.EXTENDED,
+                                  activestyle='none', exportselection=False)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.listbox.bind("<MouseWheel>", self._on_mousewheel)
+        self.listbox.bind("<Button-4>", lambda e: self.scroll_by(-3)) # X11 wheel up
+        self.listbox.bind("<Button-5>", lambda e: self.scroll_by(3))  # X11 wheel down
+
+        self._sequence = []
+        self._cache = []      # Display string per element (without row number), None until first shown
+        self.top = 0          # Index of the first visible element
+        self.cursor = -1      # Index of the stepping cursor row, -1 for none
+        self.selected = set() # Selected element indices (may lie outside the window)
+        self._render_pending = False
+
+    # --- Data ---
+    def set_sequence(self, sequence):
+        """Shows a new or fully replaced sequence; cached row texts are dropped."""
+        self._sequence = sequence
+        self._cache = [None] * len(sequence)
+        self.selected.clear()
+        if self.cursor >= len(sequence):
+            self.cursor = -1
+        self.top = min(self.top, self._max_top())
+        self._render()
+
+    def row_text(self, index):
+        text = self._cache[index]
+        if text is None:
+            text = self._cache[index] = self.format_item(self._sequence[index])
+        return f"{index:03d} | {text}"
+
+    def rows_inserted(self, start, count):
+        """Model callback: elements [start, start + count) were inserted."""
+        self._cache[start:start] = [None] * count
+        self.selected = {i + count if i >= start else i for i in self.selected}
+        if self.cursor >= start:
+            self.cursor += count
+        self._refresh_from(start)
+
+    def rows_removed(self, start, count):
+        """Model callback: elements [start, start + count) were removed."""
+        del self._cache[start:start + count]
+        end = start + count
+        self.selected = {i - count if i >= end else i for i in self.selected if not start <= i < end}
+        if start <= self.cursor < end:
+            self.cursor = -1
+        elif self.cursor >= end:
+            self.cursor -= count
+        self.top = min(self.top, self._max_top())
+        self._refresh_from(start)
+
+    def rows_compacted(self, runs):
+        """Model callback: the (start, count) runs (ascending, old indices) were removed in one batch."""
+        self._cache = [text for start, stop in kept_ranges(runs, len(self._cache)) for text in self._cache[start:stop]]
+        run_starts = [start for start, _ in runs]
+        removed_before = list(accumulate(count for _, count in runs))
+
+        def shifted(index):
+            run = bisect.bisect_right(run_starts, index) - 1
+            if run < 0:
+                return index
+            start, count = runs[run]
+            return -1 if index < start + count else index - removed_before[run]
+
+        self.selected = {i for i in map(shifted, self.selected) if i >= 0}
+        self.cursor = shifted(self.cursor) if self.cursor >= 0 else -1
+        self.top = min(self.top, self._max_top())
+        self._refresh_from(runs[0][0])
+
+    def rows_replaced(self, start, count):
+        """Model callback: elements [start, start + count) changed in place; only those rows are redrawn."""
+        for index in range(start, start + count):
+            self._cache[index] = None
+            if self.top <= index < self.top + self.rows:
+                row = index - self.top
+                self.listbox.delete(row)
+                self.listbox.insert(row, self.row_text(index))
+                if index in self.selected:
+                    self.listbox.select_set(row)
+                if index == self.cursor:
+                    self._paint_row(index, CURSOR_BACKGROUND)
+
+    def _refresh_from(self, start):
+        """
+        Redraws the window if rows at or after start are visible, otherwise just the scrollbar.
+        The redraw runs once at idle time, so a batch of change events costs a single redraw.
+        """
+        if start < self.top + self.rows or len(self._sequence) <= self.rows:
+            if not self._render_pending:
+                self._render_pending = True
+                self.after_idle(self._render)
+        else:
+            count = len(self._sequence)
+            self.scrollbar.set(self.top / count, min(self.top + self.rows, count) / count)
+
+    def curselection(self):
+        """Returns the selected element indices in ascending order."""
+        return sorted(self.selected)
+
+    # --- Cursor ---
+    def highlight(self, index):
+        """Moves the stepping cursor, scrolling only if the row is outside the visible window."""
+        old = self.cursor
+        self.cursor = index
+        if not (0 <= index < len(self._sequence)):
+            self._paint_row(old, "")
+            return
+        if not (self.top <= index < self.top + self.rows):
+            # Keep the cursor roughly a third from the top so upcoming rows stay visible
+            self.scroll_to(index - self.rows // 3)
+            return
+        self._paint_row(old, "")
+        self._paint_row(index, CURSOR_BACKGROUND)
+
+    # --- Scrolling ---
+    def _max_top(self):
+        return max(0, len(self._sequence) - self.rows)
+
+    def scroll_to(self, top):
+        self.top = max(0, min(top, self._max_top()))
+        self._render()
+
+    def scroll_by(self, delta):
+        self.scroll_to(self.top + delta)
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == tk.MOVETO:
+            self.scroll_to(int(float(amount) * len(self._sequence)))
+        elif action == tk.SCROLL:
+            step = self.rows if unit == tk.PAGES else 1
+            self.scroll_by(int(amount) * step)
+
+    def _on_mousewheel(self, event):
+        self.scroll_by(-3 if event.delta > 0 else 3)
+        return "break"
+
+    # --- Rendering ---
+    def _paint_row(self, index, colour):
+        if self.top <= index < self.top + self.rows and index < len(self._sequence):
+            self.listbox.itemconfig(index - self.top, background=colour)
+
+    def _on_select(self, event=None):
+        visible = range(self.top, min(self.top + self.rows, len(self._sequence)))
+        self.selected.difference_update(visible)
+        self.selected.update(self.top + row for row in self.listbox.curselection())
+
+    def _render(self):
+        """Redraws the visible window only (at most `rows` rows)."""
+        self._render_pending = False
+        self.listbox.delete(0, tk.END)
+        count = len(self._sequence)
+        if not count:
+            if self.empty_text:
+                self.listbox.insert(tk.END, self.empty_text)
+            self.scrollbar.set(0.0, 1.0)
+            return
+        end = min(self.top + self.rows, count)
+        self.listbox.insert(tk.END, *(self.row_text(i) for i in range(self.top, end)))
+        for index in self.selected:
+            if self.top <= index < end:
+                self.listbox.select_set(index - self.top)
+        self._paint_row(self.cursor, CURSOR_BACKGROUND)
+        self.scrollbar.set(self.top / count, end / count)
@@ -0,0 +1,228 @@
+import threading
+import time
+
+from midi_output import BUFFER_CACHE_LIMIT, NOTE_ON_STATUS, NOTE_OFF_STATUS, LatencyRing, NoteState
+from packed_sequence import PackedSequence, item_notes as element_notes
+
+# --- Compiled Step Program ---
+STEP_CACHE_LIMIT = BUFFER_CACHE_LIMIT
+_step_cache = {} # (note-on status, velocity, notes) -> shared (note-on, note-off) buffer pair
+
+def _compile_step(on_status, off_status, velocity, notes):
+    key = (on_status, velocity, notes)
+    step = _step_cache.get(key)
+    if step is None:
+        for note in notes:
+            if not (0 <= note <= 127):
+                raise ValueError(f"MIDI note {note} out of range 0-127.")
+        step = (bytes(b for note in notes for b in (on_status, note, velocity)),
+                bytes(b for note in notes for b in (off_status, note, 0)))
+        if len(_step_cache) >= STEP_CACHE_LIMIT:
+            _step_cache.clear()
+        _step_cache[key] = step
+    return step
+
+def compile_sequence(sequence, channel, velocity):
+    """
+    Compiles a melody sequence into raw MIDI byte buffers.
+    Every element becomes a note-on buffer and its matching note-off buffer, so stepping is an
+    index lookup plus a send, with no per-keypress message building or validation.
+    Buffer pairs are interned per distinct chord: a melody repeats a small set of chords, so the
+    program is one shared pair reference per element rather than two fresh bytes objects.
+    """
+    if isinstance(sequence, PackedSequence):
+        pitches = sequence.pitches.tolist()
+        offsets = sequence.offsets
+        all_notes = (tuple(pitches[start:end]) for start, end in zip(offsets, offsets[1:]))
+    else:
+        all_notes = (tuple(element_notes(item)) for item in sequence)
+    on_status = NOTE_ON_STATUS | channel
+    off_status = NOTE_OFF_STATUS | channel
+    return [_compile_step(on_status, off_status, velocity, notes) for notes in all_notes]
+
+def prepare_program(port, program):
+    """Lets the output backend pre-decode every distinct buffer of the program before stepping starts."""
+    port.prepare(buf for step in set(program) for buf in step)
+
+
+# --- Lock-free Single-Producer/Single-Consumer Ring ---
+class SpscRing:
+    """
+    Bounded single-producer/single-consumer ring buffer.
+    Only the producer advances head and only the consumer advances tail; each is a single
+    attribute store (atomic under the GIL), so neither side ever takes a lock.
+    """
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._head = 0 # Next slot to write (producer only)
+        self._tail = 0 # Next slot to read (consumer only)
+
+    def push(self, item):
+        """Producer side. Returns False (and drops the item) when the ring is full."""
+        head = self._head
+        if head - self._tail >= self.capacity:
+            return False
+        self._slots[head % self.capacity] = item
+        self._head = head + 1
+        return True
+
+    def pop(self):
+        """Consumer side. Returns the oldest item, or None when the ring is empty."""
+        tail = self._tail
+        if tail == self._head:
+            return None
+        index = tail % self.capacity
+        item = self._slots[index]
+        self._slots[index] = None
+        self._tail = tail + 1
+        return item
+
+
+# --- Control Commands (Tk thread -> sender thread) ---
+CMD_LOAD = 0     # arg: compiled program
+CMD_SEEK = 1     # arg: sequence index to play next
+CMD_PROGRAM = 2  # arg: MIDI program number
+CMD_STOP = 3     # arg: None
+
+class StepEngine:
+    """
+    Keyboard stepping engine. A dedicated sender thread owns the MIDI port, the step cursor
+    and the sounding note state. Key presses arrive from the pynput listener thread through
+    one SPSC ring, control commands from the Tk thread through another, so the listener
+    callback only pushes a timestamp and stopping is a message instead of a cross-thread close.
+    """
+    def __init__(self, port, program, channel):
+        self.port = port
+        self.channel = channel
+        # Latest step as (step_count, index, is_rest), replaced by one atomic store per step.
+        # The GUI polls it at a fixed rate, so intermediate steps are simply never drawn.
+        self.last_step = (0, -1, False)
+        self.press_latency = LatencyRing()     # Listener callback entry -> last note-on send finished
+        self.note_off_latency = LatencyRing()  # Listener callback entry -> previous element's note-offs sent
+        self.dropped_presses = 0
+
+        # Sender-thread state
+        self._program = program
+        self._cursor = 0
+        self._pending_note_off = b""
+        self.note_state = NoteState()
+
+        self._presses = SpscRing()   # Producer: keyboard listener thread
+        self._control = SpscRing()   # Producer: Tk main thread
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="midi-sender", daemon=True)
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def start(self):
+        prepare_program(self.port, self._program)
+        self._thread.start()
+
+    # --- Listener thread API ---
+    def press(self, start_ns):
+        """Queues one step; start_ns is the perf_counter_ns taken when the key callback started."""
+        if not self._presses.push(start_ns):
+            self.dropped_presses += 1
+            return
+        self._wakeup.set()
+
+    # --- Tk thread API ---
+    def _command(self, command, arg=None):
+        """
+        Queues a control command, waiting while the ring is full. Returns False (the command is
+        dropped) when the sender thread is gone, e.g. after a backend error, instead of waiting forever.
+        """
+        while not self._control.push((command, arg)):
+            if not self.running:
+                return False
+            self._wakeup.set()
+            time.sleep(0.001)
+        self._wakeup.set()
+        return True
+
+    def load_program(self, program, new_steps=None):
+        """Swaps in a new compiled program. new_steps: the only steps the backend has not seen yet (default: all)."""
+        self._command(CMD_LOAD, (program, program if new_steps is None else new_steps))
+
+    def seek(self, index):
+        self._command(CMD_SEEK, index)
+
+    def set_program(self, program_number):
+        self._command(CMD_PROGRAM, program_number)
+
+    def stop(self, timeout=1.0):
+        """Asks the sender thread to silence the current notes and close the port, then waits for it."""
+        if self.running:
+            self._command(CMD_STOP)
+            self._thread.join(timeout)
+
+    # --- Sender thread ---
+    def _run(self):
+        try:
+            while True:
+                self._wakeup.clear()
+                command = self._control.pop()
+                if command is not None:
+                    if not self._handle_command(*command):
+                        return
+                    continue
+                start_ns = self._presses.pop()
+                if start_ns is not None:
+                    self._step(start_ns)
+                    continue
+                self._wakeup.wait()
+        finally:
+            self._close_port()
+
+    def _handle_command(self, command, arg):
+        """Runs one control command. Returns False when the sender thread should exit."""
+        if command == CMD_LOAD:
+            program, new_steps = arg
+            prepare_program(self.port, new_steps)
+            self._program = program
+            if self._cursor >= len(program):
+                self._cursor = 0
+        elif command == CMD_SEEK:
+            if self._program:
+                self._cursor = arg % len(self._program)
+        elif command == CMD_PROGRAM:
+            self.port.send_program_change(self.channel, arg)
+            print(f"Sent Program Change to instrument: {arg}")
+        elif command == CMD_STOP:
+            return False
+        return True
+
+    def _step(self, start_ns):
+        program = self._program
+        if not program:
+            return
+        index = self._cursor
+        port = self.port
+        note_state = self.note_state
+        if self._pending_note_off:
+            # A note still held by another sounding element keeps playing: only last releases are sent
+            off_buf = note_state.release(self._pending_note_off)
+            if off_buf:
+                port.send_buffer(off_buf)
+        off_done_ns = time.perf_counter_ns()
+        on_buf, self._pending_note_off = program[index]
+        if on_buf:
+            port.send_buffer(on_buf)
+            note_state.apply(on_buf)
+        end_ns = time.perf_counter_ns()
+        self.note_off_latency.record(off_done_ns - start_ns)
+        self.press_latency.record(end_ns - start_ns)
+
+        self._cursor = (index + 1) % len(program)
+        self.last_step = (self.last_step[0] + 1, index, not on_buf)
+
+    def _close_port(self):
+        if not self.port.closed:
+            print("Stopping all active notes and closing MIDI port...")
+            self.port.all_notes_off(self.note_state)
+            self._pending_note_off = b""
+            self.port.close()
+            print(self.port.latency_report())
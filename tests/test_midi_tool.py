@@ -0,0 +1,56 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import midi_tool
+
+SAMPLE_MIDI = os.path.join(REPO_DIR, "ssssa.mid")
+
+class SeparateFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmp_dir, "lib")
+        self.output_dir = os.path.join(self.input_dir, "separated_midi")
+        os.makedirs(self.input_dir)
+        shutil.copy(SAMPLE_MIDI, self.input_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def separate(self, force=False):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return midi_tool.separate_files([self.input_dir], self.output_dir, force=force)
+
+    def outputs(self):
+        return sorted(name for name in os.listdir(self.output_dir) if name.endswith(".mid"))
+
+    def test_outputs_inside_the_input_directory_are_not_separated_again(self):
+        self.assertEqual(self.separate(), 0)
+        first = self.outputs()
+        self.assertTrue(first)
+        self.assertEqual(self.separate(), 0)
+        self.assertEqual(self.outputs(), first)
+        self.assertEqual(self.separate(force=True), 0)
+        self.assertEqual(self.outputs(), first)
+
+    def test_failed_input_is_skipped_until_it_changes(self):
+        broken = os.path.join(self.input_dir, "broken.mid")
+        with open(broken, 'wb') as f:
+            f.write(b"MThd\0\0\0\6\0\1\0\1\1\xe0MTrk\0\0\0\x10\0\xff")
+        self.assertEqual(self.separate(), 1)
+        manifest = midi_tool.BuildManifest(self.output_dir)
+        self.assertTrue(manifest.error(broken))
+        self.assertTrue(manifest.is_current(broken, {"command": "separate"}))
+        with open(broken, 'ab') as f:
+            f.write(b"\0")
+        self.assertFalse(midi_tool.BuildManifest(self.output_dir).is_current(broken, {"command": "separate"}))
+
+if __name__ == "__main__":
+    unittest.main()